@@ -0,0 +1,181 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import Response, request
+from metrics import record_rejection
+
+
+WRITE_METHODS = frozenset(('POST', 'PUT', 'PATCH', 'DELETE'))
+
+# Settings of every namespace, overridden per namespace with ADMISSION_<NAMESPACE>_<SETTING>.
+# 0 turns a limit off.
+DEFAULT_LIMITS = {
+	'CONCURRENCY': 0,
+	'MAX_POOL_WAIT': 1.0,
+	'RETRY_AFTER': 1,
+}
+
+# The analytics queries are the expensive ones, so fewer of them run at once
+NAMESPACE_DEFAULTS = {
+	'analytics': {'CONCURRENCY': 2},
+}
+
+
+# Settings of the write limit, from ADMISSION_<SETTING>. It is shared by the namespaces: each user
+# has one bucket for all their writes, with WRITE_RATE writes per second. 0 turns it off.
+WRITE_LIMITS = {
+	'WRITE_RATE': 10.0,
+	'WRITE_BURST': 20,
+}
+
+
+def namespace_limits(name):
+	"""
+	Returns the admission settings of a namespace from ADMISSION_<NAMESPACE>_<SETTING>,
+	falling back to ADMISSION_<SETTING> and the defaults.
+	"""
+	limits = dict(DEFAULT_LIMITS, **NAMESPACE_DEFAULTS.get(name, {}))
+	for key, default in limits.items():
+		value = os.getenv(f'ADMISSION_{name.upper()}_{key}', os.getenv(f'ADMISSION_{key}'))
+		if value is not None:
+			limits[key] = type(default)(value)
+	return limits
+
+
+def write_rate_limiter():
+	"""
+	Returns the rate limiter of writes shared by every namespace, or None if WRITE_RATE is 0.
+	"""
+	limits = dict(WRITE_LIMITS)
+	for key, default in limits.items():
+		value = os.getenv(f'ADMISSION_{key}')
+		if value is not None:
+			limits[key] = type(default)(value)
+	return RateLimiter(limits['WRITE_RATE'], limits['WRITE_BURST']) if limits['WRITE_RATE'] > 0 else None
+
+
+class RateLimiter:
+	"""
+	A token bucket per key: each holds up to burst tokens and refills at rate tokens per second.
+	At most maxsize buckets are kept, the least recently used is dropped and starts full again.
+	"""
+
+	def __init__(self, rate, burst, maxsize=10000):
+		self.rate = rate
+		self.burst = burst
+		self.maxsize = maxsize
+		self._buckets = OrderedDict()
+		self._lock = threading.Lock()
+
+	def acquire(self, key, cost=1):
+		"""
+		Takes cost tokens from the bucket of key. Returns 0 if at least one token was available,
+		otherwise the seconds until the next one. An admitted cost above the tokens left is still
+		charged in full, so the bucket goes into debt and the next requests wait for it.
+		"""
+		now = time.monotonic()
+		with self._lock:
+			tokens, updated = self._buckets.pop(key, (self.burst, now))
+			tokens = min(self.burst, tokens + (now - updated) * self.rate)
+			wait = 0.0
+			if tokens >= 1:
+				tokens -= cost
+			else:
+				wait = (1 - tokens) / self.rate
+			self._buckets[key] = (tokens, now)
+			while len(self._buckets) > self.maxsize:
+				self._buckets.popitem(last=False)
+		return wait
+
+	def clear(self):
+		with self._lock:
+			self._buckets.clear()
+
+
+class ConcurrencyLimiter:
+	"""
+	Admits at most limit requests at a time. A request over the limit is rejected rather than queued,
+	so it does not hold a worker thread while it waits.
+	"""
+
+	def __init__(self, limit):
+		self.limit = limit
+		self._semaphore = threading.BoundedSemaphore(limit)
+
+	def acquire(self):
+		return self._semaphore.acquire(blocking=False)
+
+	def release(self):
+		self._semaphore.release()
+
+
+def _reject(namespace, reason, status, message, retry_after):
+	record_rejection(namespace, reason)
+	body = json.dumps({'message': message})
+	return Response(body, status, {'Retry-After': str(max(1, math.ceil(retry_after)))}, mimetype='application/json')
+
+
+class AdmissionControl:
+	"""
+	Decorator admitting the requests of a namespace, for its decorators list.
+	In order, a request is turned away with:
+	- 503 if checkouts of the connection pool wait longer than MAX_POOL_WAIT seconds, so requests
+	  fail fast instead of piling up on the pool until they time out,
+	- 429 if the user made more writes than rate_limiter allows, a RateLimiter that may be shared with
+	  other namespaces,
+	- 503 if CONCURRENCY requests of the namespace are running already.
+	Every rejection carries Retry-After. pool_wait returns the current checkout wait in seconds.
+	write_cost returns the number of writes the current request makes, 1 if not given.
+	"""
+
+	def __init__(self, namespace, pool_wait, rate_limiter=None, write_cost=None, limits=None):
+		self.namespace = namespace
+		self.pool_wait = pool_wait
+		self.limits = limits or namespace_limits(namespace)
+		self.rate_limiter = rate_limiter
+		self.write_cost = write_cost
+		self.concurrency = ConcurrencyLimiter(self.limits['CONCURRENCY']) if self.limits['CONCURRENCY'] > 0 else None
+
+	def reset(self):
+		"""
+		Refills every user's bucket, e.g. between tests.
+		"""
+		if self.rate_limiter is not None:
+			self.rate_limiter.clear()
+
+	def _check(self):
+		# Returns the rejection of the request, or None to admit it
+		retry_after = self.limits['RETRY_AFTER']
+		if self.limits['MAX_POOL_WAIT'] > 0 and self.pool_wait() > self.limits['MAX_POOL_WAIT']:
+			return _reject(self.namespace, 'pool_wait', 503, "The database is overloaded, retry later", retry_after)
+
+		if self.rate_limiter is not None and request.method in WRITE_METHODS:
+			# Authentication runs later, an unauthenticated request is limited by its address
+			key = request.headers.get('X-User-ID') or request.remote_addr
+			wait = self.rate_limiter.acquire(key, self.write_cost() if self.write_cost else 1)
+			if wait:
+				return _reject(self.namespace, 'write_rate', 429, "Too many writes, retry later", wait)
+		return None
+
+	def __call__(self, func):
+		@wraps(func)
+		def wrapper(*args, **kwargs):
+			rejection = self._check()
+			if rejection is not None:
+				return rejection
+
+			if self.concurrency is None:
+				return func(*args, **kwargs)
+			if not self.concurrency.acquire():
+				return _reject(self.namespace, 'concurrency', 503, "Too many requests in progress, retry later",
+				               self.limits['RETRY_AFTER'])
+			try:
+				return func(*args, **kwargs)
+			finally:
+				self.concurrency.release()
+
+		return wrapper
@@ -1,4 +1,12 @@
-from models import db, Workout, Set
+from collections import deque
+from datetime import timedelta
+import numpy as np
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.exc import IntegrityError
+from models import db, Workout, Set, PersonalRecord, RepRecord
+from volume import week_start
+from replica import use_primary
+from upsert import upsert
 
 
 def calculate_one_rep_max(weight, reps):
@@ -11,30 +19,417 @@ def calculate_one_rep_max(weight, reps):
 	return None
 
 
-def find_pr(sets):
+# Vectorized 1RM formulas, each taking NumPy arrays of weights and reps
+ONE_REP_MAX_FORMULAS = {
+	'epley': lambda w, r: w * (1 + r / 30),
+	'brzycki': lambda w, r: w * 36 / (37 - r),
+	'lombardi': lambda w, r: w * np.power(r, 0.10),
+	'mayhew': lambda w, r: 100 * w / (52.2 + 41.9 * np.exp(-0.055 * r)),
+	'oconner': lambda w, r: w * (1 + r / 40),
+}
+
+
+def calculate_one_rep_max_batch(weights, reps, formula='epley'):
 	"""
-	Finds the personal record (PR) for an exercise from a list of sets.
+	Calculates the 1RM for whole columns of weights and reps in one vectorized pass.
+	Returns a list with None wherever the 1RM is undefined (missing values, no reps,
+	or reps outside the range of the formula).
 	"""
-	pr_weight = 0.0
-	pr_set_id = None
+	w = np.asarray(weights, dtype=float)
+	r = np.asarray(reps, dtype=float)
 
-	for s in sets:
-		if s.weight is not None and s.weight > pr_weight:
-			pr_weight = s.weight
-			pr_set_id = s.id
+	with np.errstate(divide='ignore', invalid='ignore'):
+		one_rep_max = ONE_REP_MAX_FORMULAS[formula](w, r)
+		valid = (r > 0) & np.isfinite(one_rep_max) & (one_rep_max > 0)
 
-	return {
-		'max_weight_set_id': pr_set_id,
-		'max_weight': pr_weight
-	}
+	one_rep_max = np.round(one_rep_max, 2)
+	return [float(v) if ok else None for v, ok in zip(one_rep_max.tolist(), valid.tolist())]
 
 
-def get_sets_for_exercise_and_user(user_id, exercise_id):
+def query_sets_for_exercise_and_user(user_id, exercise_id):
 	"""
-	Retrieves all sets for a specific exercise and user.
+	Builds the query for all sets of a specific exercise and user.
 	"""
-	sets = db.session.query(Set).join(Workout).filter(
+	return db.session.query(Set).join(Workout).filter(
 		Workout.user_id == user_id,
 		Set.exercise_id == exercise_id
-	).all()
-	return sets
+	)
+
+
+def get_one_rep_max_series(query, formula='epley'):
+	"""
+	Calculates the 1RM of every set returned by a query of (id, workout_date, weight, reps) rows.
+	"""
+	rows = query.all()
+	one_rep_maxes = calculate_one_rep_max_batch([row.weight for row in rows], [row.reps for row in rows], formula)
+
+	return [
+		{
+			'set_id': row.id,
+			'workout_date': row.workout_date,
+			'weight': row.weight,
+			'reps': row.reps,
+			'one_rep_max': one_rep_max
+		}
+		for row, one_rep_max in zip(rows, one_rep_maxes)
+	]
+
+
+def query_weekly_bests(user_id, exercise_id):
+	"""
+	Builds the query for the heaviest weight per week and rep count of a user's exercise, oldest first.
+	Every 1RM formula grows with the weight at a fixed rep count, so the best 1RM of a week is
+	among these rows whatever the formula, and a multi-year history comes back as a few hundred rows.
+	"""
+	week = week_start(Workout.workout_date).label('week_start')
+	return query_sets_for_exercise_and_user(user_id, exercise_id) \
+		.with_entities(week, Set.reps, func.max(Set.weight).label('weight')) \
+		.filter(Set.weight > 0, Set.reps > 0) \
+		.group_by(week, Set.reps) \
+		.order_by(week)
+
+
+def get_trend(rows, formula='epley', window=4, plateau_weeks=6):
+	"""
+	Computes the progression of an exercise in one pass over the rows of query_weekly_bests.
+	For every calendar week from the first to the last trained one it returns the best 1RM of
+	the week, the rolling best over the last window weeks and its change per week. The exercise
+	is on a plateau when its all-time best 1RM is plateau_weeks or more weeks old.
+	"""
+	rows = list(rows)
+	one_rep_maxes = calculate_one_rep_max_batch([row.weight for row in rows], [row.reps for row in rows], formula)
+
+	# Best 1RM per week
+	weekly = {}
+	for row, one_rep_max in zip(rows, one_rep_maxes):
+		if one_rep_max is not None and one_rep_max > weekly.get(row.week_start, 0):
+			weekly[row.week_start] = one_rep_max
+
+	result = {'formula': formula, 'window_weeks': window, 'current_best': None, 'change_per_week': None,
+	          'best_one_rep_max': None, 'best_week_start': None, 'weeks_since_best': None,
+	          'plateau': False, 'weeks': []}
+	if not weekly:
+		return result
+
+	first, last = min(weekly), max(weekly)
+	candidates = deque()  # (index, best) of the weeks that can still be the rolling maximum
+	rolling = []
+	best, best_index = None, None
+	for index in range((last - first).days // 7 + 1):
+		week = first + timedelta(weeks=index)
+		week_best = weekly.get(week)
+
+		if week_best is not None:
+			while candidates and candidates[-1][1] <= week_best:
+				candidates.pop()
+			candidates.append((index, week_best))
+			if best is None or week_best > best:
+				best, best_index = week_best, index
+		while candidates and candidates[0][0] <= index - window:
+			candidates.popleft()
+
+		rolling.append(candidates[0][1] if candidates else None)
+		previous = rolling[index - window] if index >= window else None
+		change = round((rolling[index] - previous) / window, 2) \
+			if rolling[index] is not None and previous is not None else None
+
+		result['weeks'].append({
+			'week_start': week,
+			'best_one_rep_max': week_best,
+			'rolling_best': rolling[index],
+			'change_per_week': change
+		})
+
+	current = result['weeks'][-1]
+	weeks_since_best = len(result['weeks']) - 1 - best_index
+	result.update({
+		'current_best': current['rolling_best'],
+		'change_per_week': current['change_per_week'],
+		'best_one_rep_max': best,
+		'best_week_start': first + timedelta(weeks=best_index),
+		'weeks_since_best': weeks_since_best,
+		'plateau': weeks_since_best >= plateau_weeks
+	})
+	return result
+
+
+def find_pr(user_id, exercise_id, lock=False):
+	"""
+	Finds the personal record (PR) for a user's exercise.
+	Each value is one ORDER BY ... LIMIT 1 query answered from the
+	ix_workout_user_date and ix_set_exercise_workout_weight indexes.
+	With lock the sets are read with a locking read, which sees sets committed meanwhile.
+	"""
+	sets = query_sets_for_exercise_and_user(user_id, exercise_id) \
+		.with_entities(Set.id, Set.weight, Set.reps) \
+		.filter(Set.weight > 0)
+	if lock:
+		sets = sets.with_for_update(read=True)
+
+	heaviest = sets.order_by(Set.weight.desc(), Set.id).first()
+
+	# Epley formula, as in calculate_one_rep_max
+	one_rep_max = Set.weight * (1 + Set.reps / 30.0)
+	strongest = sets.filter(Set.reps > 0).order_by(one_rep_max.desc(), Set.id).first()
+
+	return {
+		'max_weight_set_id': heaviest.id if heaviest else None,
+		'max_weight': heaviest.weight if heaviest else 0.0,
+		'best_one_rep_max_set_id': strongest.id if strongest else None,
+		'best_one_rep_max': calculate_one_rep_max(strongest.weight, strongest.reps) if strongest else None
+	}
+
+
+def find_rep_records(user_id, exercise_id, lock=False):
+	"""
+	Finds the set with the most reps at each weight for a user's exercise, using a window function.
+	"""
+	rank = func.row_number().over(
+		partition_by=func.round(Set.weight, 2),
+		order_by=(Set.reps.desc(), Set.id)
+	)
+	ranked = query_sets_for_exercise_and_user(user_id, exercise_id) \
+		.with_entities(Set.id, Set.weight, Set.reps, rank.label('rn')) \
+		.filter(Set.weight.isnot(None), Set.reps > 0)
+	if lock:
+		ranked = ranked.with_for_update(read=True)
+	ranked = ranked.subquery()
+
+	return db.session.query(ranked.c.id, ranked.c.weight, ranked.c.reps).filter(ranked.c.rn == 1).all()
+
+
+def rep_record_weight(weight):
+	"""
+	Normalizes a set weight into the weight key of the rep_record table.
+	"""
+	return round(weight, 2)
+
+
+def _rep_records(rows):
+	# The set with the most reps per weight key, keyed in Python as well, in case SQL and Python
+	# round a weight differently
+	best = {}
+	for row in rows:
+		key = rep_record_weight(row.weight)
+		if key not in best or row.reps > best[key].reps:
+			best[key] = row
+	return best
+
+
+def _improve_personal_record(record, set_record):
+	"""
+	Raises the max weight and best 1RM of a record if the set beats them.
+	"""
+	if set_record.weight is None:
+		return
+
+	if set_record.weight > record.max_weight:
+		record.max_weight = set_record.weight
+		record.max_weight_set_id = set_record.id
+
+	one_rep_max = calculate_one_rep_max(set_record.weight, set_record.reps)
+	if one_rep_max is not None and (record.best_one_rep_max is None or one_rep_max > record.best_one_rep_max):
+		record.best_one_rep_max = one_rep_max
+		record.best_one_rep_max_set_id = set_record.id
+
+
+def _improve_rep_record(rep_record, set_record):
+	"""
+	Raises a rep record if the set, of the same weight, beats it.
+	"""
+	if set_record.reps > rep_record.reps:
+		rep_record.reps = set_record.reps
+		rep_record.set_id = set_record.id
+
+
+def _counts_for_rep_record(weight, reps):
+	return weight is not None and reps is not None and reps > 0
+
+
+def _locked_record(user_id, exercise_id):
+	# Locked until the transaction ends, so concurrent writes to one exercise do not lose a record.
+	# Loaded again even if the session has it, the lock must come with the latest values.
+	return db.session.get(PersonalRecord, (user_id, exercise_id), with_for_update=True, populate_existing=True)
+
+
+def _locked_rep_record(user_id, exercise_id, weight):
+	return db.session.get(RepRecord, (user_id, exercise_id, weight), with_for_update=True, populate_existing=True)
+
+
+def refresh_personal_record(user_id, exercise_id):
+	"""
+	Recomputes the personal record and rep records of a user's exercise from the full set history.
+	"""
+	# Stored records must not be computed from a lagging replica
+	use_primary()
+	db.session.flush()
+
+	record = _locked_record(user_id, exercise_id)
+	if record is None:
+		record = PersonalRecord(user_id=user_id, exercise_id=exercise_id)
+		db.session.add(record)
+	for key, value in find_pr(user_id, exercise_id, lock=True).items():
+		setattr(record, key, value)
+
+	RepRecord.query.filter_by(user_id=user_id, exercise_id=exercise_id).delete()
+	db.session.add_all(RepRecord(user_id=user_id, exercise_id=exercise_id, weight=key, reps=s.reps, set_id=s.id)
+	                   for key, s in _rep_records(find_rep_records(user_id, exercise_id, lock=True)).items())
+
+	return record
+
+
+def get_personal_record(user_id, exercise_id):
+	"""
+	Returns the personal record of a user's exercise and its rep records by weight, with primary-key lookups.
+	An exercise without a stored record, e.g. with history loaded by SQL scripts, gets one computed
+	from the history; it is not stored, a GET does not write.
+	"""
+	record = db.session.get(PersonalRecord, (user_id, exercise_id))
+	if record is not None:
+		rep_records = RepRecord.query.filter_by(user_id=user_id, exercise_id=exercise_id) \
+			.order_by(RepRecord.weight).all()
+		return record, rep_records
+
+	record = PersonalRecord(user_id=user_id, exercise_id=exercise_id, **find_pr(user_id, exercise_id))
+	rep_records = [RepRecord(user_id=user_id, exercise_id=exercise_id, weight=key, reps=s.reps, set_id=s.id)
+	               for key, s in sorted(_rep_records(find_rep_records(user_id, exercise_id)).items())]
+	return record, rep_records
+
+
+def _add_to_records(user_id, exercise_id, record, sets):
+	# Applies new or improved sets to a locked record and locks each rep record they touch once
+	for set_record in sets:
+		_improve_personal_record(record, set_record)
+
+	best = _rep_records(s for s in sets if _counts_for_rep_record(s.weight, s.reps))
+	for weight, set_record in sorted(best.items()):
+		# A weight without a rep record gets it inserted, a locking read of a missing row only
+		# takes a gap lock and would let two requests insert it
+		db.session.execute(upsert(RepRecord, {'user_id': user_id, 'exercise_id': exercise_id, 'weight': weight,
+		                                      'reps': set_record.reps, 'set_id': set_record.id}))
+		_improve_rep_record(_locked_rep_record(user_id, exercise_id, weight), set_record)
+
+
+def add_sets_to_records(user_id, exercise_id, sets):
+	"""
+	Updates the records of a user's exercise with new or improved sets, in the order they were logged.
+	Each record row is locked and written once for all the sets. The sets must be flushed so that they have IDs.
+	"""
+	record = _locked_record(user_id, exercise_id)
+	if record is None:
+		# The first sets of the exercise: the record is computed from the history, which has them.
+		# If another request stores it first, the sets are added to that one instead.
+		try:
+			with db.session.begin_nested():
+				refresh_personal_record(user_id, exercise_id)
+			return
+		except IntegrityError:
+			record = _locked_record(user_id, exercise_id)
+
+	_add_to_records(user_id, exercise_id, record, sets)
+
+
+def add_set_to_records(user_id, set_record):
+	"""
+	Updates the records of a user's exercise with a new set.
+	The set must be flushed so that it has an ID.
+	"""
+	add_sets_to_records(user_id, set_record.exercise_id, [set_record])
+
+
+def change_set_in_records(user_id, set_record, old_weight, old_reps):
+	"""
+	Updates the records of a user's exercise after a set was edited.
+	Recomputes from the history only if the set held a record and was lowered.
+	"""
+	record = _locked_record(user_id, set_record.exercise_id)
+	if record is None:
+		# Not stored, get_personal_record computes it from the history
+		return
+
+	lowered = False
+	if record.max_weight_set_id == set_record.id:
+		lowered |= set_record.weight is None or set_record.weight < old_weight
+	if record.best_one_rep_max_set_id == set_record.id:
+		one_rep_max = calculate_one_rep_max(set_record.weight, set_record.reps)
+		lowered |= one_rep_max is None or one_rep_max < calculate_one_rep_max(old_weight, old_reps)
+	if _counts_for_rep_record(old_weight, old_reps):
+		old_key = rep_record_weight(old_weight)
+		rep_record = _locked_rep_record(user_id, set_record.exercise_id, old_key)
+		if rep_record is not None and rep_record.set_id == set_record.id:
+			lowered |= (not _counts_for_rep_record(set_record.weight, set_record.reps)
+				or rep_record_weight(set_record.weight) != old_key
+				or set_record.reps < old_reps)
+
+	if lowered:
+		refresh_personal_record(user_id, set_record.exercise_id)
+	else:
+		_add_to_records(user_id, set_record.exercise_id, record, [set_record])
+
+
+def remove_sets_from_records(user_id, exercise_id, set_ids):
+	"""
+	Updates the records of a user's exercise after sets were deleted.
+	Recomputes from the history only if one of the deleted sets held a record.
+	"""
+	record = _locked_record(user_id, exercise_id)
+	if record is None:
+		return
+
+	set_ids = set(set_ids)
+	held = {record.max_weight_set_id, record.best_one_rep_max_set_id} & set_ids
+	if not held:
+		held = RepRecord.query.filter(
+			RepRecord.user_id == user_id,
+			RepRecord.exercise_id == exercise_id,
+			RepRecord.set_id.in_(set_ids)
+		).first()
+
+	if held:
+		refresh_personal_record(user_id, exercise_id)
+
+
+def store_all_records(connection):
+	"""
+	Stores the records of every user's exercises, computed from the whole set history with window
+	functions, replacing any stored ones. For the migration that adds the record tables.
+	"""
+	user_sets = select(Workout.user_id, Set.exercise_id, Set.id, Set.weight, Set.reps) \
+		.join(Workout, Set.workout_id == Workout.id)
+
+	def first_per_group(partition_by, order_by, *conditions):
+		rank = func.row_number().over(partition_by=partition_by, order_by=order_by)
+		ranked = user_sets.add_columns(rank.label('rn')).where(*conditions).subquery()
+		return connection.execute(select(ranked).where(ranked.c.rn == 1))
+
+	records = {}
+	pairs = select(Workout.user_id, Set.exercise_id).join(Workout, Set.workout_id == Workout.id).distinct()
+	for user_id, exercise_id in connection.execute(pairs):
+		records[user_id, exercise_id] = {'user_id': user_id, 'exercise_id': exercise_id, 'max_weight': 0.0,
+		                                 'max_weight_set_id': None, 'best_one_rep_max': None,
+		                                 'best_one_rep_max_set_id': None}
+
+	# The same orders as find_pr
+	exercises = (Workout.user_id, Set.exercise_id)
+	for row in first_per_group(exercises, (Set.weight.desc(), Set.id), Set.weight > 0):
+		records[row.user_id, row.exercise_id].update(max_weight=row.weight, max_weight_set_id=row.id)
+	one_rep_max = Set.weight * (1 + Set.reps / 30.0)
+	for row in first_per_group(exercises, (one_rep_max.desc(), Set.id), Set.weight > 0, Set.reps > 0):
+		records[row.user_id, row.exercise_id].update(best_one_rep_max=calculate_one_rep_max(row.weight, row.reps),
+		                                              best_one_rep_max_set_id=row.id)
+
+	rows = first_per_group(exercises + (func.round(Set.weight, 2),), (Set.reps.desc(), Set.id),
+	                       Set.weight.isnot(None), Set.reps > 0)
+	by_exercise = {}
+	for row in rows:
+		by_exercise.setdefault((row.user_id, row.exercise_id), []).append(row)
+	rep_records = [{'user_id': user_id, 'exercise_id': exercise_id, 'weight': key, 'reps': s.reps, 'set_id': s.id}
+	               for (user_id, exercise_id), sets in by_exercise.items()
+	               for key, s in _rep_records(sets).items()]
+
+	connection.execute(delete(RepRecord))
+	connection.execute(delete(PersonalRecord))
+	if records:
+		connection.execute(insert(PersonalRecord), list(records.values()))
+	if rep_records:
+		connection.execute(insert(RepRecord), rep_records)
@@ -1,11 +1,37 @@
 import os
+import io
+import re
+import hashlib
 from dotenv import load_dotenv
-from flask import Flask
-from flask_restx import Api, Resource, fields, reqparse
-from models import db, User, Exercise, Workout, Set, SchemaVersion
+from flask import Flask, request, Response, stream_with_context
+from flask_restx import Api, Resource, fields, reqparse, inputs, marshal
+from flask_restx.utils import unpack
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import load_only, selectinload
+from models import db, User, Exercise, Workout, Set, SchemaVersion, WorkoutSummary
 from datetime import datetime
+from werkzeug.exceptions import HTTPException
 from functools import wraps
-from analytics import calculate_one_rep_max, find_pr, get_sets_for_exercise_and_user
+from analytics import (calculate_one_rep_max, query_sets_for_exercise_and_user, get_personal_record,
+                       add_set_to_records, add_sets_to_records, change_set_in_records, remove_sets_from_records,
+                       get_one_rep_max_series, query_weekly_bests, get_trend, ONE_REP_MAX_FORMULAS)
+from volume import (PERIODS, TOTAL, get_volume, add_set_to_volume, add_sets_to_volume, change_set_in_volume,
+                    remove_sets_from_volume)
+from summary import (build_summaries, compute_summaries, create_summary, add_set_to_summary, add_sets_to_summary,
+                     change_set_in_summary, remove_sets_from_summary)
+from pagination import MAX_PAGE_SIZE, keyset_page, keyset_slice
+from cache import TTLCache, GenerationCounter
+from catalogue import EXERCISES, exercise_catalogue
+from versions import bump_version, stored_versions
+from pool import InstrumentedQueuePool, pool_status
+from admission import AdmissionControl, write_rate_limiter
+from replica import init_replicas, read_only, use_primary
+from serialize import RowSerializer, requested_fields, serialize_list_with
+from metrics import init_metrics, render_metrics
+from compression import init_compression
+from export import EXPORT_FORMATS
+from importer import IMPORT_FORMATS, import_history
 from flask_cors import CORS
 
 
@@ -14,10 +40,10 @@ load_dotenv()
 
 # Initialize Flask and SQLAlchemy
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Next-Cursor'])
+init_metrics(app)
+init_compression(app)
 
-# Configure a simple SQLite database for local testing
-#app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///lifting.db'
 # Get database credentials from environment variables
 db_user = os.getenv('DB_USERNAME')
 db_password = os.getenv('DB_PASSWORD')
@@ -25,10 +51,32 @@ db_host = os.getenv('DB_HOST')
 db_name = os.getenv('DB_NAME')
 
 # Construct the database URI and set it in the app config
-database_uri = f"mysql://{db_user}:{db_password}@{db_host}/{db_name}"
+# DATABASE_URI overrides it, e.g. DATABASE_URI=sqlite:///lifting.db for local testing and benchmarks
+database_uri = os.getenv('DATABASE_URI') or f"mysql://{db_user}:{db_password}@{db_host}/{db_name}"
 app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# Connection pool settings. Recycle connections well before MySQL's wait_timeout
+# and ping them on checkout, so workers never get a connection the server closed.
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'poolclass': InstrumentedQueuePool,
+    'pool_size': int(os.getenv('DB_POOL_SIZE', 10)),
+    'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 10)),
+    'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+    'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+    'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes'),
+}
+# Optional read replicas with the same credentials, e.g. DB_REPLICA_HOSTS=replica1,replica2.
+# DATABASE_REPLICA_URIS overrides them, e.g. sqlite:///replica.db for local testing.
+# Read-only GETs read from a replica that is at most DB_REPLICA_MAX_LAG seconds behind, else from the primary.
+replica_hosts = [host.strip() for host in os.getenv('DB_REPLICA_HOSTS', '').split(',') if host.strip()]
+replica_uris = [uri.strip() for uri in os.getenv('DATABASE_REPLICA_URIS', '').split(',') if uri.strip()] \
+    or [f"mysql://{db_user}:{db_password}@{host}/{db_name}" for host in replica_hosts]
+replica_max_lag = float(os.getenv('DB_REPLICA_MAX_LAG', 5))
+init_replicas(app, replica_uris, max_lag=replica_max_lag,
+              check_interval=float(os.getenv('DB_REPLICA_CHECK_INTERVAL', 5)))
+
 app.config['RESTX_MASK_SWAGGER'] = False  # Allows full API doc in Swagger
 
 # Security definitions for API documentation
@@ -61,51 +109,233 @@ api = Api(app,
           security=['apikey', 'userid'])
 
 
-# Create the database tables
-with app.app_context():
-    db.create_all()
+# The schema is created and upgraded by migrate.py at deploy time, importing the app
+# must not touch the database so that workers start without waiting on it.
 
-# --- Security Decorator ---
-# This parser will extract the user role and ID from the request headers
-auth_parser = reqparse.RequestParser()
-auth_parser.add_argument('X-User-Role', type=str, required=True, location='headers',
-                         help='The role of the authenticated user (admin, user, report)')
-auth_parser.add_argument('X-User-ID', type=int, required=True, location='headers',
-                         help='The ID of the authenticated user')
+# --- User Status Cache ---
+# User rows rarely change, so whether a user exists and is enabled is cached per process.
+# The user write endpoints invalidate their entry; other workers catch up after the TTL.
+user_status_cache = TTLCache(maxsize=int(os.getenv('USER_CACHE_SIZE', 10000)),
+                             ttl=float(os.getenv('USER_CACHE_TTL', 60)))
+
+
+def get_user_status(user_id):
+    """
+    Returns the enabled flag of a user, or None if the user does not exist.
+    """
+    def load():
+        row = db.session.query(User.enabled).filter_by(id=user_id).first()
+        return row.enabled if row else None
 
+    return user_status_cache.get_or_load(user_id, load)
+
+
+def validate_user(user_id):
+    """
+    Aborts with a 404 unless the user exists.
+    """
+    if get_user_status(user_id) is None:
+        api.abort(404, "User not found")
+
+
+def validate_exercise(exercise_id):
+    """
+    Aborts with a 404 unless the exercise exists. Answered from the in-process exercise catalogue,
+    so it needs no database round trip.
+    """
+    exercise = exercise_catalogue.get(exercise_id)
+    if exercise is None:
+        api.abort(404, "Exercise not found")
+    return exercise
 
+
+# --- Security Decorator ---
 def requires_auth(allowed_roles):
     """
     Decorator to protect API routes based on user roles.
-    Checks for the X-User-Role and X-User-ID headers.
+    Checks for the X-User-Role and X-User-ID headers, and that the user exists and is enabled.
     """
 
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
+            # Read the headers directly, a RequestParser is noticeable overhead on every request
+            user_role = request.headers.get('X-User-Role')
             try:
-                args_from_parser = auth_parser.parse_args()
-                user_role = args_from_parser['X-User-Role']
-                authenticated_user_id = args_from_parser['X-User-ID']
+                authenticated_user_id = int(request.headers['X-User-ID'])
+            except (KeyError, ValueError):
+                authenticated_user_id = None
+            if not user_role or authenticated_user_id is None:
+                api.abort(401, "Authentication required: Please provide X-User-Role and X-User-ID headers.")
 
-                # Check if the user role is in the list of allowed roles
-                if user_role not in allowed_roles:
-                    api.abort(403, "Forbidden: You do not have the required permissions.")
+            # Check if the user role is in the list of allowed roles
+            if user_role not in allowed_roles:
+                api.abort(403, "Forbidden: You do not have the required permissions.")
 
-                # If the role is 'user', restrict access to their own data
-                if user_role == 'user':
-                    if 'userID' in kwargs and kwargs['userID'] != authenticated_user_id:
-                        api.abort(403, "Forbidden: Users can only access their own data.")
+            # If the role is 'user', restrict access to their own data
+            if user_role == 'user':
+                if 'userID' in kwargs and kwargs['userID'] != authenticated_user_id:
+                    api.abort(403, "Forbidden: Users can only access their own data.")
 
-                return func(*args, **kwargs)
-            except Exception as e:
-                api.abort(401, "Authentication required: Please provide X-User-Role and X-User-ID headers.")
+            # Reject unknown and disabled users, usually without touching the DB
+            status = get_user_status(authenticated_user_id)
+            if status is None:
+                api.abort(401, "Authentication required: Unknown user.")
+            if not status:
+                api.abort(403, "Forbidden: The user is disabled.")
+
+            # Errors raised by the resource itself (404, 400, ...) must not be turned into a 401
+            return func(*args, **kwargs)
 
         return wrapper
 
     return decorator
 
 
+# --- Response Cache ---
+# Rendered bodies of read endpoints are kept per URL together with the generation of
+# the data they depend on. Write endpoints bump those generations, so an unchanged
+# reload is answered from memory, or with a 304 if the client sends If-None-Match.
+# Generations are version stamps in the cache_version table, so a write in one worker
+# invalidates the entries of every worker.
+response_cache = TTLCache(maxsize=int(os.getenv('RESPONSE_CACHE_SIZE', 1000)),
+                          ttl=float(os.getenv('RESPONSE_CACHE_TTL', 30)))
+
+
+def response_stamp(scope):
+    """
+    Returns the name of the version stamp of a response cache scope.
+    """
+    return f'response:{scope}'
+
+
+def load_generations(scopes):
+    # Read before the resource marks the request read-only, so always from the primary
+    return stored_versions([response_stamp(scope) for scope in scopes])
+
+
+def store_generations(scopes):
+    # Write paths bump before their commit, so the stamps are committed with the data
+    for scope in scopes:
+        bump_version(response_stamp(scope))
+
+
+# The stamps are read at most every RESPONSE_GENERATION_CHECK_INTERVAL seconds, so a write
+# in another worker may be served from this worker's cache for that long
+response_generations = GenerationCounter(
+    load=load_generations, store=store_generations,
+    check_interval=float(os.getenv('RESPONSE_GENERATION_CHECK_INTERVAL', 5)))
+
+
+def cached_response(*scopes):
+    """
+    Decorator caching the marshalled response of a GET resource and answering conditional requests.
+    Scopes are filled in from the route arguments, e.g. 'user:{userID}'.
+    Must be applied below requires_auth so that cached responses are still authorized.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = request.full_path
+            scope_keys = [scope.format(**kwargs) for scope in scopes]
+            generation = response_generations.get(scope_keys)
+
+            entry = response_cache.get(key)
+            if entry is None or entry['generation'] != generation:
+                # A replica may not have this worker's recent writes yet, and the body would be cached
+                if response_generations.seconds_since_bump(scope_keys) < replica_max_lag:
+                    use_primary()
+                result = func(*args, **kwargs)
+                if isinstance(result, Response):
+                    # Already serialized, e.g. by serialize_list_with
+                    rendered, code = result, result.status_code
+                    headers = {k: v for k, v in result.headers.items() if k not in ('Content-Type', 'Content-Length')}
+                else:
+                    data, code, headers = unpack(result)
+                    rendered = api.make_response(data, code, headers=headers)
+                if code != 200:
+                    return rendered
+                body = rendered.get_data()
+                entry = {
+                    'generation': generation,
+                    'etag': hashlib.sha1(body).hexdigest(),
+                    'body': body,
+                    'headers': dict(headers or {})
+                }
+                response_cache.set(key, entry)
+
+            response = Response(entry['body'], 200, entry['headers'], mimetype='application/json')
+            response.set_etag(entry['etag'])
+            # Clients may store the response but must revalidate it
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response.make_conditional(request)
+
+        return wrapper
+
+    return decorator
+
+
+# --- Pagination ---
+# List endpoints accept ?limit=&after= and return the cursor of the next page
+# in the X-Next-Cursor header, so the response body keeps its original shape.
+page_parser = reqparse.RequestParser()
+page_parser.add_argument('limit', type=int, required=False, location='args',
+                         help='Maximum number of items to return')
+page_parser.add_argument('after', type=str, required=False, location='args',
+                         help='Cursor from the X-Next-Cursor header of the previous page')
+
+# Lists serialized from column tuples also accept ?fields=id,workout_date, which limits
+# both the columns selected and the fields returned
+fields_parser = page_parser.copy()
+fields_parser.add_argument('fields', type=str, required=False, location='args',
+                           help='Comma separated fields to return, all by default')
+
+
+def paginate(query, columns, page=keyset_page):
+    """
+    Returns one keyset page of the query as a (items, status, headers) response tuple.
+    With page=keyset_slice, query is a list of rows already sorted by the columns.
+    """
+    args = page_parser.parse_args()
+    try:
+        items, next_cursor = page(query, columns, args['limit'], args['after'])
+    except ValueError as e:
+        api.abort(400, str(e))
+
+    headers = {'X-Next-Cursor': next_cursor} if next_cursor else {}
+    return items, 200, headers
+
+
+# --- Admission Control ---
+# Every namespace but admin turns requests away while the database is saturated, limits the
+# writes of each user and optionally how many of its requests run at once. Each user has one
+# write bucket for every namespace; the other limits are set per namespace with
+# ADMISSION_<NAMESPACE>_<SETTING>, see admission.py.
+def pool_wait():
+    """
+    Returns how long connection checkouts wait right now, the longest over the primary and the replicas.
+    """
+    return max((engine.pool.stats.current_wait() for engine in db.engines.values()
+                if getattr(engine.pool, 'stats', None) is not None), default=0.0)
+
+
+def batch_write_cost():
+    """
+    Returns the number of operations of a batch request, each is charged as one write.
+    """
+    payload = request.get_json(silent=True)
+    operations = payload.get('operations') if isinstance(payload, dict) else None
+    return max(1, len(operations)) if isinstance(operations, list) else 1
+
+
+write_limiter = write_rate_limiter()
+admission = {name: AdmissionControl(name, pool_wait, write_limiter,
+                                    write_cost=batch_write_cost if name == 'batch' else None)
+             for name in ('users', 'exercises', 'workouts', 'sets', 'schema', 'analytics', 'batch')}
+
+
 # --- API Resources ---
 # A model to define the structure of a user in the API docs
 user_model = api.model('User', {
@@ -116,18 +346,24 @@ user_model = api.model('User', {
     'enabled': fields.String(required=True, description='1 - enabled, 0 - disabled'),
 })
 
+user_rows = RowSerializer(user_model, (User.id, User.first_name, User.last_name, User.email, User.enabled))
+
 # Namespace for user endpoints
-ns_users = api.namespace('users', description='User operations')
+ns_users = api.namespace('users', description='User operations', decorators=[admission['users']])
 
 @ns_users.route('/')
 class UserList(Resource):
     @ns_users.doc('list_users')
-    @ns_users.marshal_list_with(user_model)
+    @ns_users.expect(fields_parser)
     @requires_auth(['admin'])
+    @cached_response('users')
+    @read_only
+    @ns_users.response(200, 'Success', [user_model])
+    @serialize_list_with(user_rows)
     def get(self):
         """List all users"""
-        users = User.query.all()
-        return users
+        query = db.session.query(*user_rows.requested().query_columns([User.id]))
+        return paginate(query, [User.id])
 
 # A new namespace to handle single user resources
 @ns_users.route('/<int:id>/enable')
@@ -139,7 +375,9 @@ class UserEnable(Resource):
         """Enable a user by their ID"""
         user = User.query.get_or_404(id)
         user.enabled = 1
+        response_generations.bump('users', f'user:{id}')
         db.session.commit()
+        user_status_cache.invalidate(id)
         return user
 
 @ns_users.route('/<int:id>/disable')
@@ -151,7 +389,9 @@ class UserDisable(Resource):
         """Disable a user by their ID"""
         user = User.query.get_or_404(id)
         user.enabled = 0
+        response_generations.bump('users', f'user:{id}')
         db.session.commit()
+        user_status_cache.invalidate(id)
         return user
 
 # Assuming ns_users and user_model are already defined
@@ -171,7 +411,9 @@ class UserDelete(Resource):
         db.session.delete(user)
         
         # 3. Commit the session to persist the deletion to the database.
+        response_generations.bump('users', f'user:{id}')
         db.session.commit()
+        user_status_cache.invalidate(id)
         
         # 4. Return a 204 No Content response, which is standard for a successful DELETE operation.
         return '', 204
@@ -199,9 +441,86 @@ class UserAdd(Resource):
             enabled=1  # Enabled by default
         )
         db.session.add(new_user)
+        response_generations.bump('users')
         db.session.commit()
+        # A lookup of this ID may have cached "not found"
+        user_status_cache.invalidate(new_user.id)
         return new_user, 201
 
+
+export_parser = reqparse.RequestParser()
+export_parser.add_argument('format', type=str, default='ndjson', location='args',
+                           choices=list(EXPORT_FORMATS),
+                           help='ndjson (one workout with its sets per line) or csv (one set per line)')
+
+
+@ns_users.route('/<int:userID>/export')
+class UserExport(Resource):
+    @ns_users.doc('export_user_history')
+    @ns_users.expect(export_parser)
+    @requires_auth(['admin', 'user', 'report'])
+    @read_only
+    def get(self, userID):
+        """
+        Streams all workouts and sets of a user as NDJSON or CSV.
+        """
+        validate_user(userID)
+        export_format = export_parser.parse_args()['format']
+        generate, mimetype, extension = EXPORT_FORMATS[export_format]
+
+        # The body is generated while it is sent, so memory use does not grow with the history
+        response = Response(stream_with_context(generate(userID)), mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename="user-{userID}-history.{extension}"'
+        return response
+
+
+# Models for the summary of an import
+import_error_model = api.model('ImportError', {
+    'line': fields.Integer(description='The line of the rejected row'),
+    'message': fields.String(description='Why the row was rejected')
+})
+
+import_summary_model = api.model('ImportSummary', {
+    'sets_imported': fields.Integer(description='Sets added to the history'),
+    'duplicates_skipped': fields.Integer(description='Sets that were already in the history'),
+    'workouts_created': fields.Integer(description='Workouts created for new dates'),
+    'rows_rejected': fields.Integer(description='Rows that could not be imported'),
+    'errors': fields.List(fields.Nested(import_error_model), description='The first rejected rows')
+})
+
+import_parser = reqparse.RequestParser()
+import_parser.add_argument('format', type=str, required=False, location='args',
+                           choices=list(IMPORT_FORMATS),
+                           help='csv or ndjson, by default taken from the Content-Type')
+
+
+@ns_users.route('/<int:userID>/import')
+class UserImport(Resource):
+    @ns_users.doc('import_user_history')
+    @ns_users.expect(import_parser)
+    @ns_users.marshal_with(import_summary_model)
+    @requires_auth(['admin', 'user'])
+    def post(self, userID):
+        """
+        Imports workouts and sets from a CSV or NDJSON upload, e.g. a history from another tracker.
+        The formats of the export are accepted. Sets already in the history are skipped.
+        """
+        validate_user(userID)
+
+        # 1. Pick the reader from ?format= or the Content-Type
+        import_format = import_parser.parse_args()['format']
+        if import_format is None:
+            import_format = next((name for name, (_, mimetype) in IMPORT_FORMATS.items()
+                                  if mimetype == request.mimetype), None)
+        if import_format is None:
+            api.abort(415, "Send text/csv or application/x-ndjson, or pass ?format=")
+        read = IMPORT_FORMATS[import_format][0]
+
+        # 2. Read the body as it arrives and import it in chunked transactions
+        stream = io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline='')
+        return import_history(userID, read(stream),
+                              before_commit=lambda: response_generations.bump(f'user:{userID}'))
+
 # A model to define the structure of an exercise in the API docs
 exercise_model = api.model('Exercise', {
     'id': fields.Integer(readOnly=True, description='The exercise unique identifier'),
@@ -210,8 +529,10 @@ exercise_model = api.model('Exercise', {
     'date_started': fields.DateTime(readOnly=True, description='The date the exercise was started'),
 })
 
+exercise_rows = RowSerializer(exercise_model, (Exercise.id, Exercise.name, Exercise.description, Exercise.date_started))
+
 # Namespace for exercise endpoints
-ns_exercises = api.namespace('exercises', description='Exercise operations')
+ns_exercises = api.namespace('exercises', description='Exercise operations', decorators=[admission['exercises']])
 
 # Request parser for adding a new exercise
 exercise_add_parser = reqparse.RequestParser()
@@ -232,16 +553,28 @@ class ExerciseList(Resource):
             description=args['description']
         )
         db.session.add(new_exercise)
+        bump_version(EXERCISES)
+        response_generations.bump('exercises')
         db.session.commit()
+        exercise_catalogue.invalidate()
         return new_exercise, 201
 
     @ns_exercises.doc('list_all_exercises')
-    @ns_exercises.marshal_list_with(exercise_model)
+    @ns_exercises.expect(fields_parser)
     @requires_auth(['admin', 'user', 'report'])
+    @cached_response('exercises')
+    @read_only
+    @ns_exercises.response(200, 'Success', [exercise_model])
+    @serialize_list_with(exercise_rows)
     def get(self):
         """List all exercises"""
-        exercises = Exercise.query.all()
-        return exercises
+        # Served from the exercise catalogue, with only the requested columns of each row. The
+        # response is being rebuilt because the exercises changed, so the catalogue must not wait
+        # for its next check.
+        exercise_catalogue.refresh(force=True)
+        columns = exercise_rows.requested().columns
+        items, code, headers = paginate(exercise_catalogue.all(), [Exercise.id], page=keyset_slice)
+        return [tuple(getattr(row, column.key) for column in columns) for row in items], code, headers
 
 # Assuming ns_exercises is already defined
 @ns_exercises.route('/<int:id>/delete')
@@ -257,10 +590,18 @@ class ExerciseDelete(Resource):
         exercise = Exercise.query.get_or_404(id, description="Exercise not found")
         
         # 2. Delete the exercise from the database session.
+        # Its sets go with it, so every user's cached history is invalidated too,
+        # and the summaries of the workouts they belonged to are built again.
+        workout_ids = db.session.scalars(select(Set.workout_id).where(Set.exercise_id == id).distinct()).all()
         db.session.delete(exercise)
+        db.session.flush()
+        build_summaries(workout_ids)
+        bump_version(EXERCISES)
         
         # 3. Commit the changes to the database.
+        response_generations.bump('exercises')
         db.session.commit()
+        exercise_catalogue.invalidate()
         
         # 4. Return a 204 No Content status, which is the standard response for a successful deletion.
         return '', 204
@@ -273,13 +614,59 @@ workout_model = api.model('Workout', {
     'user_id': fields.Integer(required=True)
 })
 
-ns_workouts = api.namespace('workouts', description='Workout operations')
+# Large lists are serialized from column tuples instead of marshalled ORM objects
+workout_rows = RowSerializer(workout_model, (Workout.id, Workout.workout_date, Workout.comment, Workout.user_id))
+
+# A workout with the totals of its sets, so a workout list needs no sets
+workout_summary_model = api.clone('WorkoutWithSummary', workout_model, {
+    'set_count': fields.Integer(description='Number of sets'),
+    'tonnage': fields.Float(description='Total volume, the sum of weight x reps over all sets'),
+    'exercise_count': fields.Integer(description='Number of distinct exercises'),
+    'top_set_id': fields.Integer(description='ID of the top set: the heaviest, then the one with the most reps'),
+    'top_weight': fields.Float(description='Weight of the top set'),
+    'top_reps': fields.Integer(description='Reps of the top set')
+})
+
+workout_summary_rows = RowSerializer(workout_summary_model, (
+    Workout.id, Workout.workout_date, Workout.comment, Workout.user_id,
+    WorkoutSummary.set_count, WorkoutSummary.tonnage, WorkoutSummary.exercise_count,
+    WorkoutSummary.top_set_id, WorkoutSummary.top_weight, WorkoutSummary.top_reps
+))
+
+ns_workouts = api.namespace('workouts', description='Workout operations', decorators=[admission['workouts']])
 
 # Request parser for adding a new workout
 workout_add_parser = reqparse.RequestParser()
 workout_add_parser.add_argument('workout_date', type=str, required=False, help='Date and time of the workout (YYYY-MM-DD HH:MM:SS)')
 workout_add_parser.add_argument('comment', type=str, required=False, help='A comment about the workout')
 
+def parse_workout_date(value):
+    """
+    Parses an optional workout date, aborting with a 400 unless it is YYYY-MM-DD HH:MM:SS.
+    """
+    if value is None:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        api.abort(400, "Invalid date format. Use YYYY-MM-DD HH:MM:SS")
+
+
+def create_workout(user_id, workout_date, comment):
+    """
+    Adds a workout for an existing user, with its empty summary, and flushes it. The caller commits.
+    """
+    new_workout = Workout(
+        workout_date=workout_date,
+        comment=comment,
+        user_id=user_id
+    )
+    db.session.add(new_workout)
+    db.session.flush()
+    create_summary(new_workout.id)
+    return new_workout
+
+
 @ns_workouts.route('/<int:userID>/add')
 class WorkoutAdd(Resource):
     @ns_workouts.doc('add_workout_for_user')
@@ -290,26 +677,17 @@ class WorkoutAdd(Resource):
         """Creates a new workout for a specific user"""
 
         # 1. Validate the user ID
-        user = User.query.get_or_404(userID, description="User not found")
+        validate_user(userID)
 
         # 2. Parse optional arguments
         args = workout_add_parser.parse_args()
 
         # 3. Handle optional date
-        workout_date = args['workout_date']
-        if workout_date is not None:
-            try:
-                workout_date = datetime.strptime(workout_date, '%Y-%m-%d %H:%M:%S')
-            except ValueError:
-                api.abort(400, "Invalid date format. Use YYYY-MM-DD HH:MM:SS")
+        workout_date = parse_workout_date(args['workout_date'])
 
         # 4. Create and save the new workout
-        new_workout = Workout(
-            workout_date=workout_date,
-            comment=args['comment'],
-            user_id=userID
-        )
-        db.session.add(new_workout)
+        new_workout = create_workout(userID, workout_date, args['comment'])
+        response_generations.bump(f'user:{userID}')
         db.session.commit()
 
         return new_workout, 201
@@ -318,16 +696,33 @@ class WorkoutAdd(Resource):
 @ns_workouts.route('/<int:userID>/get')
 class WorkoutGet(Resource):
     @ns_workouts.doc('get_workouts_for_user')
-    @ns_workouts.marshal_list_with(workout_model)
+    @ns_workouts.expect(fields_parser)
     @requires_auth(['admin', 'user', 'report'])
+    @cached_response('user:{userID}')
+    @read_only
+    @ns_workouts.response(200, 'Success', [workout_summary_model])
+    @serialize_list_with(workout_summary_rows)
     def get(self, userID):
-        """Lists all workouts for a specific user"""
+        """Lists all workouts for a specific user with the totals of their sets, oldest first"""
         # Validate that the user exists
-        User.query.get_or_404(userID, description="User not found")
-
-        # Get all workouts for the specified user ID
-        workouts = Workout.query.filter_by(user_id=userID).all()
-        return workouts
+        validate_user(userID)
+
+        # Get one page of workouts for the specified user ID, joined to their summaries by primary key
+        sort_columns = [Workout.workout_date, Workout.id]
+        query = db.session.query(*workout_summary_rows.requested().query_columns(sort_columns),
+                                 WorkoutSummary.workout_id.label('summary_id')) \
+            .outerjoin(WorkoutSummary, WorkoutSummary.workout_id == Workout.id) \
+            .filter(Workout.user_id == userID)
+        rows, code, headers = paginate(query, sort_columns)
+
+        # Workouts loaded outside the API have no stored summary, theirs are computed without storing them
+        missing = [row.id for row in rows if row.summary_id is None]
+        if missing:
+            computed = compute_summaries(missing)
+            rows = [row if row.summary_id is not None else
+                    tuple(computed[row.id].get(key, value) for key, value in row._mapping.items())
+                    for row in rows]
+        return rows, code, headers
 
 
 @ns_workouts.route('/<int:workoutID>/delete')
@@ -340,13 +735,27 @@ class WorkoutDelete(Resource):
         """Deletes a workout by its ID"""
         # 1. Find the workout by ID, or return 404 if not found
         workout = Workout.query.get_or_404(workoutID, description="Workout not found")
+        user_id, workout_date = workout.user_id, workout.workout_date
+
+        # 2. Remember which sets go away with it, per exercise
+        deleted_rows = db.session.query(Set.id, Set.exercise_id, Set.weight, Set.reps).filter_by(workout_id=workoutID).all()
+        deleted_sets = {}
+        for row in deleted_rows:
+            deleted_sets.setdefault(row.exercise_id, []).append(row.id)
 
-        # 2. Delete the workout and its associated sets
-        # Assuming you have a cascade delete relationship set up on your database model
+        # 3. Delete the workout and its associated sets
+        # The sets are removed by the ON DELETE CASCADE foreign key
         db.session.delete(workout)
+        db.session.flush()
+
+        # 4. Update the personal records the deleted sets may have held
+        for exercise_id, set_ids in deleted_sets.items():
+            remove_sets_from_records(user_id, exercise_id, set_ids)
+        remove_sets_from_volume(user_id, workout_date, deleted_rows)
+        response_generations.bump(f'user:{user_id}')
         db.session.commit()
 
-        # 3. Return a 204 No Content status for a successful deletion
+        # 5. Return a 204 No Content status for a successful deletion
         return '', 204
     
 
@@ -359,7 +768,42 @@ set_model = api.model('Set', {
     'workout_id': fields.Integer(required=True)
 })
 
-ns_sets = api.namespace('sets', description='Set operations')
+set_rows = RowSerializer(set_model, (Set.id, Set.exercise_id, Set.weight, Set.reps, Set.comment, Set.workout_id))
+
+# A workout with its sets nested, so a client can render a workout list in one request
+workout_with_sets_model = api.inherit('WorkoutWithSets', workout_model, {
+    'sets': fields.List(fields.Nested(set_model), description='All sets of the workout')
+})
+
+
+@ns_workouts.route('/<int:userID>/getwithsets')
+class WorkoutGetWithSets(Resource):
+    @ns_workouts.doc('get_workouts_with_sets_for_user')
+    @ns_workouts.expect(fields_parser)
+    @requires_auth(['admin', 'user', 'report'])
+    @cached_response('user:{userID}', 'exercises')
+    @read_only
+    @ns_workouts.response(200, 'Success', [workout_with_sets_model])
+    def get(self, userID):
+        """Lists all workouts for a specific user with their sets, oldest first"""
+        # Validate that the user exists
+        validate_user(userID)
+
+        # Only the requested columns are loaded, and the sets only if they are requested
+        model = workout_with_sets_model.resolved
+        names = requested_fields(workout_with_sets_model) or list(model)
+        sort_columns = [Workout.workout_date, Workout.id]
+        columns = [getattr(Workout, name) for name in names if name != 'sets']
+        query = Workout.query.filter_by(user_id=userID).options(load_only(*columns, *sort_columns))
+        if 'sets' in names:
+            # The sets of the whole page are loaded with a single extra IN query
+            query = query.options(selectinload(Workout.sets))
+
+        items, code, headers = paginate(query, sort_columns)
+        return marshal(items, {name: model[name] for name in names}), code, headers
+
+
+ns_sets = api.namespace('sets', description='Set operations', decorators=[admission['sets']])
 
 set_add_parser = reqparse.RequestParser()
 set_add_parser.add_argument('exercise_id', type=int, required=True, help='ID of the exercise this set belongs to')
@@ -368,6 +812,35 @@ set_add_parser.add_argument('reps', type=int, required=False, help='Number of re
 set_add_parser.add_argument('comment', type=str, required=False, help='A comment about the set')
 
 
+def add_set(workout, exercise_id, weight, reps, comment):
+    """
+    Adds a set to a workout and updates the user's personal records, volume rollups and
+    the workout summary in the same transaction. Aborts with a 404 for an unknown exercise. The caller commits.
+    """
+    exercise = validate_exercise(exercise_id)
+    new_set = Set(
+        exercise_id=exercise.id,  # Use the validated exercise ID
+        weight=weight,
+        reps=reps,
+        comment=comment,
+        workout_id=workout.id  # Use the validated workout ID
+    )
+    db.session.add(new_set)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        # The workout or exercise was deleted meanwhile, e.g. the exercise by another worker
+        # after this one's catalogue was checked
+        db.session.rollback()
+        exercise_catalogue.invalidate()
+        api.abort(404, "Workout or exercise not found")
+
+    add_set_to_records(workout.user_id, new_set)
+    add_set_to_volume(workout.user_id, workout.workout_date, new_set)
+    add_set_to_summary(new_set)
+    return new_set
+
+
 @ns_sets.route('/<int:workoutID>')
 class SetList(Resource):
     @ns_sets.doc('add_set_for_workout')
@@ -383,34 +856,135 @@ class SetList(Resource):
         # 2. Parse the request arguments
         args = set_add_parser.parse_args()
 
-        # 3. Validate the exercise ID
-        exercise_id = args['exercise_id']
-        exercise = Exercise.query.get_or_404(exercise_id, description="Exercise not found")
-
-        # 4. Create and save the new set
-        new_set = Set(
-            exercise_id=exercise.id,  # Use the validated exercise ID
-            weight=args['weight'],
-            reps=args['reps'],
-            comment=args['comment'],
-            workout_id=workout.id  # Use the validated workout ID
-        )
-        db.session.add(new_set)
+        # 3. Validate the exercise, create the set and update the records, rollups and workout summary
+        new_set = add_set(workout, args['exercise_id'], args['weight'], args['reps'], args['comment'])
+        response_generations.bump(f'user:{workout.user_id}')
         db.session.commit()
 
         return new_set, 201
 
     @ns_sets.doc('list_sets_for_workout')
-    @ns_sets.marshal_list_with(set_model)
+    @ns_sets.expect(fields_parser)
+    @ns_sets.response(200, 'Success', [set_model])
     @requires_auth(['admin', 'user'])
+    @serialize_list_with(set_rows)
     def get(self, workoutID):
         """Lists all sets for a specific workout"""
         # Validate that the workout exists
         Workout.query.get_or_404(workoutID, description="Workout not found")
 
-        # Get all sets with the specified workout ID
-        sets = Set.query.filter_by(workout_id=workoutID).all()
-        return sets
+        # Get one page of sets with the specified workout ID
+        query = db.session.query(*set_rows.requested().query_columns([Set.id])) \
+            .filter(Set.workout_id == workoutID)
+        return paginate(query, [Set.id])
+
+
+# Model for the per-item outcome of a bulk set insert
+bulk_set_result_model = api.model('BulkSetResult', {
+    'index': fields.Integer(description='Position of the item in the request'),
+    'status': fields.Integer(description='201 if the set was created, otherwise the error code'),
+    'id': fields.Integer(description='ID of the created set'),
+    'message': fields.String(description='Why the item was rejected')
+})
+
+MAX_BULK_SETS = 1000
+
+
+def validate_bulk_set(item):
+    """
+    Checks the shape of one bulk set item. Returns an error message, or None if it is valid.
+    """
+    if not isinstance(item, dict):
+        return "Each item must be an object"
+    for key in ('workout_id', 'exercise_id'):
+        if not isinstance(item.get(key), int) or isinstance(item.get(key), bool):
+            return f"{key} must be an integer"
+    if item.get('weight') is not None and not isinstance(item['weight'], (int, float)):
+        return "weight must be a number"
+    if item.get('reps') is not None and not isinstance(item['reps'], int):
+        return "reps must be an integer"
+    if item.get('comment') is not None and not isinstance(item['comment'], str):
+        return "comment must be a string"
+    return None
+
+
+@ns_sets.route('/bulk')
+class SetBulkAdd(Resource):
+    @ns_sets.doc('add_sets_in_bulk')
+    @ns_sets.expect([set_model])
+    @ns_sets.marshal_list_with(bulk_set_result_model)
+    @requires_auth(['admin', 'user'])
+    def post(self):
+        """Creates many sets, possibly across several workouts, in a single transaction"""
+        items = api.payload
+        if not isinstance(items, list):
+            api.abort(400, "Expected a JSON array of sets")
+        if len(items) > MAX_BULK_SETS:
+            api.abort(400, f"At most {MAX_BULK_SETS} sets can be added per request")
+
+        # 1. Check the shape of every item
+        results = [{'index': i, 'status': 201, 'id': None, 'message': None} for i in range(len(items))]
+        for result, item in zip(results, items):
+            error = validate_bulk_set(item)
+            if error:
+                result.update(status=400, message=error)
+
+        # 2. Validate all referenced workouts with one query, and the exercises against the catalogue
+        valid = [(result, items[result['index']]) for result in results if result['status'] == 201]
+        workout_ids = {item['workout_id'] for _, item in valid}
+        exercise_ids = {item['exercise_id'] for _, item in valid}
+        known_workouts = {row.id: row for row in db.session.query(Workout.id, Workout.user_id, Workout.workout_date)
+                          .filter(Workout.id.in_(workout_ids))}
+        known_exercises = exercise_catalogue.existing(exercise_ids)
+
+        # 3. Create the sets that passed validation
+        new_sets = []
+        for result, item in valid:
+            if item['workout_id'] not in known_workouts:
+                result.update(status=404, message="Workout not found")
+            elif item['exercise_id'] not in known_exercises:
+                result.update(status=404, message="Exercise not found")
+            else:
+                new_set = Set(
+                    exercise_id=item['exercise_id'],
+                    weight=item.get('weight'),
+                    reps=item.get('reps'),
+                    comment=item.get('comment'),
+                    workout_id=item['workout_id']
+                )
+                new_sets.append((result, new_set))
+
+        # 4. Insert them in one flush and one commit (batched into multi-row INSERTs where
+        # the driver supports it)
+        db.session.add_all([new_set for _, new_set in new_sets])
+        try:
+            db.session.flush()
+        except IntegrityError:
+            # A workout or exercise was deleted meanwhile, e.g. an exercise by another worker
+            # after this one's catalogue was checked
+            db.session.rollback()
+            exercise_catalogue.invalidate()
+            api.abort(409, "A workout or exercise was deleted while the sets were added, retry the request")
+
+        # 5. Update the personal records, volume rollups and workout summaries in the same transaction,
+        # grouped so that each record, rollup and summary row is locked and written once
+        by_exercise, by_user, by_workout = {}, {}, {}
+        for result, new_set in new_sets:
+            workout = known_workouts[new_set.workout_id]
+            by_exercise.setdefault((workout.user_id, new_set.exercise_id), []).append(new_set)
+            by_user.setdefault(workout.user_id, []).append((workout.workout_date, new_set))
+            by_workout.setdefault(new_set.workout_id, []).append(new_set)
+            # Read before the commit expires the sets
+            result['id'] = new_set.id
+        for (user_id, exercise_id), exercise_sets in sorted(by_exercise.items()):
+            add_sets_to_records(user_id, exercise_id, exercise_sets)
+        for user_id, user_sets in sorted(by_user.items()):
+            add_sets_to_volume(user_id, user_sets)
+        for workout_id, workout_sets in sorted(by_workout.items()):
+            add_sets_to_summary(workout_id, workout_sets)
+        response_generations.bump(*(f'user:{user_id}' for user_id in by_user))
+        db.session.commit()
+        return results
 
 
 # Parser for updating a set
@@ -420,6 +994,28 @@ set_update_parser.add_argument('weight', type=float, required=False, help='Weigh
 set_update_parser.add_argument('comment', type=str, required=False, help='A comment about the set')
 
 
+def update_set(set_record, reps, weight, comment):
+    """
+    Changes the given fields of a set, keeping the user's personal records, volume rollups and
+    the workout summary in step. Fields that are None stay as they are. The caller commits.
+    """
+    old_weight, old_reps = set_record.weight, set_record.reps
+
+    if reps is not None:
+        set_record.reps = reps
+    if weight is not None:
+        set_record.weight = weight
+    if comment is not None:
+        set_record.comment = comment
+
+    if (set_record.weight, set_record.reps) != (old_weight, old_reps):
+        db.session.flush()
+        workout = set_record.workout
+        change_set_in_records(workout.user_id, set_record, old_weight, old_reps)
+        change_set_in_volume(workout.user_id, workout.workout_date, set_record, old_weight, old_reps)
+        change_set_in_summary(set_record, old_weight, old_reps)
+
+
 @ns_sets.route('/<int:setID>/update')
 class SetUpdate(Resource):
     @ns_sets.doc('update_set')
@@ -431,16 +1027,30 @@ class SetUpdate(Resource):
         set_record = Set.query.get_or_404(setID, description="Set not found")
         args = set_update_parser.parse_args()
 
-        if args['reps'] is not None:
-            set_record.reps = args['reps']
-        if args['weight'] is not None:
-            set_record.weight = args['weight']
-        if args['comment'] is not None:
-            set_record.comment = args['comment']
-
+        # Keep the user's personal records, volume rollups and workout summary in step with the edited set
+        update_set(set_record, args['reps'], args['weight'], args['comment'])
+        response_generations.bump(f'user:{set_record.workout.user_id}')
         db.session.commit()
         return set_record
 
+def delete_set(set_record):
+    """
+    Deletes a set and updates the personal records it may have held, the volume rollups
+    and the workout summary. Returns the ID of the user. The caller commits.
+    """
+    user_id, exercise_id = set_record.workout.user_id, set_record.exercise_id
+    workout_id, workout_date = set_record.workout_id, set_record.workout.workout_date
+    deleted_row = (set_record.id, exercise_id, set_record.weight, set_record.reps)
+
+    db.session.delete(set_record)
+    db.session.flush()
+
+    remove_sets_from_records(user_id, exercise_id, [deleted_row[0]])
+    remove_sets_from_volume(user_id, workout_date, [deleted_row])
+    remove_sets_from_summary(workout_id, [deleted_row])
+    return user_id
+
+
 # Assuming ns_sets and set_model are already defined
 @ns_sets.route('/<int:setID>/delete')
 class SetDelete(Resource):
@@ -453,10 +1063,11 @@ class SetDelete(Resource):
         # 1. Retrieve the set record by its ID, or return a 404 if it doesn't exist.
         set_record = Set.query.get_or_404(setID, description="Set not found")
         
-        # 2. Delete the set from the database session.
-        db.session.delete(set_record)
-        
+        # 2. Delete the set together with what it contributed to the records, rollups and workout summary.
+        user_id = delete_set(set_record)
+
         # 3. Commit the changes to the database.
+        response_generations.bump(f'user:{user_id}')
         db.session.commit()
         
         # 4. Return a 204 No Content status, which is the standard response for a successful deletion.
@@ -469,7 +1080,8 @@ schema_version_model = api.model('SchemaVersion', {
     'description': fields.String
 })
 
-ns_schema = api.namespace('schema', description='Database schema versioning operations')
+ns_schema = api.namespace('schema', description='Database schema versioning operations',
+                          decorators=[admission['schema']])
 
 schema_version_parser = reqparse.RequestParser()
 schema_version_parser.add_argument('version', type=str, required=True, help='The version string (e.g., "1.0.0")')
@@ -497,7 +1109,8 @@ class SchemaVersionAdd(Resource):
         return new_version, 201
 
 
-ns_analytics = api.namespace('analytics', description='Analytical queries for lifting data')
+ns_analytics = api.namespace('analytics', description='Analytical queries for lifting data',
+                             decorators=[admission['analytics']])
 
 # Model for a single set with calculated 1RM
 analytical_set_model = api.model('AnalyticalSet', {
@@ -508,10 +1121,20 @@ analytical_set_model = api.model('AnalyticalSet', {
     'one_rep_max': fields.Float(description='Calculated one-rep max (1RM) for the set')
 })
 
+# Model for the most reps done at one weight
+rep_record_model = api.model('RepRecord', {
+    'weight': fields.Float(description='The weight lifted'),
+    'reps': fields.Integer(description='The most reps done at this weight'),
+    'set_id': fields.Integer(description='The ID of the set with the most reps')
+})
+
 # Model for the Personal Record (PR)
 pr_model = api.model('PersonalRecord', {
     'max_weight_set_id': fields.Integer(description='The ID of the set with the max weight'),
-    'max_weight': fields.Float(description='The max weight lifted for this exercise')
+    'max_weight': fields.Float(description='The max weight lifted for this exercise'),
+    'best_one_rep_max_set_id': fields.Integer(description='The ID of the set with the best estimated 1RM'),
+    'best_one_rep_max': fields.Float(description='The best estimated 1RM for this exercise'),
+    'rep_records': fields.List(fields.Nested(rep_record_model), description='The most reps done at each weight')
 })
 
 # Model for the overall analytical response
@@ -526,6 +1149,7 @@ user_exercise_analytics_model = api.model('UserExerciseAnalytics', {
 class Set1RM(Resource):
     @ns_analytics.doc('calculate_set_1rm')
     @requires_auth(['admin', 'user', 'report'])
+    @read_only
     def get(self, setID):
         """
         Calculates the 1RM for a single set by its ID.
@@ -542,34 +1166,442 @@ class Set1RM(Resource):
 @ns_analytics.route('/users/<int:userID>/exercises/<int:exerciseID>/findpr')
 class UserExercisePR(Resource):
     @ns_analytics.doc('find_pr_for_user_exercise')
-    @ns_analytics.marshal_with(pr_model)
     @requires_auth(['admin', 'user', 'report'])
+    @cached_response('user:{userID}', 'exercises')
+    @read_only
+    @ns_analytics.marshal_with(pr_model)
     def get(self, userID, exerciseID):
         """
         Finds the personal record for a user's exercise.
         """
-        User.query.get_or_404(userID, description="User not found")
-        Exercise.query.get_or_404(exerciseID, description="Exercise not found")
+        validate_user(userID)
+        validate_exercise(exerciseID)
 
-        sets = get_sets_for_exercise_and_user(userID, exerciseID)
-        return find_pr(sets)
+        # Records are maintained by the set write paths, so this is a primary-key lookup
+        record, rep_records = get_personal_record(userID, exerciseID)
+
+        return {
+            'max_weight_set_id': record.max_weight_set_id,
+            'max_weight': record.max_weight,
+            'best_one_rep_max_set_id': record.best_one_rep_max_set_id,
+            'best_one_rep_max': record.best_one_rep_max,
+            'rep_records': rep_records
+        }
 
 
 @ns_analytics.route('/users/<int:userID>/exercises/<int:exerciseID>/getsets')
 class UserExerciseSets(Resource):
     @ns_analytics.doc('get_sets_for_user_exercise')
-    @ns_analytics.marshal_list_with(set_model)
+    @ns_analytics.expect(fields_parser)
     @requires_auth(['admin', 'user', 'report'])
+    @cached_response('user:{userID}', 'exercises')
+    @read_only
+    @ns_analytics.response(200, 'Success', [set_model])
+    @serialize_list_with(set_rows)
     def get(self, userID, exerciseID):
         """
         Retrieves all sets for a specific user and exercise.
         """
-        User.query.get_or_404(userID, description="User not found")
-        Exercise.query.get_or_404(exerciseID, description="Exercise not found")
+        validate_user(userID)
+        validate_exercise(exerciseID)
+
+        query = query_sets_for_exercise_and_user(userID, exerciseID) \
+            .with_entities(*set_rows.requested().query_columns([Set.id]))
+        return paginate(query, [Set.id])
+
+
+# Model for the estimated 1RM of one set
+one_rep_max_point_model = api.model('OneRepMaxPoint', {
+    'set_id': fields.Integer(description='The ID of the set'),
+    'workout_date': fields.DateTime(description='The date of the workout the set belongs to'),
+    'weight': fields.Float(description='The weight of the set'),
+    'reps': fields.Integer(description='The reps in the set'),
+    'one_rep_max': fields.Float(description='Estimated one-rep max (1RM) for the set')
+})
+
+# Model for a series of estimated 1RMs, oldest first
+one_rep_max_series_model = api.model('OneRepMaxSeries', {
+    'formula': fields.String(description='The formula used for the estimate'),
+    'sets': fields.List(fields.Nested(one_rep_max_point_model))
+})
+
+one_rep_max_parser = reqparse.RequestParser()
+one_rep_max_parser.add_argument('formula', type=str, default='epley', location='args',
+                                choices=list(ONE_REP_MAX_FORMULAS),
+                                help='1RM formula: ' + ', '.join(ONE_REP_MAX_FORMULAS))
+
+set_ids_one_rep_max_parser = one_rep_max_parser.copy()
+set_ids_one_rep_max_parser.add_argument('ids', type=int, action='split', required=True, location='args',
+                                        help='Comma separated set IDs')
+
+# Columns the 1RM series is computed from
+one_rep_max_columns = (Set.id, Workout.workout_date, Set.weight, Set.reps)
+
+
+@ns_analytics.route('/users/<int:userID>/exercises/<int:exerciseID>/e1rm')
+class UserExerciseOneRepMax(Resource):
+    @ns_analytics.doc('get_e1rm_series_for_user_exercise')
+    @ns_analytics.expect(one_rep_max_parser)
+    @requires_auth(['admin', 'user', 'report'])
+    @cached_response('user:{userID}', 'exercises')
+    @read_only
+    @ns_analytics.marshal_with(one_rep_max_series_model)
+    def get(self, userID, exerciseID):
+        """
+        Calculates the estimated 1RM of every set of a user's exercise, oldest first.
+        """
+        validate_user(userID)
+        validate_exercise(exerciseID)
+        formula = one_rep_max_parser.parse_args()['formula']
+
+        query = query_sets_for_exercise_and_user(userID, exerciseID) \
+            .with_entities(*one_rep_max_columns) \
+            .order_by(Workout.workout_date, Set.id)
+        return {'formula': formula, 'sets': get_one_rep_max_series(query, formula)}
+
+
+@ns_analytics.route('/sets/e1rm')
+class SetsOneRepMax(Resource):
+    @ns_analytics.doc('get_e1rm_for_sets')
+    @ns_analytics.expect(set_ids_one_rep_max_parser)
+    @ns_analytics.marshal_with(one_rep_max_series_model)
+    @requires_auth(['admin', 'user', 'report'])
+    @read_only
+    def get(self):
+        """
+        Calculates the estimated 1RM of a list of sets, oldest first. Unknown IDs are skipped.
+        """
+        args = set_ids_one_rep_max_parser.parse_args()
+        if len(args['ids']) > MAX_PAGE_SIZE:
+            api.abort(400, f"At most {MAX_PAGE_SIZE} set IDs can be passed")
+
+        query = db.session.query(*one_rep_max_columns).join(Workout, Set.workout_id == Workout.id) \
+            .filter(Set.id.in_(args['ids'])) \
+            .order_by(Workout.workout_date, Set.id)
+        return {'formula': args['formula'], 'sets': get_one_rep_max_series(query, args['formula'])}
+
+
+# Model for the progression of one calendar week
+trend_week_model = api.model('TrendWeek', {
+    'week_start': fields.Date(description='The Monday of the week'),
+    'best_one_rep_max': fields.Float(description='The best estimated 1RM of the week, empty if not trained'),
+    'rolling_best': fields.Float(description='The best estimated 1RM over the window ending with this week'),
+    'change_per_week': fields.Float(description='Change of the rolling best per week over the last window')
+})
+
+# Model for the progression of an exercise
+trend_model = api.model('Trend', {
+    'formula': fields.String(description='The formula used for the estimate'),
+    'window_weeks': fields.Integer(description='The length of the rolling window in weeks'),
+    'current_best': fields.Float(description='The rolling best of the last trained week'),
+    'change_per_week': fields.Float(description='The current change of the rolling best per week'),
+    'best_one_rep_max': fields.Float(description='The all-time best estimated 1RM'),
+    'best_week_start': fields.Date(description='The week of the all-time best'),
+    'weeks_since_best': fields.Integer(description='Weeks from the all-time best to the last trained week'),
+    'plateau': fields.Boolean(description='Whether the all-time best is at least plateau_weeks old'),
+    'weeks': fields.List(fields.Nested(trend_week_model))
+})
+
+trend_parser = one_rep_max_parser.copy()
+trend_parser.add_argument('window', type=int, default=4, location='args',
+                          help='Length of the rolling window in weeks (1-52)')
+trend_parser.add_argument('plateau_weeks', type=int, default=6, location='args',
+                          help='Weeks without a new best that count as a plateau (1-104)')
+
+
+@ns_analytics.route('/users/<int:userID>/exercises/<int:exerciseID>/trend')
+class UserExerciseTrend(Resource):
+    @ns_analytics.doc('get_trend_for_user_exercise')
+    @ns_analytics.expect(trend_parser)
+    @requires_auth(['admin', 'user', 'report'])
+    @cached_response('user:{userID}', 'exercises')
+    @read_only
+    @ns_analytics.marshal_with(trend_model)
+    def get(self, userID, exerciseID):
+        """
+        Returns the weekly progression of a user's exercise: the rolling best estimated 1RM,
+        its rate of change and whether the exercise is on a plateau.
+        """
+        validate_user(userID)
+        validate_exercise(exerciseID)
+        args = trend_parser.parse_args()
+        if not 1 <= args['window'] <= 52:
+            api.abort(400, "window must be between 1 and 52")
+        if not 1 <= args['plateau_weeks'] <= 104:
+            api.abort(400, "plateau_weeks must be between 1 and 104")
+
+        # One GROUP BY query, then a single pass over a few rows per week
+        rows = query_weekly_bests(userID, exerciseID)
+        return get_trend(rows, args['formula'], args['window'], args['plateau_weeks'])
+
+
+# Model for the training volume of one week, month or the whole history
+volume_model = api.model('Volume', {
+    'period': fields.String(description='week, month or total'),
+    'period_start': fields.Date(description='The Monday of the week or the first day of the month'),
+    'set_count': fields.Integer(description='Sets done'),
+    'rep_count': fields.Integer(description='Reps done'),
+    'tonnage': fields.Float(description='Sum of weight x reps'),
+    'top_set_id': fields.Integer(description='The ID of the heaviest set'),
+    'top_weight': fields.Float(description='The weight of the heaviest set'),
+    'top_reps': fields.Integer(description='The reps of the heaviest set')
+})
+
+volume_parser = reqparse.RequestParser()
+volume_parser.add_argument('period', type=str, default='week', location='args',
+                           choices=list(PERIODS) + [TOTAL], help='week, month or total')
+volume_parser.add_argument('from', type=inputs.date_from_iso8601, dest='start', location='args',
+                           help='Only periods containing or after this date (YYYY-MM-DD)')
+volume_parser.add_argument('to', type=inputs.date_from_iso8601, dest='end', location='args',
+                           help='Only periods starting on or before this date (YYYY-MM-DD)')
+
+
+@ns_analytics.route('/users/<int:userID>/exercises/<int:exerciseID>/volume')
+class UserExerciseVolume(Resource):
+    @ns_analytics.doc('get_volume_for_user_exercise')
+    @ns_analytics.expect(volume_parser)
+    @requires_auth(['admin', 'user', 'report'])
+    @cached_response('user:{userID}', 'exercises')
+    @read_only
+    @ns_analytics.marshal_list_with(volume_model)
+    def get(self, userID, exerciseID):
+        """
+        Returns the sets, reps, tonnage and top set of a user's exercise per week or month, oldest first.
+        """
+        validate_user(userID)
+        validate_exercise(exerciseID)
+        args = volume_parser.parse_args()
+
+        # Read from the rollup table, which the set write paths keep up to date
+        return get_volume(userID, exerciseID, args['period'], args['start'], args['end'])
+
+
+# --- Batch ---
+# Lets a client run several writes and read back the result in one request and one transaction,
+# e.g. add a set and get the workout again, instead of one round trip per step.
+MAX_BATCH_OPERATIONS = 100
+
+# "$<index>.<field>" in an argument is replaced by a field of the result of an earlier operation
+BATCH_REFERENCE = re.compile(r'^\$(\d+)\.(\w+)$')
+
+
+def check_batch_owner(user_id):
+    """
+    Aborts with a 403 if a user role touches another user's data, as requires_auth does for routes.
+    """
+    if request.headers.get('X-User-Role') == 'user' and user_id != int(request.headers['X-User-ID']):
+        api.abort(403, "Forbidden: Users can only access their own data.")
+
 
-        sets = get_sets_for_exercise_and_user(userID, exerciseID)
-        return sets
+def get_batch_workout(workout_id):
+    workout = Workout.query.get_or_404(workout_id, description="Workout not found")
+    check_batch_owner(workout.user_id)
+    return workout
+
+
+def get_batch_set(set_id):
+    set_record = Set.query.get_or_404(set_id, description="Set not found")
+    check_batch_owner(set_record.workout.user_id)
+    return set_record
+
+
+def batch_create_workout(args):
+    check_batch_owner(args['user_id'])
+    validate_user(args['user_id'])
+    workout = create_workout(args['user_id'], parse_workout_date(args.get('workout_date')), args.get('comment'))
+    return 201, marshal(workout, workout_model), workout.user_id
+
+
+def batch_add_set(args):
+    workout = get_batch_workout(args['workout_id'])
+    new_set = add_set(workout, args['exercise_id'], args.get('weight'), args.get('reps'), args.get('comment'))
+    return 201, marshal(new_set, set_model), workout.user_id
+
+
+def batch_update_set(args):
+    set_record = get_batch_set(args['set_id'])
+    update_set(set_record, args.get('reps'), args.get('weight'), args.get('comment'))
+    return 200, marshal(set_record, set_model), set_record.workout.user_id
+
+
+def batch_delete_set(args):
+    return 204, None, delete_set(get_batch_set(args['set_id']))
+
+
+def batch_get_workout(args):
+    workout = get_batch_workout(args['workout_id'])
+    # Sets added or deleted earlier in the batch are loaded again
+    db.session.expire(workout, ['sets'])
+    return 200, marshal(workout, workout_with_sets_model), None
+
+
+# Operation -> (function, {argument: (type, required)}). float arguments also accept integers.
+BATCH_OPERATIONS = {
+    'create_workout': (batch_create_workout, {'user_id': (int, True), 'workout_date': (str, False),
+                                              'comment': (str, False)}),
+    'add_set': (batch_add_set, {'workout_id': (int, True), 'exercise_id': (int, True), 'weight': (float, False),
+                                'reps': (int, False), 'comment': (str, False)}),
+    'update_set': (batch_update_set, {'set_id': (int, True), 'weight': (float, False), 'reps': (int, False),
+                                      'comment': (str, False)}),
+    'delete_set': (batch_delete_set, {'set_id': (int, True)}),
+    'get_workout': (batch_get_workout, {'workout_id': (int, True)}),
+}
 
+BATCH_TYPE_NAMES = {int: 'an integer', float: 'a number', str: 'a string'}
 
+
+def resolve_batch_args(operation, results):
+    """
+    Checks an operation and its arguments, replacing references to earlier results.
+    Returns (name, function, args) and aborts with a 400 if anything is invalid.
+    """
+    if not isinstance(operation, dict) or operation.get('op') not in BATCH_OPERATIONS:
+        api.abort(400, "Each operation needs an op, one of: " + ', '.join(BATCH_OPERATIONS))
+    name = operation['op']
+    function, spec = BATCH_OPERATIONS[name]
+    given = operation.get('args', {})
+    if not isinstance(given, dict):
+        api.abort(400, "args must be an object")
+
+    args = {}
+    for key, value in given.items():
+        if key not in spec:
+            api.abort(400, f"Unknown argument: {key}")
+        reference = BATCH_REFERENCE.match(value) if isinstance(value, str) else None
+        if reference:
+            index, field = int(reference.group(1)), reference.group(2)
+            result = results[index]['result'] if index < len(results) else None
+            if not isinstance(result, dict) or field not in result:
+                api.abort(400, f"Invalid reference: {value}")
+            value = result[field]
+
+        kind = spec[key][0]
+        allowed = (int, float) if kind is float else (kind,)
+        if value is not None and (not isinstance(value, allowed) or isinstance(value, bool)):
+            api.abort(400, f"{key} must be {BATCH_TYPE_NAMES[kind]}")
+        args[key] = value
+
+    for key, (_, required) in spec.items():
+        if required and args.get(key) is None:
+            api.abort(400, f"{key} is required")
+    return name, function, args
+
+
+batch_operation_model = api.model('BatchOperation', {
+    'op': fields.String(required=True, enum=list(BATCH_OPERATIONS), description='The operation to run'),
+    'args': fields.Raw(description='Arguments of the operation. "$<index>.<field>" is replaced by a field '
+                                   'of the result of an earlier operation, e.g. "$0.id"')
+})
+
+batch_model = api.model('Batch', {
+    'operations': fields.List(fields.Nested(batch_operation_model), required=True,
+                              description=f'Operations to run in order, at most {MAX_BATCH_OPERATIONS}')
+})
+
+batch_result_model = api.model('BatchResult', {
+    'index': fields.Integer(description='Position of the operation in the request'),
+    'op': fields.String(description='The operation'),
+    'status': fields.Integer(description='The status the single endpoint would have returned'),
+    'result': fields.Raw(description='The workout or set, as the single endpoint returns it')
+})
+
+ns_batch = api.namespace('batch', description='Several operations in one request', decorators=[admission['batch']])
+
+
+@ns_batch.route('')
+class Batch(Resource):
+    @ns_batch.doc('run_batch')
+    @ns_batch.expect(batch_model)
+    @ns_batch.response(400, 'An operation is invalid, nothing was changed')
+    @ns_batch.marshal_list_with(batch_result_model)
+    @requires_auth(['admin', 'user'])
+    def post(self):
+        """
+        Runs operations in order in one transaction: all of them are applied, or none if one fails.
+        The error names the index of the failing operation.
+        """
+        operations = api.payload.get('operations') if isinstance(api.payload, dict) else None
+        if not isinstance(operations, list) or not operations:
+            api.abort(400, "Expected a JSON object with a non-empty operations array")
+        if len(operations) > MAX_BATCH_OPERATIONS:
+            api.abort(400, f"At most {MAX_BATCH_OPERATIONS} operations can be run per request")
+
+        # 1. Run the operations, each sees the changes of the ones before it
+        results = []
+        written_users = set()
+        for index, operation in enumerate(operations):
+            try:
+                name, function, args = resolve_batch_args(operation, results)
+                status, result, user_id = function(args)
+            except HTTPException as e:
+                # 2. Undo everything on the first failure
+                db.session.rollback()
+                message = (getattr(e, 'data', None) or {}).get('message', e.description)
+                api.abort(e.code, f"Operation {index} failed: {message}", index=index)
+            results.append({'index': index, 'op': name, 'status': status, 'result': result})
+            if user_id is not None:
+                written_users.add(user_id)
+
+        # 3. Commit them together
+        response_generations.bump(*(f'user:{user_id}' for user_id in written_users))
+        db.session.commit()
+        return results
+
+
+ns_admin = api.namespace('admin', description='Operational endpoints')
+
+# Model for the connection pool status
+pool_status_model = api.model('PoolStatus', {
+    'pool_class': fields.String(description='The connection pool implementation'),
+    'size': fields.Integer(description='Configured number of pooled connections'),
+    'max_overflow': fields.Integer(description='Connections allowed beyond the pool size'),
+    'timeout_seconds': fields.Float(description='How long a checkout waits before timing out'),
+    'checked_in': fields.Integer(description='Idle connections in the pool'),
+    'checked_out': fields.Integer(description='Connections currently in use'),
+    'overflow': fields.Integer(description='Connections currently open beyond the pool size'),
+    'checkouts': fields.Integer(description='Checkouts since the worker started'),
+    'timeouts': fields.Integer(description='Checkouts that timed out waiting for a connection'),
+    'total_wait_seconds': fields.Float(description='Total time spent waiting for connections'),
+    'avg_wait_seconds': fields.Float(description='Average wait per checkout'),
+    'max_wait_seconds': fields.Float(description='Longest wait for a connection'),
+    'waiting': fields.Integer(description='Checkouts waiting for a connection right now'),
+    'current_wait_seconds': fields.Float(description='How long checkouts wait right now, as used by admission control')
+})
+
+
+@ns_admin.route('/pool')
+class PoolStatus(Resource):
+    @ns_admin.doc('get_pool_status')
+    @ns_admin.marshal_with(pool_status_model)
+    @requires_auth(['admin'])
+    def get(self):
+        """
+        Returns the database connection pool occupancy and wait statistics of this worker.
+        """
+        return pool_status(db.engine.pool)
+
+
+@api.route('/metrics')
+class Metrics(Resource):
+    @api.doc('get_metrics')
+    @requires_auth(['admin'])
+    def get(self):
+        """
+        Returns request latency, SQL statement and connection pool metrics of this worker
+        in the Prometheus text format.
+        """
+        status = pool_status(db.engine.pool)
+        pool_metrics = [
+            ('lifting_db_pool_checked_out', 'gauge', 'Connections currently in use', status.get('checked_out', 0)),
+            ('lifting_db_pool_checked_in', 'gauge', 'Idle connections in the pool', status.get('checked_in', 0)),
+            ('lifting_db_pool_overflow', 'gauge', 'Connections open beyond the pool size', status.get('overflow', 0)),
+            ('lifting_db_pool_timeouts_total', 'counter', 'Checkouts that timed out', status.get('timeouts', 0)),
+            ('lifting_db_pool_wait_seconds_total', 'counter', 'Time spent waiting for connections',
+             status.get('total_wait_seconds', 0.0)),
+        ]
+        return Response(render_metrics(pool_metrics), mimetype='text/plain; version=0.0.4')
+
+
+# Development server only, run gunicorn (see gunicorn.conf.py) in production
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
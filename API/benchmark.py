@@ -0,0 +1,344 @@
+"""
+Benchmarks every API endpoint through the Flask test client against a synthetic database.
+
+Seeds a local database (SQLite by default) with the requested volume, runs each endpoint
+at a fixed concurrency and reports p50/p95/p99 latency and throughput. Results can be
+saved as a JSON baseline and compared against a previous one:
+
+	python benchmark.py --users 200 --years 2 --save baseline.json
+	python benchmark.py --users 200 --years 2 --compare baseline.json
+
+The full production volume is --users 10000 --years 5 --sets-per-workout 20.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+
+EXERCISES = [
+	('Press', 'Standing shoulder press', 60),
+	('Squat', 'High bar back squat', 140),
+	('Deadlift', 'Classic style with regular bar', 180),
+	('Bench', 'Flat wide-grip bench press', 100),
+	('Row', 'Bent over barbell row', 80),
+	('Front Squat', 'Olympic style front squat', 110),
+	('Curl', 'Straight barbell curl', 40),
+	('Pull up', 'Shoulder width body weight pull up', 20),
+	('Dip', 'Parallel bar dip', 30),
+	('Power Clean', 'Clean from the floor', 90),
+]
+
+HEADERS = {'X-User-ID': '1', 'X-User-Role': 'admin'}
+
+
+def parse_args():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--db', help='Database URI (default: a new SQLite file in the temp directory)')
+	parser.add_argument('--users', type=int, default=100, help='Number of synthetic users')
+	parser.add_argument('--years', type=float, default=1, help='Years of training history per user')
+	parser.add_argument('--workouts-per-week', type=int, default=3, help='Workouts per user per week')
+	parser.add_argument('--sets-per-workout', type=int, default=20, help='Sets per workout')
+	parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint')
+	parser.add_argument('--concurrency', type=int, default=4, help='Concurrent clients per endpoint')
+	parser.add_argument('--seed', type=int, default=42, help='Random seed for data and requests')
+	parser.add_argument('--no-cache', action='store_true', help='Disable the response cache')
+	parser.add_argument('--verbose', action='store_true', help='Show slow statement and query budget warnings')
+	parser.add_argument('--skip-seed', action='store_true', help='Reuse an already seeded --db')
+	parser.add_argument('--save', help='Write the results to this JSON baseline')
+	parser.add_argument('--compare', help='Compare the results with this JSON baseline')
+	parser.add_argument('--tolerance', type=float, default=0.20,
+	                    help='Allowed p95 slowdown against the baseline before failing (default 0.20)')
+	return parser.parse_args()
+
+
+def seed_database(app, db, args, rng):
+	"""
+	Creates the tables and fills them with synthetic users, workouts and sets in chunked executemany inserts.
+	"""
+	from models import User, Exercise, Workout, Set
+
+	weeks = int(args.years * 52)
+	workouts_per_user = weeks * args.workouts_per_week
+	start_date = datetime(2020, 1, 6, 18, 0, 0)
+	chunk = 50000
+
+	with app.app_context():
+		db.drop_all()
+		db.create_all()
+
+		db.session.execute(db.insert(Exercise), [
+			{'id': i + 1, 'name': name, 'description': description, 'date_started': start_date}
+			for i, (name, description, _) in enumerate(EXERCISES)
+		])
+		db.session.execute(db.insert(User), [
+			{'id': u, 'first_name': f'User{u}', 'last_name': 'Bench', 'email': f'user{u}@example.com', 'enabled': 1}
+			for u in range(1, args.users + 1)
+		])
+		db.session.commit()
+
+		workout_id = 0
+		set_id = 0
+		workouts, sets = [], []
+		for user_id in range(1, args.users + 1):
+			for n in range(workouts_per_user):
+				workout_id += 1
+				day = n // args.workouts_per_week * 7 + n % args.workouts_per_week * 2
+				workouts.append({
+					'id': workout_id,
+					'workout_date': start_date + timedelta(days=day),
+					'comment': f'Workout {n}',
+					'user_id': user_id
+				})
+				for _ in range(args.sets_per_workout):
+					set_id += 1
+					exercise_index = rng.randrange(len(EXERCISES))
+					base = EXERCISES[exercise_index][2]
+					sets.append({
+						'id': set_id,
+						'exercise_id': exercise_index + 1,
+						'weight': round(base * rng.uniform(0.6, 1.1) * (1 + n / (workouts_per_user * 4)) / 2.5) * 2.5,
+						'reps': rng.randint(1, 12),
+						'comment': None,
+						'workout_id': workout_id
+					})
+				if len(sets) >= chunk:
+					db.session.execute(db.insert(Workout), workouts)
+					db.session.execute(db.insert(Set), sets)
+					db.session.commit()
+					workouts, sets = [], []
+		if workouts:
+			db.session.execute(db.insert(Workout), workouts)
+		if sets:
+			db.session.execute(db.insert(Set), sets)
+		db.session.commit()
+
+	return workout_id, set_id
+
+
+def build_scenarios(args, workout_count, set_count):
+	"""
+	Returns the (name, method, url factory, json factory) of every endpoint to benchmark.
+	The factories take a Random instance so each request hits a different user or row.
+	"""
+	users = args.users
+	exercises = len(EXERCISES)
+	created_sets = []
+	lock = threading.Lock()
+
+	def user(r):
+		return r.randint(1, users)
+
+	def workout(r):
+		return r.randint(1, workout_count)
+
+	def a_set(r):
+		return r.randint(1, set_count)
+
+	def created_set(r):
+		with lock:
+			return created_sets.pop() if created_sets else a_set(r)
+
+	scenarios = [
+		('users_list', 'GET', lambda r: '/users/?limit=100', None),
+		('exercises_list', 'GET', lambda r: '/exercises/', None),
+		('workouts_get', 'GET', lambda r: f'/workouts/{user(r)}/get', None),
+		('workouts_get_page', 'GET', lambda r: f'/workouts/{user(r)}/get?limit=50', None),
+		('workouts_get_with_sets', 'GET', lambda r: f'/workouts/{user(r)}/getwithsets?limit=20', None),
+		('sets_list', 'GET', lambda r: f'/sets/{workout(r)}', None),
+		('set_calc1rm', 'GET', lambda r: f'/analytics/sets/{a_set(r)}/calc1rm', None),
+		('user_exercise_findpr', 'GET', lambda r: f'/analytics/users/{user(r)}/exercises/{r.randint(1, exercises)}/findpr', None),
+		('user_exercise_getsets', 'GET', lambda r: f'/analytics/users/{user(r)}/exercises/{r.randint(1, exercises)}/getsets', None),
+		('user_exercise_e1rm', 'GET', lambda r: f'/analytics/users/{user(r)}/exercises/{r.randint(1, exercises)}/e1rm', None),
+		('user_exercise_volume', 'GET', lambda r: f'/analytics/users/{user(r)}/exercises/{r.randint(1, exercises)}/volume?period=week', None),
+		('user_exercise_trend', 'GET', lambda r: f'/analytics/users/{user(r)}/exercises/{r.randint(1, exercises)}/trend', None),
+		('user_export_ndjson', 'GET', lambda r: f'/users/{user(r)}/export', None),
+		('user_export_csv', 'GET', lambda r: f'/users/{user(r)}/export?format=csv', None),
+		('sets_e1rm', 'GET', lambda r: '/analytics/sets/e1rm?ids=' + ','.join(str(a_set(r)) for _ in range(50)), None),
+		('workout_add', 'POST', lambda r: f'/workouts/{user(r)}/add', lambda r: {'comment': 'benchmark'}),
+		('set_add', 'POST', lambda r: f'/sets/{workout(r)}',
+		 lambda r: {'exercise_id': r.randint(1, exercises), 'weight': r.randint(20, 200), 'reps': r.randint(1, 10)}),
+		('sets_bulk_add', 'POST', lambda r: '/sets/bulk',
+		 lambda r: [{'workout_id': workout(r), 'exercise_id': r.randint(1, exercises),
+		             'weight': r.randint(20, 200), 'reps': r.randint(1, 10)} for _ in range(20)]),
+		('set_update', 'PUT', lambda r: f'/sets/{a_set(r)}/update', lambda r: {'reps': r.randint(1, 10)}),
+		('set_delete', 'DELETE', lambda r: f'/sets/{created_set(r)}/delete', None),
+		('admin_pool', 'GET', lambda r: '/admin/pool', None),
+		('metrics', 'GET', lambda r: '/metrics', None),
+	]
+	return scenarios, created_sets
+
+
+def run_scenario(app, scenario, args, seed, created_sets):
+	"""
+	Sends args.requests requests for one endpoint from args.concurrency threads.
+	Returns the latency percentiles and throughput of the 2xx responses, and the count of the others.
+	The percentiles are None if no request succeeded.
+	"""
+	name, method, url_for, json_for = scenario
+	per_thread = [args.requests // args.concurrency + (1 if i < args.requests % args.concurrency else 0)
+	              for i in range(args.concurrency)]
+	latencies = [[] for _ in range(args.concurrency)]
+	errors = [0] * args.concurrency
+
+	def worker(index):
+		r = random.Random(seed * 1000 + index)
+		client = app.test_client()
+		for _ in range(per_thread[index]):
+			url = url_for(r)
+			body = json_for(r) if json_for else None
+			start = time.perf_counter()
+			res = client.open(url, method=method, json=body, headers=HEADERS)
+			# Streamed responses are only complete once their body has been read
+			res.get_data()
+			res.close()
+			elapsed = time.perf_counter() - start
+			# A rejected or failed request is not timed, it would make the endpoint look faster
+			if not 200 <= res.status_code < 300:
+				errors[index] += 1
+				continue
+			latencies[index].append(elapsed)
+			if name == 'set_add':
+				created_sets.append(res.get_json()['id'])
+
+	threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.concurrency)]
+	start = time.perf_counter()
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	elapsed = time.perf_counter() - start
+
+	all_latencies = np.array([value for values in latencies for value in values]) * 1000
+	if not all_latencies.size:
+		return {'requests': 0, 'errors': sum(errors), 'p50_ms': None, 'p95_ms': None, 'p99_ms': None,
+		        'mean_ms': None, 'throughput_rps': 0.0}
+	p50, p95, p99 = np.percentile(all_latencies, [50, 95, 99])
+	return {
+		'requests': int(all_latencies.size),
+		'errors': sum(errors),
+		'p50_ms': round(float(p50), 3),
+		'p95_ms': round(float(p95), 3),
+		'p99_ms': round(float(p99), 3),
+		'mean_ms': round(float(all_latencies.mean()), 3),
+		'throughput_rps': round(all_latencies.size / elapsed, 1)
+	}
+
+
+def git_commit():
+	try:
+		return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+		                               stderr=subprocess.DEVNULL).strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def compare(results, baseline, tolerance):
+	"""
+	Prints the p95 change of every endpoint against the baseline. Returns the names of regressed endpoints,
+	an endpoint with more failed requests than in the baseline counts as regressed.
+	"""
+	regressions = []
+	print(f"\n{'endpoint':<26}{'baseline p95':>14}{'p95':>10}{'change':>10}")
+	for name, result in results.items():
+		before = baseline.get('results', {}).get(name)
+		if result['errors'] > (before or {}).get('errors', 0) or result['p95_ms'] is None:
+			print(f"{name:<26}{'-':>14}{'-':>10}{'':>10}  FAILED {result['errors']} of "
+			      f"{result['requests'] + result['errors']}")
+			regressions.append(name)
+			continue
+		if before is None or before['p95_ms'] is None:
+			print(f"{name:<26}{'-':>14}{result['p95_ms']:>10.2f}{'new':>10}")
+			continue
+		change = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] if before['p95_ms'] else 0.0
+		flag = '  REGRESSION' if change > tolerance else ''
+		print(f"{name:<26}{before['p95_ms']:>14.2f}{result['p95_ms']:>10.2f}{change:>+10.1%}{flag}")
+		if change > tolerance:
+			regressions.append(name)
+	return regressions
+
+
+def main():
+	args = parse_args()
+	rng = random.Random(args.seed)
+
+	# The app reads its configuration when it is imported
+	db_uri = args.db or 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'lifting_benchmark.db')
+	os.environ['DATABASE_URI'] = db_uri
+	if args.no_cache:
+		os.environ['RESPONSE_CACHE_SIZE'] = '0'
+	# Admission control would turn the benchmark's own load away, the endpoints are measured without it
+	for setting in ('ADMISSION_WRITE_RATE', 'ADMISSION_ANALYTICS_CONCURRENCY', 'ADMISSION_MAX_POOL_WAIT'):
+		os.environ[setting] = '0'
+	from app import app, db
+	from models import Workout, Set
+
+	if not args.verbose:
+		logging.getLogger('metrics').setLevel(logging.ERROR)
+
+	if args.skip_seed:
+		with app.app_context():
+			workout_count = db.session.query(db.func.max(Workout.id)).scalar()
+			set_count = db.session.query(db.func.max(Set.id)).scalar()
+	else:
+		print(f"Seeding {db_uri} ...", flush=True)
+		start = time.perf_counter()
+		workout_count, set_count = seed_database(app, db, args, rng)
+		print(f"Seeded {args.users} users, {workout_count} workouts, {set_count} sets "
+		      f"in {time.perf_counter() - start:.1f}s")
+
+	scenarios, created_sets = build_scenarios(args, workout_count, set_count)
+	results = {}
+	print(f"\n{'endpoint':<26}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}{'errors':>8}")
+	for index, scenario in enumerate(scenarios):
+		result = run_scenario(app, scenario, args, args.seed + index, created_sets)
+		results[scenario[0]] = result
+		if result['p95_ms'] is None:
+			print(f"{scenario[0]:<26}{'-':>10}{'-':>10}{'-':>10}{'-':>10}{result['errors']:>8}", flush=True)
+			continue
+		print(f"{scenario[0]:<26}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+		      f"{result['throughput_rps']:>10.1f}{result['errors']:>8}", flush=True)
+
+	failed = {name: result['errors'] for name, result in results.items() if result['errors']}
+	if failed:
+		print("\nFailed requests, not included in the timings: "
+		      + ', '.join(f'{name} {count}' for name, count in failed.items()))
+
+	report = {
+		'meta': {
+			'commit': git_commit(),
+			'timestamp': datetime.now().isoformat(timespec='seconds'),
+			'python': platform.python_version(),
+			'database': db_uri.split(':', 1)[0],
+			'params': {key: value for key, value in vars(args).items()
+			           if key not in ('save', 'compare', 'tolerance', 'verbose', 'skip_seed')}
+		},
+		'results': results
+	}
+
+	if args.save:
+		with open(args.save, 'w', encoding='utf-8') as f:
+			json.dump(report, f, indent=2)
+		print(f"\nSaved results to {args.save}")
+
+	if args.compare:
+		with open(args.compare, 'r', encoding='utf-8') as f:
+			baseline = json.load(f)
+		if baseline.get('meta', {}).get('params') != report['meta']['params']:
+			print("\nWarning: the baseline was recorded with different parameters")
+		if compare(results, baseline, args.tolerance):
+			sys.exit(1)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,127 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+_MISSING = object()
+
+
+class TTLCache:
+	"""
+	A small thread-safe LRU cache whose entries expire after ttl seconds.
+	It is local to the process, so other workers only see a change once their entry expires.
+	"""
+
+	def __init__(self, maxsize=1024, ttl=60):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key, default=None):
+		"""
+		Returns the cached value for key, or default if it is missing or expired.
+		"""
+		now = time.monotonic()
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None or entry[1] <= now:
+				return default
+			self._entries.move_to_end(key)
+			return entry[0]
+
+	def get_or_load(self, key, loader):
+		"""
+		Returns the cached value for key, calling loader() to fill it on a miss.
+		None is cached like any other value.
+		"""
+		value = self.get(key, _MISSING)
+		if value is not _MISSING:
+			return value
+
+		value = loader()
+		self.set(key, value)
+		return value
+
+	def set(self, key, value):
+		with self._lock:
+			self._entries[key] = (value, time.monotonic() + self.ttl)
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.maxsize:
+				self._entries.popitem(last=False)
+
+	def invalidate(self, key):
+		with self._lock:
+			self._entries.pop(key, None)
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+
+	def __len__(self):
+		return len(self._entries)
+
+
+class GenerationCounter:
+	"""
+	Per-scope counters that write paths bump to invalidate everything cached for that scope.
+	Given load and store, the counters are kept in the database so that every worker sees the bumps:
+	store(scopes) increments them in the write's transaction and load(scopes) returns their values in order.
+	A loaded counter is used for check_interval seconds before it is read again; this worker's own
+	bumps are read again on the next lookup.
+	"""
+
+	def __init__(self, load=None, store=None, check_interval=5.0):
+		self._load = load
+		self._store = store
+		self.check_interval = check_interval
+		self._counters = {}
+		self._checked = {}
+		self._bumped = {}
+		self._lock = threading.Lock()
+
+	def bump(self, *scopes):
+		"""
+		Bumps the scopes. With a store this must be called before the write commits, so that
+		the bump is committed or rolled back together with the data.
+		"""
+		# In a fixed order, so that two writers lock the stored counters in the same order
+		scopes = sorted(set(scopes))
+		if self._store is not None:
+			self._store(scopes)
+		now = time.monotonic()
+		with self._lock:
+			for scope in scopes:
+				self._counters[scope] = self._counters.get(scope, 0) + 1
+				self._bumped[scope] = now
+				self._checked.pop(scope, None)
+
+	def get(self, scopes):
+		"""
+		Returns the current generation of each scope as a tuple.
+		"""
+		if self._load is not None:
+			now = time.monotonic()
+			with self._lock:
+				due = [scope for scope in scopes
+				       if now - self._checked.get(scope, float('-inf')) >= self.check_interval]
+			if due:
+				loaded = tuple(self._load(due))
+				with self._lock:
+					for scope, counter in zip(due, loaded):
+						if self._counters.get(scope) != counter:
+							# Bumped by another worker, or not seen by this one yet, counts as a recent bump
+							self._counters[scope] = counter
+							self._bumped[scope] = now
+						self._checked[scope] = now
+
+		with self._lock:
+			return tuple(self._counters.get(scope, 0) for scope in scopes)
+
+	def seconds_since_bump(self, scopes):
+		"""
+		Returns the seconds since any of the scopes was last bumped, or first seen changed, infinity if never.
+		"""
+		with self._lock:
+			last = max((self._bumped.get(scope, float('-inf')) for scope in scopes), default=float('-inf'))
+		return time.monotonic() - last
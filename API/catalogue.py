@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+from models import db, Exercise
+from versions import stored_version
+
+
+EXERCISES = 'exercises'
+
+
+class ExerciseCatalogue:
+	"""
+	All exercises, loaded once per process: rows by ID and IDs by lower-cased name.
+	Exercise writes bump the 'exercises' version stamp; the stamp is read at most every
+	check_interval seconds and the catalogue is reloaded when it is newer. A lookup that misses
+	reads the stamp right away, so an exercise added by another worker is found at once.
+	"""
+
+	def __init__(self, check_interval=5.0):
+		self.check_interval = check_interval
+		self._version = -1
+		self._by_id = {}
+		self._by_name = {}
+		self._next_check = float('-inf')
+		self._lock = threading.Lock()
+
+	def _load(self):
+		rows = db.session.query(Exercise.id, Exercise.name, Exercise.description, Exercise.date_started) \
+			.order_by(Exercise.id).all()
+		# Names are matched case-insensitively, the oldest exercise wins if two share a name
+		by_name = {}
+		for row in rows:
+			if row.name:
+				by_name.setdefault(row.name.strip().lower(), row.id)
+		return {row.id: row for row in rows}, by_name
+
+	def refresh(self, force=False):
+		"""
+		Reloads the exercises if the stamp changed. Unless forced, the stamp is only read
+		when check_interval has passed since the last check.
+		"""
+		now = time.monotonic()
+		if not force and now < self._next_check:
+			return
+
+		# The stamp is read before the rows, so the rows are at least as new as the stamp.
+		# Only a newer stamp is taken, a lagging replica must not roll the catalogue back.
+		version = stored_version(EXERCISES)
+		if version > self._version:
+			by_id, by_name = self._load()
+			with self._lock:
+				if version > self._version:
+					self._version, self._by_id, self._by_name = version, by_id, by_name
+		self._next_check = now + self.check_interval
+
+	def invalidate(self):
+		"""
+		Makes the next lookup read the stamp, e.g. after this worker changed an exercise.
+		"""
+		self._next_check = float('-inf')
+
+	def clear(self):
+		"""
+		Drops the loaded exercises, the next lookup loads them again.
+		"""
+		with self._lock:
+			self._version, self._by_id, self._by_name = -1, {}, {}
+		self._next_check = float('-inf')
+
+	def get(self, exercise_id):
+		"""
+		Returns the (id, name, description, date_started) row of an exercise, or None if it does not exist.
+		"""
+		self.refresh()
+		row = self._by_id.get(exercise_id)
+		if row is None:
+			self.refresh(force=True)
+			row = self._by_id.get(exercise_id)
+		return row
+
+	def existing(self, exercise_ids):
+		"""
+		Returns the IDs of the given exercises that exist.
+		"""
+		self.refresh()
+		found = {exercise_id for exercise_id in exercise_ids if exercise_id in self._by_id}
+		if len(found) < len(set(exercise_ids)):
+			self.refresh(force=True)
+			found = {exercise_id for exercise_id in exercise_ids if exercise_id in self._by_id}
+		return found
+
+	def names(self):
+		"""
+		Returns the IDs of the exercises by lower-cased name. The dict must not be changed.
+		"""
+		self.refresh(force=True)
+		return self._by_name
+
+	def all(self):
+		"""
+		Returns the rows of all exercises, ordered by ID.
+		"""
+		self.refresh()
+		return list(self._by_id.values())
+
+
+exercise_catalogue = ExerciseCatalogue(check_interval=float(os.getenv('EXERCISE_CATALOGUE_CHECK_INTERVAL', 5)))
@@ -0,0 +1,152 @@
+import gzip
+import os
+import zlib
+from flask import request
+from cache import TTLCache
+
+try:
+	import brotli
+except ImportError:
+	brotli = None
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+
+# Buffered bodies smaller than this go out uncompressed, the headers would eat the gain.
+# Streamed bodies have no known size and are always compressed.
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', 6))
+BROTLI_LEVEL = int(os.getenv('COMPRESSION_BROTLI_LEVEL', 5))
+ZSTD_LEVEL = int(os.getenv('COMPRESSION_ZSTD_LEVEL', 3))
+
+# Compressed bodies of responses with an ETag, keyed on (ETag, encoding), so a cached
+# response is compressed once rather than on every request
+compressed_cache = TTLCache(maxsize=int(os.getenv('COMPRESSION_CACHE_SIZE', 1000)),
+                            ttl=float(os.getenv('RESPONSE_CACHE_TTL', 30)))
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/x-ndjson', 'text/csv', 'text/plain', 'text/html',
+                          'text/css', 'application/javascript'}
+
+
+class _Gzip:
+	def compress(self, data):
+		return gzip.compress(data, GZIP_LEVEL)
+
+	def compressor(self):
+		# wbits=31 writes the gzip header and trailer
+		compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+		return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+
+class _Brotli:
+	def compress(self, data):
+		return brotli.compress(data, quality=BROTLI_LEVEL)
+
+	def compressor(self):
+		compressor = brotli.Compressor(quality=BROTLI_LEVEL)
+		return compressor.process, compressor.flush, compressor.finish
+
+
+class _Zstd:
+	def compress(self, data):
+		return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+
+	def compressor(self):
+		compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+		return (compressor.compress, lambda: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK),
+		        compressor.flush)
+
+
+# Content-Encoding -> codec, in order of preference when the client accepts several equally
+ENCODINGS = {}
+if zstandard is not None:
+	ENCODINGS['zstd'] = _Zstd()
+if brotli is not None:
+	ENCODINGS['br'] = _Brotli()
+ENCODINGS['gzip'] = _Gzip()
+
+
+def choose_encoding(accept_encodings):
+	"""
+	Returns the supported encoding the client prefers, or None for an uncompressed response.
+	"""
+	return accept_encodings.best_match(list(ENCODINGS))
+
+
+def _compress_stream(chunks, codec):
+	compress, flush, finish = codec.compressor()
+	try:
+		for chunk in chunks:
+			if isinstance(chunk, str):
+				chunk = chunk.encode('utf-8')
+			# Flushed per chunk, so the client receives every batch as it is produced
+			data = compress(chunk) + flush()
+			if data:
+				yield data
+		yield finish()
+	finally:
+		close = getattr(chunks, 'close', None)
+		if close is not None:
+			close()
+
+
+def _is_compressible(response):
+	mimetype = response.mimetype or ''
+	return mimetype in COMPRESSIBLE_MIMETYPES or mimetype.endswith('+json')
+
+
+def compress_response(response):
+	"""
+	Compresses the body with the best encoding the client accepts.
+	Streamed bodies are compressed chunk by chunk as they are sent. A strong ETag becomes weak,
+	because the bytes depend on the encoding; If-None-Match compares ETags weakly, so
+	revalidation keeps working for compressed and uncompressed responses alike.
+	"""
+	if request.method == 'HEAD' or 'Content-Encoding' in response.headers or response.direct_passthrough:
+		return response
+	if not _is_compressible(response):
+		return response
+	response.vary.add('Accept-Encoding')
+
+	encoding = choose_encoding(request.accept_encodings)
+	if encoding is None:
+		return response
+	if response.status_code not in (200, 304):
+		return response
+
+	# Weakened whenever an encoding is negotiated, so a 304 names the same ETag as the 200
+	etag, weak = response.get_etag()
+	if etag and not weak:
+		response.set_etag(etag, weak=True)
+	if response.status_code == 304:
+		return response
+
+	codec = ENCODINGS[encoding]
+	if response.is_streamed:
+		response.response = _compress_stream(response.response, codec)
+		response.headers.pop('Content-Length', None)
+	else:
+		data = response.get_data()
+		if len(data) < COMPRESSION_MIN_SIZE:
+			return response
+		if etag:
+			compressed = compressed_cache.get((etag, encoding))
+			if compressed is None:
+				compressed = codec.compress(data)
+				compressed_cache.set((etag, encoding), compressed)
+		else:
+			compressed = codec.compress(data)
+		response.set_data(compressed)
+
+	response.headers['Content-Encoding'] = encoding
+	return response
+
+
+def init_compression(app):
+	"""
+	Compresses the responses of the app according to the Accept-Encoding of each request.
+	"""
+	app.after_request(compress_response)
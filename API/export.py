@@ -0,0 +1,107 @@
+import csv
+import io
+import json
+from sqlalchemy import select
+from models import db, Exercise, Workout, Set
+
+
+# Rows are fetched from a server-side cursor in batches of this size
+EXPORT_BATCH_SIZE = 1000
+
+# Columns of the CSV export, one row per set; workouts without sets get one row with empty set columns
+CSV_COLUMNS = ('workout_id', 'workout_date', 'workout_comment', 'set_id', 'exercise_id', 'exercise_name',
+               'weight', 'reps', 'set_comment')
+
+
+def _history_batches(user_id, batch_size):
+	"""
+	Yields the workouts and sets of a user in batches of rows, ordered by workout date.
+	yield_per streams the result from a server-side cursor instead of buffering it.
+	"""
+	stmt = select(
+		Workout.id.label('workout_id'),
+		Workout.workout_date,
+		Workout.comment.label('workout_comment'),
+		Set.id.label('set_id'),
+		Set.exercise_id,
+		Exercise.name.label('exercise_name'),
+		Set.weight,
+		Set.reps,
+		Set.comment.label('set_comment')
+	).outerjoin(Set, Set.workout_id == Workout.id) \
+		.outerjoin(Exercise, Exercise.id == Set.exercise_id) \
+		.where(Workout.user_id == user_id) \
+		.order_by(Workout.workout_date, Workout.id, Set.id) \
+		.execution_options(yield_per=batch_size)
+
+	result = db.session.execute(stmt)
+	try:
+		yield from result.partitions()
+	finally:
+		result.close()
+
+
+def _format_date(value):
+	return value.isoformat() if value is not None else None
+
+
+def generate_ndjson(user_id, batch_size=EXPORT_BATCH_SIZE):
+	"""
+	Yields a user's history as NDJSON, one workout with its sets per line.
+	Only the workout being assembled is held in memory.
+	"""
+	workout = None
+	for rows in _history_batches(user_id, batch_size):
+		lines = []
+		for row in rows:
+			if workout is None or workout['id'] != row.workout_id:
+				if workout is not None:
+					lines.append(json.dumps(workout))
+				workout = {
+					'id': row.workout_id,
+					'user_id': user_id,
+					'workout_date': _format_date(row.workout_date),
+					'comment': row.workout_comment,
+					'sets': []
+				}
+			if row.set_id is not None:
+				workout['sets'].append({
+					'id': row.set_id,
+					'exercise_id': row.exercise_id,
+					'exercise_name': row.exercise_name,
+					'weight': row.weight,
+					'reps': row.reps,
+					'comment': row.set_comment
+				})
+		if lines:
+			yield '\n'.join(lines) + '\n'
+
+	if workout is not None:
+		yield json.dumps(workout) + '\n'
+
+
+def generate_csv(user_id, batch_size=EXPORT_BATCH_SIZE):
+	"""
+	Yields a user's history as CSV with a header line, one set per line.
+	"""
+	buffer = io.StringIO()
+	writer = csv.writer(buffer, lineterminator='\n')
+
+	# The header goes out before the query runs
+	writer.writerow(CSV_COLUMNS)
+	yield buffer.getvalue()
+
+	for rows in _history_batches(user_id, batch_size):
+		buffer.seek(0)
+		buffer.truncate()
+		for row in rows:
+			writer.writerow((row.workout_id, _format_date(row.workout_date), row.workout_comment, row.set_id,
+			                 row.exercise_id, row.exercise_name, row.weight, row.reps, row.set_comment))
+		yield buffer.getvalue()
+
+
+# Export format -> (generator, mimetype, file extension)
+EXPORT_FORMATS = {
+	'ndjson': (generate_ndjson, 'application/x-ndjson', 'ndjson'),
+	'csv': (generate_csv, 'text/csv', 'csv')
+}
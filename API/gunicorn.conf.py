@@ -0,0 +1,70 @@
+"""
+Gunicorn settings for running the API in production:
+
+	cd API && gunicorn
+
+Gunicorn loads this file from the working directory. Every setting can be overridden
+from the environment or .env, and command line options override both.
+
+The defaults suit the API's workload: most of a request is spent waiting on MySQL,
+so each worker runs several threads (gthread) that share the worker's connection pool,
+and one worker per core keeps the Python code of all cores busy. Keep
+WEB_CONCURRENCY x (DB_POOL_SIZE + DB_MAX_OVERFLOW) below MySQL's max_connections and
+DB_POOL_SIZE at or above GUNICORN_THREADS, so threads do not queue for connections.
+Caches, metrics and admission limits are per worker.
+"""
+import multiprocessing
+import os
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+
+def _bool(name, default):
+	return os.getenv(name, str(default)).lower() in ('1', 'true', 'yes')
+
+
+wsgi_app = 'app:app'
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+
+# Worker model
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+
+# Connections and timeouts. keepalive only needs to outlast the proxy in front
+# reusing its upstream connections.
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+
+# Restart workers after a number of requests, with jitter so they do not all restart at once.
+# Bounds the memory of long running workers; 0 disables it.
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+# Loading the app before forking saves memory and start-up time per worker
+preload_app = _bool('GUNICORN_PRELOAD', True)
+
+# Logging
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = os.getenv('GUNICORN_ERROR_LOG', '-')
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+	"""
+	Gives every worker its own database connections. With preload_app the app and its engines
+	were created in the master; any connection the master opened must not be shared by the forks.
+	"""
+	if not server.cfg.preload_app:
+		return
+
+	from app import app, db
+
+	with app.app_context():
+		# Every engine of the app, db.engine is only the default one; close=False leaves the
+		# master's connections open for the master
+		for engine in db.engines.values():
+			engine.dispose(close=False)
@@ -0,0 +1,317 @@
+import argparse
+import csv
+import json
+import logging
+import math
+import sys
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func, insert
+from models import db, User, Workout, Set
+from analytics import rep_record_weight, refresh_personal_record
+from volume import invalidate_volume
+from catalogue import exercise_catalogue
+from summary import build_summaries
+
+
+logger = logging.getLogger(__name__)
+
+# Sets inserted per transaction
+IMPORT_CHUNK_SIZE = 5000
+# Rejected rows beyond this are only counted
+MAX_REPORTED_ERRORS = 100
+
+COMMENT_LENGTH = Set.comment.type.length
+
+
+def read_csv(stream):
+	"""
+	Yields (line, row) for a CSV file with a header, e.g. the CSV export.
+	Rows need workout_date, and for a set exercise_name or exercise_id, weight and reps.
+	"""
+	reader = csv.DictReader(stream)
+	for row in reader:
+		yield reader.line_num, row
+
+
+def read_ndjson(stream):
+	"""
+	Yields (line, row) for an NDJSON file. A line is either a workout with its sets,
+	as in the NDJSON export, or a single set with the same fields as a CSV row.
+	"""
+	for line, text in enumerate(stream, start=1):
+		if not text.strip():
+			continue
+		try:
+			item = json.loads(text)
+		except ValueError:
+			yield line, None
+			continue
+
+		if not isinstance(item, dict) or 'sets' not in item:
+			yield line, item
+			continue
+
+		workout = {'workout_date': item.get('workout_date'), 'workout_comment': item.get('comment')}
+		sets = item['sets'] if isinstance(item['sets'], list) else [None]
+		if not sets:
+			yield line, workout
+		for s in sets:
+			if not isinstance(s, dict):
+				yield line, None
+				continue
+			yield line, dict(workout, exercise_id=s.get('exercise_id'), exercise_name=s.get('exercise_name'),
+			                 weight=s.get('weight'), reps=s.get('reps'), set_comment=s.get('comment'))
+
+
+# Import format -> (reader, mimetype)
+IMPORT_FORMATS = {
+	'csv': (read_csv, 'text/csv'),
+	'ndjson': (read_ndjson, 'application/x-ndjson')
+}
+
+
+def _blank(value):
+	return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _parse_date(value):
+	if isinstance(value, str):
+		try:
+			value = datetime.fromisoformat(value.strip())
+		except ValueError:
+			raise ValueError("workout_date must be an ISO 8601 date")
+	if not isinstance(value, datetime):
+		raise ValueError("workout_date is required")
+	if value.tzinfo is not None:
+		value = value.astimezone(timezone.utc).replace(tzinfo=None)
+	# DATETIME columns have no fractional seconds and MySQL rounds them, keys must compare equal to what is stored
+	return (value + timedelta(microseconds=500000)).replace(microsecond=0)
+
+
+def _parse_number(value, name, kind):
+	try:
+		if isinstance(value, bool):
+			raise ValueError
+		number = kind(value.strip()) if isinstance(value, str) else kind(value)
+		if kind is int and not isinstance(value, str) and number != value:
+			raise ValueError
+	except (TypeError, ValueError):
+		raise ValueError(f"{name} must be {'an integer' if kind is int else 'a number'}")
+	if not math.isfinite(number):
+		raise ValueError(f"{name} must be a number")
+	if number < 0:
+		raise ValueError(f"{name} must not be negative")
+	return number
+
+
+def _parse_comment(value, name):
+	if _blank(value):
+		return None
+	if len(str(value)) > COMMENT_LENGTH:
+		raise ValueError(f"{name} must be at most {COMMENT_LENGTH} characters")
+	return str(value)
+
+
+def _parse_row(row, exercises, exercise_ids):
+	"""
+	Returns (workout_date, workout_comment, exercise_id, weight, reps, set_comment) for a row.
+	exercise_id is None for a workout without sets. Raises ValueError if the row is invalid.
+	"""
+	if not isinstance(row, dict):
+		raise ValueError("Invalid row")
+
+	workout_date = _parse_date(row.get('workout_date'))
+	workout_comment = _parse_comment(row.get('workout_comment'), 'workout_comment')
+
+	set_fields = ('exercise_name', 'exercise_id', 'weight', 'reps', 'set_comment')
+	if all(_blank(row.get(key)) for key in set_fields):
+		return workout_date, workout_comment, None, None, None, None
+
+	# Names are portable between installations, so they win over IDs
+	if not _blank(row.get('exercise_name')):
+		exercise_id = exercises.get(str(row['exercise_name']).strip().lower())
+		if exercise_id is None:
+			raise ValueError(f"Unknown exercise: {row['exercise_name']}")
+	else:
+		exercise_id = _parse_number(row.get('exercise_id'), 'exercise_id', int)
+		if exercise_id not in exercise_ids:
+			raise ValueError(f"Unknown exercise ID: {exercise_id}")
+
+	return (workout_date, workout_comment, exercise_id,
+	        _parse_number(row.get('weight'), 'weight', float),
+	        _parse_number(row.get('reps'), 'reps', int),
+	        _parse_comment(row.get('set_comment'), 'set_comment'))
+
+
+def _set_key(workout_date, exercise_id, weight, reps):
+	return workout_date, exercise_id, rep_record_weight(weight), reps
+
+
+class _Import:
+	"""
+	State of one import: the exercise lookup, the duplicate counters and the summary.
+	"""
+
+	def __init__(self, user_id, before_commit=None):
+		self.user_id = user_id
+		self.before_commit = before_commit
+		self.summary = {'sets_imported': 0, 'duplicates_skipped': 0, 'workouts_created': 0,
+		                'rows_rejected': 0, 'errors': []}
+
+		# The exercise catalogue resolves every exercise name in the file. Names are matched
+		# case-insensitively, the oldest exercise wins if two share a name.
+		self.exercises = exercise_catalogue.names()
+		self.exercise_ids = {exercise.id for exercise in exercise_catalogue.all()}
+
+		# Occurrences of each set key in the file so far, and how many of them were inserted
+		self.seen = Counter()
+		self.inserted = Counter()
+
+	def reject(self, line, message):
+		self.summary['rows_rejected'] += 1
+		if len(self.summary['errors']) < MAX_REPORTED_ERRORS:
+			self.summary['errors'].append({'line': line, 'message': message})
+
+	def _workouts_by_date(self, dates):
+		workouts = {}
+		query = db.session.query(Workout.id, Workout.workout_date) \
+			.filter(Workout.user_id == self.user_id, Workout.workout_date.in_(dates)) \
+			.order_by(Workout.id)
+		for workout in query:
+			workouts.setdefault(workout.workout_date, workout.id)
+		return workouts
+
+	def import_chunk(self, rows):
+		"""
+		Inserts one chunk of parsed rows in a single transaction.
+		"""
+		dates = {row[0] for row in rows}
+
+		# 1. Find the workouts of these dates, creating the missing ones with one executemany
+		workouts = self._workouts_by_date(dates)
+		new_workouts = {}
+		for workout_date, workout_comment, *_ in rows:
+			if workout_date not in workouts and workout_date not in new_workouts:
+				new_workouts[workout_date] = {'user_id': self.user_id, 'workout_date': workout_date,
+				                              'comment': workout_comment}
+		if new_workouts:
+			db.session.execute(insert(Workout), list(new_workouts.values()))
+			workouts = self._workouts_by_date(dates)
+
+		# 2. Count the sets these workouts already have, per key
+		stored = Counter()
+		query = db.session.query(Workout.workout_date, Set.exercise_id, Set.weight, Set.reps, func.count()) \
+			.join(Workout, Set.workout_id == Workout.id) \
+			.filter(Workout.user_id == self.user_id, Workout.workout_date.in_(dates)) \
+			.group_by(Workout.workout_date, Set.exercise_id, Set.weight, Set.reps)
+		for workout_date, exercise_id, weight, reps, count in query:
+			stored[_set_key(workout_date, exercise_id, weight, reps)] += count
+
+		# 3. Skip the sets that were there before the import. Keys are counted rather than
+		# compared, so repeated sets (3x5 at the same weight) are kept and a re-import adds nothing.
+		new_sets = []
+		added = Counter()
+		for workout_date, _, exercise_id, weight, reps, comment in rows:
+			if exercise_id is None:
+				continue
+			key = _set_key(workout_date, exercise_id, weight, reps)
+			self.seen[key] += 1
+			# stored includes what earlier chunks inserted, but not this one
+			if self.seen[key] <= stored[key] - self.inserted[key]:
+				self.summary['duplicates_skipped'] += 1
+				continue
+			added[key] += 1
+			new_sets.append({'workout_id': workouts[workout_date], 'exercise_id': exercise_id,
+			                 'weight': weight, 'reps': reps, 'comment': comment})
+
+		# 4. Insert the sets with one executemany, then recompute the records and summaries they
+		# change once per exercise and workout; the rollups are rebuilt on their next lookup
+		if new_sets:
+			db.session.execute(insert(Set), new_sets)
+			exercise_ids = sorted({s['exercise_id'] for s in new_sets})
+			for exercise_id in exercise_ids:
+				refresh_personal_record(self.user_id, exercise_id)
+			invalidate_volume(self.user_id, exercise_ids)
+		if new_sets or new_workouts:
+			build_summaries(sorted({s['workout_id'] for s in new_sets} | {workouts[d] for d in new_workouts}))
+		if self.before_commit:
+			self.before_commit()
+		db.session.commit()
+
+		self.inserted.update(added)
+		self.summary['workouts_created'] += len(new_workouts)
+		self.summary['sets_imported'] += len(new_sets)
+
+
+def import_history(user_id, rows, chunk_size=IMPORT_CHUNK_SIZE, progress=None, before_commit=None):
+	"""
+	Imports (line, row) pairs from read_csv or read_ndjson into a user's history.
+	Workouts are matched on their date, sets already stored with the same date, exercise,
+	weight and reps are skipped. Every chunk is committed on its own; before_commit is called
+	in its transaction and progress with the summary after it. Returns the summary.
+	"""
+	state = _Import(user_id, before_commit)
+	chunk = []
+	line = 0
+
+	def flush():
+		state.import_chunk(chunk)
+		chunk.clear()
+		logger.info("Import for user %d: %d sets imported, %d duplicates skipped (line %d)",
+		            user_id, state.summary['sets_imported'], state.summary['duplicates_skipped'], line)
+		if progress:
+			progress(state.summary)
+
+	try:
+		for line, row in rows:
+			try:
+				chunk.append(_parse_row(row, state.exercises, state.exercise_ids))
+			except ValueError as e:
+				state.reject(line, str(e))
+				continue
+			if len(chunk) >= chunk_size:
+				flush()
+		if chunk:
+			flush()
+	except UnicodeDecodeError:
+		db.session.rollback()
+		state.reject(line + 1, "The file is not UTF-8 encoded")
+	except csv.Error as e:
+		db.session.rollback()
+		state.reject(line + 1, f"Invalid CSV: {e}")
+
+	return state.summary
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Imports a CSV or NDJSON training history for a user.')
+	parser.add_argument('file', help='The file to import, e.g. from GET /users/<userID>/export')
+	parser.add_argument('--user', type=int, required=True, help='The ID of the user to import for')
+	parser.add_argument('--format', choices=list(IMPORT_FORMATS),
+	                    help='The file format (default: from the file extension)')
+	parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE, help='Sets per transaction')
+	args = parser.parse_args()
+
+	file_format = args.format or ('csv' if args.file.lower().endswith('.csv') else 'ndjson')
+	read = IMPORT_FORMATS[file_format][0]
+
+	def report(summary):
+		print(f"{summary['sets_imported']} sets imported, {summary['duplicates_skipped']} duplicates skipped, "
+		      f"{summary['rows_rejected']} rows rejected", file=sys.stderr)
+
+	# Imported here so that the app can import this module
+	from app import app, response_generations
+
+	with app.app_context():
+		if db.session.get(User, args.user) is None:
+			sys.exit(f"User {args.user} not found")
+		with open(args.file, 'r', encoding='utf-8-sig', newline='') as f:
+			summary = import_history(args.user, read(f), args.chunk_size, progress=report,
+			                         before_commit=lambda: response_generations.bump(f'user:{args.user}'))
+
+	print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+	main()
@@ -1,7 +1,12 @@
 START TRANSACTION;
 INSERT INTO `schema_version` VALUES
 (1, '1.0.0', '2025-08-27 20:26:29', 'Initial schema creation with exercise, set, workout tables'),
-(2, '1.0.1', '2025-08-28 09:26:29', 'Added user table');
+(2, '1.0.1', '2025-08-28 09:26:29', 'Added user table'),
+(3, '1.1.0', '2025-09-15 20:00:00', 'Added personal_record and rep_record tables'),
+(4, '1.2.0', '2025-09-15 20:00:00', 'Replaced foreign key indexes with composite indexes for history queries'),
+(5, '1.3.0', '2025-09-18 20:00:00', 'Added cache_version table'),
+(6, '1.4.0', '2025-09-22 20:00:00', 'Added volume_rollup table'),
+(7, '1.5.0', '2025-09-29 20:00:00', 'Added workout_summary table');
 COMMIT;
 
 START TRANSACTION;
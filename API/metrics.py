@@ -0,0 +1,179 @@
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+logger = logging.getLogger(__name__)
+
+# Statements slower than this are logged with their SQL
+SLOW_QUERY_SECONDS = float(os.getenv('SLOW_QUERY_MS', 200)) / 1000
+# Requests issuing more statements than this are logged and counted, usually an N+1
+MAX_QUERIES_PER_REQUEST = int(os.getenv('MAX_QUERIES_PER_REQUEST', 20))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+	"""
+	A Prometheus style histogram with one series per label set.
+	"""
+
+	def __init__(self, name, description, buckets):
+		self.name = name
+		self.description = description
+		self.buckets = buckets
+		self._series = {}
+
+	def observe(self, labels, value):
+		series = self._series.get(labels)
+		if series is None:
+			series = self._series[labels] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+		series['counts'][bisect_left(self.buckets, value)] += 1
+		series['sum'] += value
+		series['count'] += 1
+
+	def render(self):
+		lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+		for labels, series in sorted(self._series.items()):
+			cumulative = 0
+			for bound, count in zip(self.buckets + ('+Inf',), series['counts']):
+				cumulative += count
+				lines.append(f'{self.name}_bucket{_labels(labels, le=bound)} {cumulative}')
+			lines.append(f'{self.name}_sum{_labels(labels)} {series["sum"]}')
+			lines.append(f'{self.name}_count{_labels(labels)} {series["count"]}')
+		return lines
+
+
+class Counter:
+	"""
+	A Prometheus style counter with one series per label set.
+	"""
+
+	def __init__(self, name, description):
+		self.name = name
+		self.description = description
+		self._series = {}
+
+	def inc(self, labels, value=1):
+		self._series[labels] = self._series.get(labels, 0) + value
+
+	def render(self):
+		lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+		for labels, value in sorted(self._series.items()):
+			lines.append(f'{self.name}{_labels(labels)} {value}')
+		return lines
+
+
+def _labels(labels, **extra):
+	pairs = list(labels) + [(key, value) for key, value in extra.items()]
+	if not pairs:
+		return ''
+	escaped = [(key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in pairs]
+	return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+_lock = threading.Lock()
+request_latency = Histogram('lifting_request_duration_seconds', 'Request latency by route', LATENCY_BUCKETS)
+request_queries = Histogram('lifting_request_sql_statements', 'SQL statements issued per request', QUERY_COUNT_BUCKETS)
+sql_seconds = Counter('lifting_sql_seconds_total', 'Time spent in SQL statements by route')
+slow_statements = Counter('lifting_slow_sql_statements_total', 'SQL statements slower than SLOW_QUERY_MS by route')
+query_budget_exceeded = Counter('lifting_requests_over_query_budget_total',
+                                'Requests issuing more than MAX_QUERIES_PER_REQUEST statements by route')
+admission_rejections = Counter('lifting_admission_rejected_total',
+                               'Requests rejected by admission control by namespace and reason')
+
+
+def _route_labels():
+	rule = request.url_rule.rule if request.url_rule else 'unmatched'
+	return (('method', request.method), ('route', rule))
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+	conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+	elapsed = time.perf_counter() - conn.info['query_start'].pop()
+
+	if elapsed > SLOW_QUERY_SECONDS:
+		logger.warning("Slow SQL statement (%.1f ms): %s", elapsed * 1000, statement)
+		if has_request_context():
+			with _lock:
+				slow_statements.inc(_route_labels())
+
+	if has_request_context() and 'query_count' in g:
+		g.query_count += 1
+		g.query_seconds += elapsed
+
+
+def _handle_error(exception_context):
+	# after_cursor_execute is not called for a failed statement
+	starts = exception_context.connection.info.get('query_start') if exception_context.connection else None
+	if starts:
+		starts.pop()
+
+
+def _start_request():
+	g.request_start = time.perf_counter()
+	g.query_count = 0
+	g.query_seconds = 0.0
+
+
+def _finish_request(response):
+	if 'request_start' not in g:
+		return response
+
+	elapsed = time.perf_counter() - g.request_start
+	labels = _route_labels()
+	with _lock:
+		request_latency.observe(labels, elapsed)
+		request_queries.observe(labels, g.query_count)
+		sql_seconds.inc(labels, g.query_seconds)
+		if g.query_count > MAX_QUERIES_PER_REQUEST:
+			query_budget_exceeded.inc(labels)
+
+	if g.query_count > MAX_QUERIES_PER_REQUEST:
+		logger.warning("%s %s issued %d SQL statements", request.method, request.path, g.query_count)
+	return response
+
+
+def record_rejection(namespace, reason):
+	"""
+	Counts a request that admission control turned away.
+	"""
+	with _lock:
+		admission_rejections.inc((('namespace', namespace), ('reason', reason)))
+
+
+def init_metrics(app):
+	"""
+	Records the latency and SQL statements of every request of the app.
+	"""
+	if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+		event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+		event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+		event.listen(Engine, 'handle_error', _handle_error)
+	app.before_request(_start_request)
+	app.after_request(_finish_request)
+
+
+def render_metrics(extra=()):
+	"""
+	Renders all metrics of this worker in the Prometheus text format.
+	extra is a list of (name, type, description, value) tuples for values kept elsewhere.
+	"""
+	with _lock:
+		lines = []
+		for metric in (request_latency, request_queries, sql_seconds, slow_statements, query_budget_exceeded,
+		               admission_rejections):
+			lines += metric.render()
+
+	for name, kind, description, value in extra:
+		lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}', f'{name} {value}']
+	return '\n'.join(lines) + '\n'
@@ -0,0 +1,152 @@
+"""
+Applies pending schema migrations. Run it once per deploy, before starting the API:
+
+	cd API && python migrate.py
+	python migrate.py --status
+
+Every applied migration is recorded in schema_version, so only pending steps run.
+An empty database gets the current schema in one step, with every version recorded.
+MySQL commits DDL immediately, so steps are written to be safe to run again
+if a deploy is interrupted between a step and its schema_version row.
+"""
+import argparse
+from collections import namedtuple
+from sqlalchemy import Index, inspect, insert, select
+from models import db, SchemaVersion
+from analytics import store_all_records
+from summary import store_all_summaries
+
+
+Migration = namedtuple('Migration', 'version description upgrade')
+
+
+def _create_tables(*names):
+	def upgrade(connection):
+		for name in names:
+			db.metadata.tables[name].create(connection, checkfirst=True)
+	return upgrade
+
+
+def _create_tables_and_fill(fill, *names):
+	"""
+	Creates the tables, then stores their rows computed from the existing history with fill(connection),
+	so that reads never have to compute and write them. fill replaces any rows already there.
+	"""
+	create = _create_tables(*names)
+
+	def upgrade(connection):
+		create(connection)
+		fill(connection)
+	return upgrade
+
+
+def _composite_indexes(connection):
+	"""
+	Creates the composite indexes of workout and set, then drops the single column
+	indexes they replace. The new index covers the foreign key before the old one goes.
+	"""
+	inspector = inspect(connection)
+	for name, replaced_index, replaced_column in (('workout', 'fk_workout_user', 'user_id'),
+	                                              ('set', 'fk_set_exercise', 'exercise_id')):
+		table = db.metadata.tables[name]
+		existing = {index['name'] for index in inspector.get_indexes(name)}
+		for index in table.indexes:
+			if index.name not in existing:
+				index.create(connection)
+		if replaced_index in existing:
+			Index(replaced_index, table.c[replaced_column]).drop(connection)
+
+
+# In order. Baseline versions (upgrade None) predate this runner and are only recorded.
+MIGRATIONS = [
+	Migration('1.0.0', 'Initial schema creation with exercise, set, workout tables', None),
+	Migration('1.0.1', 'Added user table', None),
+	Migration('1.1.0', 'Added personal_record and rep_record tables', _create_tables_and_fill(store_all_records, 'personal_record', 'rep_record')),
+	Migration('1.2.0', 'Replaced foreign key indexes with composite indexes for history queries', _composite_indexes),
+	Migration('1.3.0', 'Added cache_version table', _create_tables('cache_version')),
+	Migration('1.4.0', 'Added volume_rollup table', _create_tables('volume_rollup')),
+	Migration('1.5.0', 'Added workout_summary table', _create_tables_and_fill(store_all_summaries, 'workout_summary')),
+]
+
+
+def applied_versions(connection):
+	"""
+	Returns the versions recorded in schema_version, or None if the table does not exist.
+	"""
+	if not inspect(connection).has_table(SchemaVersion.__tablename__):
+		return None
+	return {row.version for row in connection.execute(select(SchemaVersion.version))}
+
+
+def pending_migrations(connection):
+	"""
+	Returns the migrations that migrate() would apply, in order.
+	"""
+	applied = applied_versions(connection) or set()
+	return [m for m in MIGRATIONS if m.version not in applied]
+
+
+def _record(connection, migration):
+	connection.execute(insert(SchemaVersion.__table__).values(version=migration.version,
+	                                                          description=migration.description))
+
+
+def migrate(engine, log=print):
+	"""
+	Brings the database of the engine to the latest version. Returns the versions applied.
+	"""
+	with engine.begin() as connection:
+		applied = applied_versions(connection)
+
+		# An empty database: create the current schema and record every version
+		if not applied and not inspect(connection).has_table('user'):
+			db.metadata.create_all(connection)
+			for migration in MIGRATIONS:
+				_record(connection, migration)
+			log(f"Created the schema at version {MIGRATIONS[-1].version}")
+			return [m.version for m in MIGRATIONS]
+
+		# Tables without versions were created before versioning, at the baseline
+		if not applied:
+			SchemaVersion.__table__.create(connection, checkfirst=True)
+			for migration in MIGRATIONS:
+				if migration.upgrade is None:
+					_record(connection, migration)
+
+	done = []
+	for migration in MIGRATIONS:
+		with engine.begin() as connection:
+			if migration.version in applied_versions(connection):
+				continue
+			log(f"Applying {migration.version}: {migration.description}")
+			if migration.upgrade is not None:
+				migration.upgrade(connection)
+			_record(connection, migration)
+		done.append(migration.version)
+
+	log(f"Schema is at version {MIGRATIONS[-1].version}")
+	return done
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Applies pending schema migrations to the API database.')
+	parser.add_argument('--status', action='store_true', help='List pending migrations without applying them')
+	args = parser.parse_args()
+
+	# Importing the app does not connect to the database
+	from app import app
+
+	with app.app_context():
+		if args.status:
+			with db.engine.connect() as connection:
+				pending = pending_migrations(connection)
+			for migration in pending:
+				print(f"Pending {migration.version}: {migration.description}")
+			if not pending:
+				print(f"Schema is at version {MIGRATIONS[-1].version}")
+			return
+		migrate(db.engine)
+
+
+if __name__ == '__main__':
+	main()
@@ -1,7 +1,9 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from replica import RoutingSession
 
-db = SQLAlchemy()
+# Reads of read-only requests may go to a replica, see replica.py
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 # Note: The `__tablename__` is explicitly set to 'user' to avoid conflicts
 # with the 'user' keyword in some databases.
@@ -14,7 +16,8 @@ class User(db.Model):
     enabled = db.Column(db.SmallInteger, default=1)
 
     # Relationship to workouts. 'User' has many 'Workout's.
-    workouts = db.relationship('Workout', backref='user', lazy=True)
+    # Children are removed by the ON DELETE CASCADE foreign keys, not loaded and nulled by the ORM.
+    workouts = db.relationship('Workout', backref='user', lazy=True, passive_deletes=True)
 
 class Exercise(db.Model):
     __tablename__ = 'exercise'
@@ -24,27 +27,95 @@ class Exercise(db.Model):
     date_started = db.Column(db.DateTime, default=datetime.utcnow)
 
     # Relationship to sets. 'Exercise' has many 'Set's.
-    sets = db.relationship('Set', backref='exercise', lazy=True)
+    sets = db.relationship('Set', backref='exercise', lazy=True, passive_deletes=True)
 
 class Workout(db.Model):
     __tablename__ = 'workout'
+    # Serves the per-user workout lists (ordered by date) and the user side of set history joins
+    __table_args__ = (
+        db.Index('ix_workout_user_date', 'user_id', 'workout_date'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     workout_date = db.Column(db.DateTime, nullable=False)
     comment = db.Column(db.String(245))
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     workout_date = db.Column(db.DateTime, default=datetime.utcnow)
 
     # Relationship to sets. 'Workout' has many 'Set's.
-    sets = db.relationship('Set', backref='workout', lazy=True)
+    # Ordered by id so eager-loaded sets come back in the order they were logged.
+    sets = db.relationship('Set', backref='workout', lazy=True, order_by='Set.id', passive_deletes=True)
 
 class Set(db.Model):
     __tablename__ = 'set'
+    # Covers the PR and rep record queries, which never have to read the set rows themselves.
+    # fk_set_workout serves the workout -> sets joins, as in DB/ddl.sql.
+    __table_args__ = (
+        db.Index('ix_set_exercise_workout_weight', 'exercise_id', 'workout_id', 'weight', 'reps'),
+        db.Index('fk_set_workout', 'workout_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    exercise_id = db.Column(db.Integer, db.ForeignKey('exercise.id'))
+    exercise_id = db.Column(db.Integer, db.ForeignKey('exercise.id', ondelete='CASCADE'))
     weight = db.Column(db.Float)
     reps = db.Column(db.Integer)
     comment = db.Column(db.String(245))
-    workout_id = db.Column(db.Integer, db.ForeignKey('workout.id'))
+    workout_id = db.Column(db.Integer, db.ForeignKey('workout.id', ondelete='CASCADE'))
+
+# Personal records per user and exercise, maintained by the set write paths
+# so that looking one up is a single primary-key read.
+class PersonalRecord(db.Model):
+    __tablename__ = 'personal_record'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    exercise_id = db.Column(db.Integer, db.ForeignKey('exercise.id', ondelete='CASCADE'), primary_key=True)
+    max_weight = db.Column(db.Float)
+    max_weight_set_id = db.Column(db.Integer)
+    best_one_rep_max = db.Column(db.Float)
+    best_one_rep_max_set_id = db.Column(db.Integer)
+
+# Most reps done at each weight, per user and exercise.
+# The weight is rounded to 2 decimals and stored as DOUBLE so it can be matched exactly.
+class RepRecord(db.Model):
+    __tablename__ = 'rep_record'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    exercise_id = db.Column(db.Integer, db.ForeignKey('exercise.id', ondelete='CASCADE'), primary_key=True)
+    weight = db.Column(db.Double, primary_key=True)
+    reps = db.Column(db.Integer, nullable=False)
+    set_id = db.Column(db.Integer, nullable=False)
+
+# Version stamps of data that workers cache in memory, e.g. rendered responses and the exercise catalogue.
+# Writes bump the stamp in their transaction; a worker drops or reloads its copy when the stamp changed.
+class CacheVersion(db.Model):
+    __tablename__ = 'cache_version'
+    name = db.Column(db.String(45), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+# Training volume per user and exercise for each week, month and in total, maintained by the
+# set write paths. period is 'week', 'month' or 'total'; period_start is the Monday of the week,
+# the first day of the month, or 1970-01-01 for the total, whose row marks the rollups as built.
+class VolumeRollup(db.Model):
+    __tablename__ = 'volume_rollup'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    exercise_id = db.Column(db.Integer, db.ForeignKey('exercise.id', ondelete='CASCADE'), primary_key=True)
+    period = db.Column(db.String(5), primary_key=True)
+    period_start = db.Column(db.Date, primary_key=True)
+    set_count = db.Column(db.Integer, nullable=False, default=0)
+    rep_count = db.Column(db.Integer, nullable=False, default=0)
+    tonnage = db.Column(db.Double, nullable=False, default=0.0)
+    top_set_id = db.Column(db.Integer)
+    top_weight = db.Column(db.Float)
+    top_reps = db.Column(db.Integer)
+
+# Totals of each workout, maintained by the set write paths so that a workout list shows them
+# without loading any sets. A workout without a row has not been summarized yet, e.g. because
+# it was imported or loaded outside the API; its summary is built on the first lookup.
+class WorkoutSummary(db.Model):
+    __tablename__ = 'workout_summary'
+    workout_id = db.Column(db.Integer, db.ForeignKey('workout.id', ondelete='CASCADE'), primary_key=True)
+    set_count = db.Column(db.Integer, nullable=False, default=0)
+    tonnage = db.Column(db.Double, nullable=False, default=0.0)
+    exercise_count = db.Column(db.Integer, nullable=False, default=0)
+    top_set_id = db.Column(db.Integer)
+    top_weight = db.Column(db.Float)
+    top_reps = db.Column(db.Integer)
 
 # New table for schema versioning
 class SchemaVersion(db.Model):
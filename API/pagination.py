@@ -0,0 +1,114 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(values):
+	"""
+	Encodes the sort key of the last row of a page into an opaque cursor string.
+	"""
+	payload = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+	raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+	return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+	"""
+	Decodes a cursor produced by encode_cursor back into values for the given columns.
+	Raises ValueError if the cursor is malformed.
+	"""
+	try:
+		raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+		values = json.loads(raw)
+	except (ValueError, TypeError):
+		raise ValueError("Invalid cursor")
+
+	if not isinstance(values, list) or len(values) != len(columns):
+		raise ValueError("Invalid cursor")
+
+	decoded = []
+	for column, value in zip(columns, values):
+		python_type = column.type.python_type
+		if python_type is datetime:
+			try:
+				value = datetime.fromisoformat(value)
+			except (ValueError, TypeError):
+				raise ValueError("Invalid cursor")
+		elif python_type is float and isinstance(value, int) and not isinstance(value, bool):
+			value = float(value)
+		# A value of another type, e.g. an object, would only fail once the query runs
+		if not isinstance(value, python_type) or isinstance(value, bool) and python_type is not bool:
+			raise ValueError("Invalid cursor")
+		decoded.append(value)
+	return decoded
+
+
+def _page_limit(limit):
+	if limit is None:
+		return DEFAULT_PAGE_SIZE
+	if limit < 1 or limit > MAX_PAGE_SIZE:
+		raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+	return limit
+
+
+def keyset_page(query, columns, limit=None, after=None):
+	"""
+	Orders a query by the given columns and returns one page of it, starting after the cursor.
+	The cursor is compared on the sort key itself (keyset pagination), so a deep page costs
+	the same as the first one. Returns a (rows, next_cursor) tuple; next_cursor is None on
+	the last page. Without limit and after the whole result is returned.
+	"""
+	query = query.order_by(*columns)
+
+	if limit is None and after is None:
+		return query.all(), None
+
+	limit = _page_limit(limit)
+	if after is not None:
+		values = decode_cursor(after, columns)
+		# (c1, c2, ...) > (v1, v2, ...) spelled out so MySQL can use the index range
+		conditions = []
+		for i, column in enumerate(columns):
+			equal_prefix = [c == v for c, v in zip(columns[:i], values[:i])]
+			conditions.append(and_(*equal_prefix, column > values[i]))
+		query = query.filter(or_(*conditions))
+
+	# Fetch one extra row to find out whether there is a next page
+	rows = query.limit(limit + 1).all()
+	if len(rows) <= limit:
+		return rows, None
+
+	rows = rows[:limit]
+	last = rows[-1]
+	next_cursor = encode_cursor([getattr(last, c.key) for c in columns])
+	return rows, next_cursor
+
+
+def keyset_slice(rows, columns, limit=None, after=None):
+	"""
+	keyset_page for rows already in memory, e.g. from a cache, sorted by the given columns.
+	Takes and returns the same cursors, so a client cannot tell the two apart.
+	"""
+	if limit is None and after is None:
+		return rows, None
+
+	limit = _page_limit(limit)
+	if after is not None:
+		values = decode_cursor(after, columns)
+		try:
+			rows = [row for row in rows if [getattr(row, c.key) for c in columns] > values]
+		except TypeError:
+			raise ValueError("Invalid cursor")
+
+	if len(rows) <= limit:
+		return rows, None
+
+	rows = rows[:limit]
+	last = rows[-1]
+	next_cursor = encode_cursor([getattr(last, c.key) for c in columns])
+	return rows, next_cursor
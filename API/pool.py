@@ -0,0 +1,127 @@
+import itertools
+import threading
+import time
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+
+# Seconds after which a checkout wait counts half as much towards the recent wait
+RECENT_WAIT_HALF_LIFE = 2.0
+
+
+class PoolStats:
+	"""
+	Counters for connection checkouts, shared by a pool and the pools it is recreated as.
+	"""
+
+	def __init__(self):
+		self.checkouts = 0
+		self.timeouts = 0
+		self.total_wait = 0.0
+		self.max_wait = 0.0
+		self._recent_wait = 0.0
+		self._recent_at = time.monotonic()
+		self._waiting = {}
+		self._tickets = itertools.count()
+		self._lock = threading.Lock()
+
+	def _decayed(self, now):
+		return self._recent_wait * 0.5 ** ((now - self._recent_at) / RECENT_WAIT_HALF_LIFE)
+
+	def start_wait(self):
+		"""
+		Registers a checkout that starts waiting, returns the ticket to pass to end_wait().
+		"""
+		ticket = next(self._tickets)
+		with self._lock:
+			self._waiting[ticket] = time.monotonic()
+		return ticket
+
+	def end_wait(self, ticket):
+		with self._lock:
+			self._waiting.pop(ticket, None)
+
+	def record(self, wait, timed_out=False):
+		with self._lock:
+			self.checkouts += 1
+			self.total_wait += wait
+			self.max_wait = max(self.max_wait, wait)
+			if timed_out:
+				self.timeouts += 1
+			now = time.monotonic()
+			self._recent_wait = max(self._decayed(now), wait)
+			self._recent_at = now
+
+	def current_wait(self):
+		"""
+		Returns how long checkouts wait right now: the longest wait still in progress, or the
+		longest recent one. A recent wait halves every RECENT_WAIT_HALF_LIFE seconds, so the
+		value falls back to zero once nothing waits, even if no checkout happens.
+		"""
+		with self._lock:
+			return self._current_wait(time.monotonic())
+
+	def _current_wait(self, now):
+		oldest = min(self._waiting.values(), default=now)
+		return max(now - oldest, self._decayed(now))
+
+	def snapshot(self):
+		with self._lock:
+			return {
+				'checkouts': self.checkouts,
+				'timeouts': self.timeouts,
+				'total_wait_seconds': round(self.total_wait, 6),
+				'avg_wait_seconds': round(self.total_wait / self.checkouts, 6) if self.checkouts else 0.0,
+				'max_wait_seconds': round(self.max_wait, 6),
+				'waiting': len(self._waiting),
+				'current_wait_seconds': round(self._current_wait(time.monotonic()), 6)
+			}
+
+
+class InstrumentedQueuePool(QueuePool):
+	"""
+	A QueuePool that records how long each checkout waits for a connection and how many time out.
+	The wait includes opening a new connection when the pool has none idle.
+	"""
+
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.stats = PoolStats()
+
+	def _do_get(self):
+		ticket = self.stats.start_wait()
+		start = time.perf_counter()
+		try:
+			connection = super()._do_get()
+		except PoolTimeoutError:
+			self.stats.record(time.perf_counter() - start, timed_out=True)
+			raise
+		finally:
+			self.stats.end_wait(ticket)
+		self.stats.record(time.perf_counter() - start)
+		return connection
+
+	def recreate(self):
+		pool = super().recreate()
+		pool.stats = self.stats
+		return pool
+
+
+def pool_status(pool):
+	"""
+	Returns the current occupancy of a pool together with its checkout statistics.
+	"""
+	status = {'pool_class': type(pool).__name__}
+	if isinstance(pool, QueuePool):
+		status.update({
+			'size': pool.size(),
+			'max_overflow': pool._max_overflow,
+			'timeout_seconds': pool.timeout(),
+			'checked_in': pool.checkedin(),
+			'checked_out': pool.checkedout(),
+			'overflow': max(pool.overflow(), 0)
+		})
+	stats = getattr(pool, 'stats', None)
+	if stats is not None:
+		status.update(stats.snapshot())
+	return status
@@ -0,0 +1,147 @@
+import itertools
+import logging
+import threading
+import time
+from functools import wraps
+from flask import current_app
+from flask_sqlalchemy.session import Session
+
+
+logger = logging.getLogger(__name__)
+
+# Bind keys of the replicas are this prefix and the replica's position
+REPLICA_BIND_PREFIX = 'replica_'
+
+
+def replica_binds(uris):
+	"""
+	Returns SQLALCHEMY_BINDS entries for a list of replica URIs.
+	"""
+	return {f'{REPLICA_BIND_PREFIX}{i}': uri for i, uri in enumerate(uris)}
+
+
+def replication_lag(connection):
+	"""
+	Returns how many seconds a replica is behind its source, or None if replication is stopped.
+	A server that is not replicating, or a database without replication such as SQLite, counts as current.
+	"""
+	if connection.dialect.name != 'mysql':
+		return 0.0
+	row = connection.exec_driver_sql('SHOW REPLICA STATUS').mappings().first()
+	if row is None:
+		return 0.0
+	lag = row['Seconds_Behind_Source']
+	return float(lag) if lag is not None else None
+
+
+class ReplicaRouter:
+	"""
+	Picks the replica for read-only requests, round robin over the replicas that are current enough.
+	The lag of each replica is checked at most every check_interval seconds; a replica that is
+	further behind than max_lag, or cannot be reached, is skipped until the next check.
+	"""
+
+	def __init__(self, bind_keys, max_lag=5.0, check_interval=5.0, lag=replication_lag):
+		self.bind_keys = list(bind_keys)
+		self.max_lag = max_lag
+		self.check_interval = check_interval
+		self.lag = lag
+		self._checked = {}
+		self._next = itertools.count()
+		self._lock = threading.Lock()
+
+	def _is_current(self, key, engine):
+		now = time.monotonic()
+		with self._lock:
+			checked = self._checked.get(key)
+			if checked is not None and checked[1] > now:
+				return checked[0]
+
+		try:
+			with engine.connect() as connection:
+				lag = self.lag(connection)
+		except Exception:
+			logger.warning("Replica %s is unreachable, reading from the primary", key, exc_info=True)
+			lag = None
+		current = lag is not None and lag <= self.max_lag
+		if lag is not None and not current:
+			logger.warning("Replica %s is %.1f seconds behind, reading from the primary", key, lag)
+
+		with self._lock:
+			self._checked[key] = (current, now + self.check_interval)
+		return current
+
+	def choose(self, engines):
+		"""
+		Returns the engine of a current replica, or None to read from the primary.
+		"""
+		if not self.bind_keys:
+			return None
+		start = next(self._next)
+		for i in range(len(self.bind_keys)):
+			key = self.bind_keys[(start + i) % len(self.bind_keys)]
+			if self._is_current(key, engines[key]):
+				return engines[key]
+		return None
+
+
+def init_replicas(app, uris, max_lag=5.0, check_interval=5.0):
+	"""
+	Registers the replicas as binds of the app. Must be called before db.init_app(app).
+	"""
+	binds = replica_binds(uris)
+	app.config.setdefault('SQLALCHEMY_BINDS', {}).update(binds)
+	app.extensions['replica_router'] = ReplicaRouter(binds, max_lag, check_interval)
+
+
+class RoutingSession(Session):
+	"""
+	A session that sends the SELECTs of read-only requests to a replica.
+	Everything else goes to the primary: flushes, DML, raw SQL, sessions bound to a connection,
+	and every statement after the first write, so a request reads its own writes.
+	"""
+
+	def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+		if bind is None and self.bind is None and self.info.get('read_only'):
+			if self._flushing or getattr(clause, 'is_dml', False):
+				self.info['read_only'] = False
+			elif getattr(clause, 'is_select', False):
+				engine = self._replica()
+				if engine is not None:
+					return engine
+		return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+	def _replica(self):
+		# The replica is chosen once, so all reads of a request see the same point in time
+		if 'replica' not in self.info:
+			router = current_app.extensions.get('replica_router')
+			self.info['replica'] = router.choose(self._db.engines) if router else None
+		return self.info['replica']
+
+
+def use_replica():
+	"""
+	Lets the reads of the current request go to a replica, unless an earlier use_primary()
+	or write already sent the request to the primary.
+	"""
+	current_app.extensions['sqlalchemy'].session.info.setdefault('read_only', True)
+
+
+def use_primary():
+	"""
+	Sends all further statements of the current request to the primary.
+	"""
+	current_app.extensions['sqlalchemy'].session.info['read_only'] = False
+
+
+def read_only(func):
+	"""
+	Decorator for GET resources that only read, their SELECTs may be served by a replica.
+	"""
+
+	@wraps(func)
+	def wrapper(*args, **kwargs):
+		use_replica()
+		return func(*args, **kwargs)
+
+	return wrapper
@@ -0,0 +1,162 @@
+from sqlalchemy import delete, distinct, func, insert, select
+from models import db, Set, Workout, WorkoutSummary
+from replica import use_primary
+from volume import is_better_top_set, top_set_order
+
+
+# Summaries stored per statement by store_all_summaries
+SUMMARY_CHUNK_SIZE = 5000
+
+
+def _tonnage(weight, reps):
+	return (weight or 0.0) * (reps or 0)
+
+
+def compute_summaries(workout_ids, lock=False, connection=None):
+	"""
+	Computes the summaries of workouts from their sets, with one GROUP BY query for the totals
+	and a window function for the top sets. Returns the column values of each summary by workout ID.
+	With lock the sets are read with a locking read, which sees sets committed meanwhile and makes
+	concurrent inserts into these workouts wait. Runs on connection if given, else on the session.
+	"""
+	workout_ids = list(workout_ids)
+	execute = (connection or db.session).execute
+
+	summaries = {workout_id: {'workout_id': workout_id, 'set_count': 0, 'tonnage': 0.0, 'exercise_count': 0,
+	                          'top_set_id': None, 'top_weight': None, 'top_reps': None}
+	             for workout_id in workout_ids}
+	totals = select(Set.workout_id, func.count(Set.id), func.sum(Set.weight * Set.reps), func.count(distinct(Set.exercise_id))) \
+		.where(Set.workout_id.in_(workout_ids)) \
+		.group_by(Set.workout_id)
+	rank = func.row_number().over(partition_by=Set.workout_id, order_by=top_set_order())
+	ranked = select(Set.workout_id, Set.id, Set.weight, Set.reps, rank.label('rn')) \
+		.where(Set.workout_id.in_(workout_ids), Set.weight.isnot(None))
+	if lock:
+		totals, ranked = totals.with_for_update(read=True), ranked.with_for_update(read=True)
+	ranked = ranked.subquery()
+
+	for workout_id, set_count, tonnage, exercise_count in execute(totals):
+		summaries[workout_id].update(set_count=set_count, tonnage=tonnage or 0.0, exercise_count=exercise_count)
+	for workout_id, set_id, weight, reps in execute(
+			select(ranked.c.workout_id, ranked.c.id, ranked.c.weight, ranked.c.reps).where(ranked.c.rn == 1)):
+		summaries[workout_id].update(top_set_id=set_id, top_weight=weight, top_reps=reps)
+	return summaries
+
+
+def build_summaries(workout_ids):
+	"""
+	Stores the summaries of workouts computed from their sets, replacing the stored ones,
+	e.g. for workouts an import added sets to. The sets are read under a lock. The caller commits.
+	"""
+	workout_ids = list(workout_ids)
+	# Stored summaries must not be computed from a lagging replica
+	use_primary()
+	summaries = compute_summaries(workout_ids, lock=True)
+	WorkoutSummary.query.filter(WorkoutSummary.workout_id.in_(workout_ids)).delete(synchronize_session=False)
+	if summaries:
+		db.session.execute(insert(WorkoutSummary), list(summaries.values()))
+
+
+def store_all_summaries(connection):
+	"""
+	Stores the summary of every workout, replacing any stored ones. For the migration that adds the table.
+	"""
+	workout_ids = connection.execute(select(Workout.id).order_by(Workout.id)).scalars().all()
+	connection.execute(delete(WorkoutSummary))
+	for start in range(0, len(workout_ids), SUMMARY_CHUNK_SIZE):
+		summaries = compute_summaries(workout_ids[start:start + SUMMARY_CHUNK_SIZE], connection=connection)
+		connection.execute(insert(WorkoutSummary), list(summaries.values()))
+
+
+def create_summary(workout_id):
+	"""
+	Adds the empty summary of a new workout.
+	"""
+	db.session.add(WorkoutSummary(workout_id=workout_id, set_count=0, tonnage=0.0, exercise_count=0))
+
+
+def _locked_summary(workout_id):
+	# Locked until the transaction ends, so concurrent writes to one workout do not lose counts.
+	# Loaded again even if the session has it, the lock must come with the latest values.
+	return db.session.get(WorkoutSummary, workout_id, with_for_update=True, populate_existing=True)
+
+
+def _exercise_count(workout_id):
+	return db.session.query(func.count(distinct(Set.exercise_id))).filter(Set.workout_id == workout_id).scalar()
+
+
+def _refresh_top(summary):
+	top = db.session.query(Set.id, Set.weight, Set.reps) \
+		.filter(Set.workout_id == summary.workout_id, Set.weight.isnot(None)) \
+		.order_by(*top_set_order()) \
+		.first()
+	summary.top_set_id, summary.top_weight, summary.top_reps = (top.id, top.weight, top.reps) if top else (None, None, None)
+
+
+def add_sets_to_summary(workout_id, sets):
+	"""
+	Adds new sets of one workout to its summary, locking and writing the summary once.
+	The sets must be flushed so that they have IDs.
+	"""
+	summary = _locked_summary(workout_id)
+	if summary is None:
+		return
+
+	# Only exercises the workout had no other set of add to the count, found with one query
+	exercise_ids = {set_record.exercise_id for set_record in sets}
+	logged = db.session.query(Set.exercise_id).distinct().filter(
+		Set.workout_id == workout_id,
+		Set.exercise_id.in_(exercise_ids),
+		Set.id.notin_([set_record.id for set_record in sets])
+	)
+	summary.exercise_count += len(exercise_ids - {exercise_id for exercise_id, in logged})
+
+	for set_record in sets:
+		summary.set_count += 1
+		summary.tonnage += _tonnage(set_record.weight, set_record.reps)
+		if is_better_top_set(set_record.weight, set_record.reps, set_record.id, summary):
+			summary.top_set_id, summary.top_weight, summary.top_reps = set_record.id, set_record.weight, set_record.reps
+
+
+def add_set_to_summary(set_record):
+	"""
+	Adds a new set to the summary of its workout. The set must be flushed so that it has an ID.
+	"""
+	add_sets_to_summary(set_record.workout_id, [set_record])
+
+
+def change_set_in_summary(set_record, old_weight, old_reps):
+	"""
+	Updates the summary of a workout after the weight or reps of one of its sets changed.
+	The top set is looked up again only if the changed set was the top set.
+	"""
+	summary = _locked_summary(set_record.workout_id)
+	if summary is None:
+		return
+
+	summary.tonnage += _tonnage(set_record.weight, set_record.reps) - _tonnage(old_weight, old_reps)
+	if summary.top_set_id == set_record.id:
+		_refresh_top(summary)
+	elif is_better_top_set(set_record.weight, set_record.reps, set_record.id, summary):
+		summary.top_set_id, summary.top_weight, summary.top_reps = set_record.id, set_record.weight, set_record.reps
+
+
+def remove_sets_from_summary(workout_id, sets):
+	"""
+	Takes deleted sets, as (id, exercise_id, weight, reps) rows of one workout, out of its summary.
+	The sets must be deleted and flushed. The top set is looked up again only if it was deleted.
+	"""
+	summary = _locked_summary(workout_id)
+	if summary is None:
+		return
+
+	removed_top = False
+	for set_id, _, weight, reps in sets:
+		summary.set_count -= 1
+		summary.tonnage -= _tonnage(weight, reps)
+		removed_top = removed_top or summary.top_set_id == set_id
+	if summary.set_count <= 0:
+		summary.set_count, summary.tonnage = 0, 0.0
+	summary.exercise_count = _exercise_count(workout_id)
+	if removed_top:
+		_refresh_top(summary)
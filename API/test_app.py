@@ -1,8 +1,23 @@
-import os, json
+import os, json, gzip, time
+from collections import namedtuple
+from datetime import date, datetime, timedelta
 from dotenv import load_dotenv
-from sqlalchemy import text
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine, event, inspect, insert, select, text
 import pytest
-from app import app as flask_app, db, User, Exercise, Workout, Set
+from flask_restx import marshal
+from app import app as flask_app, db, User, Exercise, Workout, Set, WorkoutSummary, response_cache, user_status_cache
+from app import admission, exercise_model, response_generations, response_stamp, set_model, set_rows, workout_model, workout_rows
+from analytics import get_trend
+from compression import ENCODINGS
+from migrate import MIGRATIONS, migrate, pending_migrations, applied_versions
+from replica import ReplicaRouter, RoutingSession, init_replicas, read_only, use_replica
+from admission import RateLimiter
+from pagination import MAX_PAGE_SIZE, encode_cursor
+from pool import PoolStats, RECENT_WAIT_HALF_LIFE
+from catalogue import EXERCISES, ExerciseCatalogue, exercise_catalogue
+from versions import bump_version, stored_version
 
 # Load environment variables from the .env file
 load_dotenv()
@@ -77,6 +92,7 @@ def session(app, seed_database):
 		connection = db.engine.connect()
 		transaction = connection.begin()
 
+		scoped_session = db.session
 		db.session = db._make_scoped_session(options={'bind': connection})
 
 		yield db.session
@@ -84,6 +100,14 @@ def session(app, seed_database):
 		db.session.remove()
 		transaction.rollback()
 		connection.close()
+		db.session = scoped_session
+
+		# The rolled back data must not be served from the in-process caches
+		response_cache.clear()
+		user_status_cache.clear()
+		exercise_catalogue.clear()
+		for control in admission.values():
+			control.reset()
 
 
 def test_add_user_success(test_client, session):
@@ -347,3 +371,945 @@ def test_gets_sets(test_client, app, session):
 	assert len(data) == 3
 	for i in range(len(data)):
 		print(f"--- Set {data[i]['id']}: {data[i]['weight']} x {data[i]['reps']}")
+
+
+def test_paginate_workouts(test_client, app, session):
+	"""
+	Test keyset pagination of /workouts/<int:userID>/get with limit and the X-Next-Cursor header
+	"""
+
+	headers = {
+		'X-User-ID': 1,
+		'X-User-Role': 'admin'
+	}
+
+	print("\n--- Retrieving all workouts for user 1 in one response ---")
+	res = test_client.get('/workouts/1/get', headers=headers)
+	assert res.status_code == 200
+	all_ids = [w['id'] for w in res.get_json()]
+	assert 'X-Next-Cursor' not in res.headers
+
+	print("--- Walking the same workouts two at a time ---")
+	paged_ids = []
+	url = '/workouts/1/get?limit=2'
+	while True:
+		res = test_client.get(url, headers=headers)
+		assert res.status_code == 200
+		page = res.get_json()
+		assert len(page) <= 2
+		paged_ids += [w['id'] for w in page]
+		cursor = res.headers.get('X-Next-Cursor')
+		if cursor is None:
+			break
+		url = f'/workouts/1/get?limit=2&after={cursor}'
+
+	print(f"--- Paged workout ids: {paged_ids} ---")
+	assert paged_ids == all_ids
+
+	res = test_client.get('/workouts/1/get?limit=2&after=not-a-cursor', headers=headers)
+	assert res.status_code == 400
+	# Well-formed, but the values do not have the types of the sort columns
+	for values in ([{'a': 1}, 1], ['2024-01-01T00:00:00', 'one'], ['2024-01-01T00:00:00', True]):
+		res = test_client.get(f'/workouts/1/get?limit=2&after={encode_cursor(values)}', headers=headers)
+		assert res.status_code == 400
+
+
+def test_get_workouts_with_sets(test_client, app, session):
+	"""
+	Test the /workouts/<int:userID>/getwithsets endpoint against the per-workout /sets/<int:workoutID> calls
+	"""
+
+	headers = {
+		'X-User-ID': 1,
+		'X-User-Role': 'admin'
+	}
+
+	print("\n--- Retrieving workouts with nested sets for user 1 ---")
+	res = test_client.get('/workouts/1/getwithsets', headers=headers)
+	assert res.status_code == 200
+	workouts = res.get_json()
+	workout_ids = [w['id'] for w in test_client.get('/workouts/1/get', headers=headers).get_json()]
+	assert [w['id'] for w in workouts] == workout_ids
+
+	for workout in workouts:
+		res_sets = test_client.get(f"/sets/{workout['id']}", headers=headers)
+		assert res_sets.status_code == 200
+		assert workout['sets'] == res_sets.get_json()
+		print(f"--- Workout {workout['id']}: {len(workout['sets'])} sets ---")
+
+
+def test_add_sets_in_bulk(test_client, app, session):
+	"""
+	Test the /sets/bulk endpoint with sets across two workouts and one invalid item
+	"""
+
+	headers = {
+		'X-User-ID': 1,
+		'X-User-Role': 'admin'
+	}
+
+	payload = [
+		{'workout_id': 1, 'exercise_id': 1, 'weight': 100, 'reps': 3, 'comment': 'bulk one'},
+		{'workout_id': 4, 'exercise_id': 2, 'weight': 170, 'reps': 5},
+		{'workout_id': 4, 'exercise_id': 999, 'weight': 170, 'reps': 5},
+		{'workout_id': 'four', 'exercise_id': 2}
+	]
+	print(f"\n--- Adding {len(payload)} sets via POST /sets/bulk ---")
+	res = test_client.post('/sets/bulk', json=payload, headers=headers)
+	assert res.status_code == 200
+	results = res.get_json()
+	assert [r['status'] for r in results] == [201, 201, 404, 400]
+
+	print("--- Verifying the created sets are listed with their workouts ---")
+	for result, item in zip(results[:2], payload[:2]):
+		res_sets = test_client.get(f"/sets/{item['workout_id']}", headers=headers)
+		created = [s for s in res_sets.get_json() if s['id'] == result['id']]
+		assert len(created) == 1
+		assert created[0]['weight'] == item['weight']
+
+
+def test_personal_record_follows_set_changes(test_client, app, session):
+	"""
+	Test that /findpr is kept up to date when a set is added, lowered and deleted
+	"""
+
+	headers = {
+		'X-User-ID': 1,
+		'X-User-Role': 'admin'
+	}
+	pr_url = '/analytics/users/1/exercises/1/findpr'
+
+	print("\n--- Reading the initial PR for user 1, exercise 1 ---")
+	res = test_client.get(pr_url, headers=headers)
+	assert res.status_code == 200
+	initial = res.get_json()
+
+	print("--- Adding a heavier set ---")
+	res_post = test_client.post('/sets/1', json={'exercise_id': 1, 'weight': initial['max_weight'] + 50, 'reps': 2}, headers=headers)
+	assert res_post.status_code == 201
+	set_id = res_post.get_json()['id']
+	data = test_client.get(pr_url, headers=headers).get_json()
+	assert data['max_weight'] == initial['max_weight'] + 50
+	assert data['max_weight_set_id'] == set_id
+	assert {'weight': initial['max_weight'] + 50, 'reps': 2, 'set_id': set_id} in data['rep_records']
+
+	print("--- Lowering the record set below the old PR ---")
+	res_put = test_client.put(f'/sets/{set_id}/update', json={'weight': 10}, headers=headers)
+	assert res_put.status_code == 200
+	data = test_client.get(pr_url, headers=headers).get_json()
+	assert data['max_weight'] == initial['max_weight']
+	assert data['max_weight_set_id'] == initial['max_weight_set_id']
+
+	print("--- Deleting the set ---")
+	res_delete = test_client.delete(f'/sets/{set_id}/delete', headers=headers)
+	assert res_delete.status_code == 204
+	data = test_client.get(pr_url, headers=headers).get_json()
+	assert data == initial
+
+
+def test_one_rep_max_series(test_client, app, session):
+	"""
+	Test the batch 1RM endpoints against the single set /calc1rm endpoint
+	"""
+
+	headers = {
+		'X-User-ID': 1,
+		'X-User-Role': 'admin'
+	}
+
+	print("\n--- Calculating the Epley 1RM series for user 1, exercise 1 ---")
+	res = test_client.get('/analytics/users/1/exercises/1/e1rm', headers=headers)
+	assert res.status_code == 200
+	data = res.get_json()
+	assert data['formula'] == 'epley'
+	assert len(data['sets']) > 0
+	for point in data['sets']:
+		single = test_client.get(f"/analytics/sets/{point['set_id']}/calc1rm", headers=headers).get_json()
+		assert point['one_rep_max'] == single['one_rep_max']
+
+	for formula in ['brzycki', 'lombardi', 'mayhew', 'oconner']:
+		res = test_client.get(f'/analytics/sets/e1rm?ids=1,2,3&formula={formula}', headers=headers)
+		assert res.status_code == 200
+		points = res.get_json()['sets']
+		assert sorted(p['set_id'] for p in points) == [1, 2, 3]
+		assert all(p['one_rep_max'] > p['weight'] for p in points)
+		print(f"--- {formula}: {[p['one_rep_max'] for p in points]} ---")
+
+	res = test_client.get('/analytics/sets/e1rm?ids=1&formula=unknown', headers=headers)
+	assert res.status_code == 400
+	ids = ','.join(str(i) for i in range(1, MAX_PAGE_SIZE + 2))
+	res = test_client.get(f'/analytics/sets/e1rm?ids={ids}', headers=headers)
+	assert res.status_code == 400
+
+
+def test_disabled_user_is_rejected(test_client, app, session):
+	"""
+	Test that a disabled user is rejected by every endpoint and accepted again once enabled
+	"""
+
+	admin_headers = {
+		'X-User-ID': 1,
+		'X-User-Role': 'admin'
+	}
+	user_headers = {
+		'X-User-ID': 2,
+		'X-User-Role': 'user'
+	}
+
+	print("\n--- User 2 can list their workouts ---")
+	assert test_client.get('/workouts/2/get', headers=user_headers).status_code == 200
+
+	print("--- Disabled user 2 is rejected ---")
+	assert test_client.put('/users/2/disable', headers=admin_headers).status_code == 200
+	assert test_client.get('/workouts/2/get', headers=user_headers).status_code == 403
+
+	print("--- Enabled user 2 is accepted again ---")
+	assert test_client.put('/users/2/enable', headers=admin_headers).status_code == 200
+	assert test_client.get('/workouts/2/get', headers=user_headers).status_code == 200
+
+	print("--- Unknown users are not authenticated ---")
+	assert test_client.get('/exercises/', headers={'X-User-ID': 999, 'X-User-Role': 'admin'}).status_code == 401
+	assert test_client.get('/workouts/999/get', headers=admin_headers).status_code == 404
+
+
+def test_conditional_get_exercises(test_client, app, session, monkeypatch):
+	"""
+	Test the ETag of /exercises/ and that adding an exercise invalidates it
+	"""
+
+	headers = {
+		'X-User-ID': 1,
+		'X-User-Role': 'admin'
+	}
+
+	print("\n--- Getting the exercise list and its ETag ---")
+	res = test_client.get('/exercises/', headers=headers)
+	assert res.status_code == 200
+	etag = res.headers['ETag']
+
+	print(f"--- Revalidating with If-None-Match: {etag} ---")
+	res = test_client.get('/exercises/', headers={**headers, 'If-None-Match': etag})
+	assert res.status_code == 304
+	assert res.data == b''
+
+	print("--- Adding an exercise changes the ETag ---")
+	res = test_client.post('/exercises/', json={'name': 'Shrug', 'description': 'Barbell shrug'}, headers=headers)
+	assert res.status_code == 201
+	res = test_client.get('/exercises/', headers={**headers, 'If-None-Match': etag})
+	assert res.status_code == 200
+	assert res.headers['ETag'] != etag
+	assert 'Shrug' in [ex['name'] for ex in res.get_json()]
+
+	print("--- An exercise added by another worker changes the ETag too ---")
+	# Read the stamps on every request rather than every few seconds
+	monkeypatch.setattr(response_generations, 'check_interval', 0)
+	etag = res.headers['ETag']
+	session.add(Exercise(name='Lunge', description='Walking lunge'))
+	bump_version(EXERCISES)
+	bump_version(response_stamp('exercises'))
+	session.flush()
+	res = test_client.get('/exercises/', headers={**headers, 'If-None-Match': etag})
+	assert res.status_code == 200
+	assert 'Lunge' in [ex['name'] for ex in res.get_json()]
+
+	print("--- The cache does not bypass authorization ---")
+	res = test_client.get('/exercises/', headers={'If-None-Match': etag})
+	assert res.status_code == 401
+
+
+def test_pool_status(test_client, app, session):
+	"""
+	Test the /admin/pool endpoint
+	"""
+
+	headers = {
+		'X-User-ID': 1,
+		'X-User-Role': 'admin'
+	}
+
+	print("\n--- Getting the connection pool status ---")
+	res = test_client.get('/admin/pool', headers=headers)
+	assert res.status_code == 200
+	data = res.get_json()
+	assert data['checkouts'] > 0
+	print(f"--- Pool status: {data} ---")
+
+	res = test_client.get('/admin/pool', headers={'X-User-ID': 1, 'X-User-Role': 'user'})
+	assert res.status_code == 403
+
+
+def test_metrics(test_client, app, session):
+	"""
+	Test that /metrics reports the latency and SQL statements of the routes that were called
+	"""
+
+	headers = {
+		'X-User-ID': 1,
+		'X-User-Role': 'admin'
+	}
+
+	assert test_client.get('/sets/1', headers=headers).status_code == 200
+
+	print("\n--- Getting the Prometheus metrics ---")
+	res = test_client.get('/metrics', headers=headers)
+	assert res.status_code == 200
+	assert res.mimetype == 'text/plain'
+	body = res.get_data(as_text=True)
+	assert 'lifting_request_duration_seconds_count{method="GET",route="/sets/<int:workoutID>"}' in body
+	assert 'lifting_request_sql_statements_bucket{method="GET",route="/sets/<int:workoutID>",le="+Inf"}' in body
+	assert 'lifting_db_pool_checked_out' in body
+
+	res = test_client.get('/metrics', headers={'X-User-ID': 1, 'X-User-Role': 'report'})
+	assert res.status_code == 403
+
+
+def test_export_user_history(test_client, app, session):
+	"""
+	Test that the NDJSON and CSV exports contain every workout and set of the user
+	"""
+
+	headers = {
+		'X-User-ID': 1,
+		'X-User-Role': 'user'
+	}
+
+	workouts = test_client.get('/workouts/1/getwithsets', headers=headers).get_json()
+
+	print("\n--- Exporting the history as NDJSON ---")
+	res = test_client.get('/users/1/export', headers=headers)
+	assert res.status_code == 200
+	assert res.mimetype == 'application/x-ndjson'
+	assert res.is_streamed
+	lines = [json.loads(line) for line in res.get_data(as_text=True).splitlines()]
+	assert [w['id'] for w in lines] == [w['id'] for w in workouts]
+	assert [len(w['sets']) for w in lines] == [len(w['sets']) for w in workouts]
+
+	print("--- Exporting the history as CSV ---")
+	res = test_client.get('/users/1/export?format=csv', headers=headers)
+	assert res.status_code == 200
+	assert res.mimetype == 'text/csv'
+	rows = res.get_data(as_text=True).splitlines()
+	assert rows[0].startswith('workout_id,workout_date')
+	assert len(rows) - 1 == sum(max(len(w['sets']), 1) for w in workouts)
+
+	res = test_client.get('/users/2/export', headers=headers)
+	assert res.status_code == 403
+
+
+def test_import_user_history(test_client, app, session):
+	"""
+	Test importing a history, that a re-import adds nothing and that repeated sets are kept
+	"""
+
+	headers = {
+		'X-User-ID': 1,
+		'X-User-Role': 'user'
+	}
+
+	print("\n--- Re-importing the user's own export ---")
+	export = test_client.get('/users/1/export?format=csv', headers=headers).get_data()
+	res = test_client.post('/users/1/import', data=export, headers=headers, content_type='text/csv')
+	assert res.status_code == 200
+	assert res.get_json()['sets_imported'] == 0
+	assert res.get_json()['rows_rejected'] == 0
+
+	print("--- Importing new sets from NDJSON ---")
+	lines = [
+		{'workout_date': '2020-01-06T18:00:00', 'comment': 'Imported', 'sets': [
+			{'exercise_name': 'squat', 'weight': 100, 'reps': 5},
+			{'exercise_name': 'Squat', 'weight': 100, 'reps': 5},
+			{'exercise_name': 'Not an exercise', 'weight': 20, 'reps': 10}
+		]},
+		{'workout_date': '2020-01-08T18:00:00', 'exercise_id': 4, 'weight': 80, 'reps': 'five'}
+	]
+	body = '\n'.join(json.dumps(line) for line in lines)
+	res = test_client.post('/users/1/import?format=ndjson', data=body, headers=headers)
+	assert res.status_code == 200
+	summary = res.get_json()
+	assert summary['sets_imported'] == 2
+	assert summary['workouts_created'] == 1
+	assert summary['rows_rejected'] == 2
+	assert [e['line'] for e in summary['errors']] == [1, 2]
+
+	res = test_client.post('/users/1/import?format=ndjson', data=body, headers=headers)
+	assert res.get_json()['sets_imported'] == 0
+	assert res.get_json()['duplicates_skipped'] == 2
+
+	res = test_client.post('/users/1/import', data=body, headers=headers, content_type='text/plain')
+	assert res.status_code == 415
+
+
+def test_volume_rollups_follow_set_changes(test_client, app, session):
+	"""
+	Test that the weekly and monthly volume matches the sets after sets are added, changed and deleted
+	"""
+
+	headers = {
+		'X-User-ID': 1,
+		'X-User-Role': 'user'
+	}
+
+	def expected(period):
+		buckets = {}
+		for workout in test_client.get('/workouts/1/getwithsets', headers=headers).get_json():
+			day = datetime.fromisoformat(workout['workout_date']).date()
+			start = day - timedelta(days=day.weekday()) if period == 'week' else day.replace(day=1)
+			for s in workout['sets']:
+				if s['exercise_id'] != 1:
+					continue
+				bucket = buckets.setdefault(start.isoformat(), {'set_count': 0, 'rep_count': 0, 'tonnage': 0.0, 'top': None})
+				bucket['set_count'] += 1
+				bucket['rep_count'] += s['reps']
+				bucket['tonnage'] += s['weight'] * s['reps']
+				if bucket['top'] is None or (s['weight'], s['reps']) > bucket['top'][1:]:
+					bucket['top'] = (s['id'], s['weight'], s['reps'])
+		return buckets
+
+	def check():
+		for period in ('week', 'month'):
+			res = test_client.get(f'/analytics/users/1/exercises/1/volume?period={period}', headers=headers)
+			assert res.status_code == 200
+			actual = {
+				row['period_start']: {'set_count': row['set_count'], 'rep_count': row['rep_count'],
+				                      'tonnage': pytest.approx(row['tonnage']),
+				                      'top': (row['top_set_id'], row['top_weight'], row['top_reps'])}
+				for row in res.get_json()
+			}
+			assert actual == expected(period)
+
+	print("\n--- Building the rollups ---")
+	check()
+
+	print("--- Adding, changing and deleting sets ---")
+	res = test_client.post('/sets/1', data={'exercise_id': 1, 'weight': 120, 'reps': 2}, headers=headers)
+	new_id = res.get_json()['id']
+	check()
+	test_client.put(f'/sets/{new_id}/update', data={'weight': 90}, headers=headers)
+	check()
+	test_client.delete(f'/sets/{new_id}/delete', headers=headers)
+	check()
+
+	res = test_client.get('/analytics/users/1/exercises/1/volume?period=total', headers=headers)
+	assert len(res.get_json()) == 1
+	assert res.get_json()[0]['set_count'] == sum(b['set_count'] for b in expected('week').values())
+
+
+def test_workout_summaries_follow_set_changes(test_client, app, session):
+	"""
+	Test that the workout list returns set totals that match the sets after sets are added, changed and deleted
+	"""
+
+	headers = {
+		'X-User-ID': 1,
+		'X-User-Role': 'user'
+	}
+
+	def check():
+		expected = {}
+		for workout in test_client.get('/workouts/1/getwithsets', headers=headers).get_json():
+			weighted = [s for s in workout['sets'] if s['weight'] is not None]
+			top = min(weighted, key=lambda s: (-s['weight'], -(s['reps'] or 0), s['id'])) if weighted else None
+			expected[workout['id']] = {
+				'set_count': len(workout['sets']),
+				'tonnage': pytest.approx(sum((s['weight'] or 0) * (s['reps'] or 0) for s in workout['sets'])),
+				'exercise_count': len({s['exercise_id'] for s in workout['sets']}),
+				'top': (top['id'], top['weight'], top['reps']) if top else (None, None, None)
+			}
+		res = test_client.get('/workouts/1/get', headers=headers)
+		assert res.status_code == 200
+		actual = {
+			w['id']: {'set_count': w['set_count'], 'tonnage': w['tonnage'], 'exercise_count': w['exercise_count'],
+			          'top': (w['top_set_id'], w['top_weight'], w['top_reps'])}
+			for w in res.get_json()
+		}
+		assert actual == expected
+
+	print("\n--- Building the summaries of the seeded workouts ---")
+	check()
+
+	print("--- Adding, changing and deleting sets ---")
+	res = test_client.post('/sets/1', data={'exercise_id': 4, 'weight': 500, 'reps': 1}, headers=headers)
+	new_id = res.get_json()['id']
+	check()
+	test_client.put(f'/sets/{new_id}/update', data={'weight': 90}, headers=headers)
+	check()
+	test_client.delete(f'/sets/{new_id}/delete', headers=headers)
+	check()
+	test_client.post('/sets/bulk', json=[{'workout_id': 4, 'exercise_id': 1, 'weight': 200, 'reps': 2}], headers=headers)
+	check()
+
+	print("--- A new workout starts with an empty summary ---")
+	res = test_client.post('/workouts/1/add', data={'workout_date': '2025-09-01 18:00:00'}, headers=headers)
+	workout_id = res.get_json()['id']
+	check()
+	test_client.post(f'/sets/{workout_id}', data={'exercise_id': 2, 'weight': 60, 'reps': 10}, headers=headers)
+	check()
+
+	print("--- Listing only some totals ---")
+	res = test_client.get('/workouts/1/get?fields=id,set_count', headers=headers)
+	assert all(list(w) == ['id', 'set_count'] for w in res.get_json())
+
+
+def test_trend(test_client, app, session):
+	"""
+	Test the rolling best, rate of change and plateau detection of the trend endpoint
+	"""
+
+	headers = {
+		'X-User-ID': 1,
+		'X-User-Role': 'user'
+	}
+
+	print("\n--- Computing a trend from weekly bests ---")
+	Row = namedtuple('Row', 'week_start reps weight')
+	monday = date(2025, 1, 6)
+	rows = [Row(monday, 1, 100), Row(monday, 5, 90), Row(monday + timedelta(weeks=1), 1, 110),
+	        Row(monday + timedelta(weeks=3), 1, 105), Row(monday + timedelta(weeks=4), 1, 104)]
+	trend = get_trend(rows, 'epley', window=2, plateau_weeks=3)
+	assert [w['best_one_rep_max'] for w in trend['weeks']] == [105.0, 113.67, None, 108.5, 107.47]
+	assert [w['rolling_best'] for w in trend['weeks']] == [105.0, 113.67, 113.67, 108.5, 108.5]
+	assert [w['change_per_week'] for w in trend['weeks']] == [None, None, 4.34, -2.59, -2.59]
+	assert trend['best_week_start'] == monday + timedelta(weeks=1)
+	assert trend['weeks_since_best'] == 3
+	assert trend['plateau']
+
+	print("--- Getting the trend of a user's exercise ---")
+	res = test_client.get('/analytics/users/1/exercises/1/trend?window=2', headers=headers)
+	assert res.status_code == 200
+	data = res.get_json()
+	assert data['window_weeks'] == 2
+	assert data['best_one_rep_max'] == max(w['best_one_rep_max'] or 0 for w in data['weeks'])
+
+	res = test_client.get('/analytics/users/1/exercises/1/trend?window=0', headers=headers)
+	assert res.status_code == 400
+
+
+def test_serialized_lists_match_marshal(test_client, app, session):
+	"""
+	Test that lists serialized from column tuples are identical to the marshalled ORM objects
+	"""
+	print("\n--- Comparing sets and workouts with their marshalled JSON ---")
+	for model, rows, entity, order in ((set_model, set_rows, Set, Set.id), (workout_model, workout_rows, Workout, Workout.id)):
+		expected = marshal(entity.query.order_by(order).all(), model)
+		actual = json.loads(rows.dumps(db.session.query(*rows.columns).order_by(order).all()))
+		assert actual == expected
+		assert [list(item) for item in actual] == [list(item) for item in expected]
+
+	print("--- Listing the sets of a workout ---")
+	headers = {'X-User-ID': 1, 'X-User-Role': 'admin'}
+	res = test_client.get('/sets/1', headers=headers)
+	assert res.status_code == 200
+	assert res.get_json() == marshal(Set.query.filter_by(workout_id=1).order_by(Set.id).all(), set_model)
+
+
+def test_sparse_fieldsets(test_client, app, session):
+	"""
+	Test that ?fields= limits the fields of list endpoints and rejects unknown fields
+	"""
+	headers = {'X-User-ID': 1, 'X-User-Role': 'admin'}
+
+	print("\n--- Listing only the IDs and dates of workouts ---")
+	full = test_client.get('/workouts/1/get', headers=headers).get_json()
+	res = test_client.get('/workouts/1/get?fields=workout_date,id', headers=headers)
+	assert res.status_code == 200
+	assert res.get_json() == [{'id': w['id'], 'workout_date': w['workout_date']} for w in full]
+
+	print("--- Paging through a sparse list ---")
+	res = test_client.get('/workouts/1/get?fields=comment&limit=1', headers=headers)
+	assert res.get_json() == [{'comment': full[0]['comment']}]
+	res = test_client.get(f"/workouts/1/get?fields=comment&limit=1&after={res.headers['X-Next-Cursor']}", headers=headers)
+	assert res.get_json() == [{'comment': full[1]['comment']}]
+
+	print("--- Listing sparse sets, exercises and nested workouts ---")
+	res = test_client.get('/sets/1?fields=reps', headers=headers)
+	assert res.status_code == 200
+	assert all(list(s) == ['reps'] for s in res.get_json())
+	res = test_client.get('/exercises/?fields=id,name', headers=headers)
+	assert all(list(e) == ['id', 'name'] for e in res.get_json())
+	res = test_client.get('/workouts/1/getwithsets?fields=id', headers=headers)
+	assert res.get_json() == [{'id': w['id']} for w in full]
+
+	print("--- Rejecting unknown fields ---")
+	res = test_client.get('/exercises/?fields=name,password', headers=headers)
+	assert res.status_code == 400
+	assert 'password' in res.get_json()['message']
+
+
+def test_response_compression(test_client, app, session):
+	"""
+	Test that responses are compressed as negotiated, keep revalidating and stream compressed exports
+	"""
+	headers = {'X-User-ID': 1, 'X-User-Role': 'admin'}
+	plain = test_client.get('/workouts/1/getwithsets', headers=headers)
+	assert 'Content-Encoding' not in plain.headers
+	assert 'Accept-Encoding' in plain.headers['Vary']
+
+	print("\n--- Negotiating each supported encoding ---")
+	decoders = {'gzip': gzip.decompress}
+	if 'br' in ENCODINGS:
+		import brotli
+		decoders['br'] = brotli.decompress
+	if 'zstd' in ENCODINGS:
+		import zstandard
+		decoders['zstd'] = lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data)
+	for encoding, decompress in decoders.items():
+		res = test_client.get('/workouts/1/getwithsets', headers=dict(headers, **{'Accept-Encoding': f'identity;q=0.5, {encoding}'}))
+		assert res.headers['Content-Encoding'] == encoding
+		assert decompress(res.get_data()) == plain.get_data()
+
+	print("--- Revalidating a compressed response ---")
+	res = test_client.get('/workouts/1/getwithsets', headers=dict(headers, **{'Accept-Encoding': 'gzip'}))
+	assert res.headers['ETag'].startswith('W/')
+	res = test_client.get('/workouts/1/getwithsets', headers=dict(headers, **{'Accept-Encoding': 'gzip', 'If-None-Match': res.headers['ETag']}))
+	assert res.status_code == 304
+	assert res.headers['ETag'].startswith('W/')
+
+	print("--- Leaving small responses uncompressed ---")
+	res = test_client.get('/exercises/?limit=1', headers=dict(headers, **{'Accept-Encoding': 'gzip'}))
+	assert 'Content-Encoding' not in res.headers
+
+	print("--- Streaming a compressed export ---")
+	res = test_client.get('/users/1/export?format=csv', headers=dict(headers, **{'Accept-Encoding': 'gzip'}))
+	assert res.headers['Content-Encoding'] == 'gzip'
+	assert gzip.decompress(res.get_data()) == test_client.get('/users/1/export?format=csv', headers=headers).get_data()
+
+
+def test_batch(test_client, app, session):
+	"""
+	Test that /batch runs its operations in one transaction and resolves references to earlier results
+	"""
+
+	headers = {
+		'X-User-ID': 1,
+		'X-User-Role': 'user'
+	}
+
+	print("\n--- Creating a workout, adding sets to it and reading it back in one batch ---")
+	operations = [
+		{'op': 'create_workout', 'args': {'user_id': 1, 'workout_date': '2024-05-01 18:00:00', 'comment': 'batch'}},
+		{'op': 'add_set', 'args': {'workout_id': '$0.id', 'exercise_id': 1, 'weight': 100, 'reps': 5}},
+		{'op': 'add_set', 'args': {'workout_id': '$0.id', 'exercise_id': 2, 'weight': 62.5, 'reps': 8}},
+		{'op': 'update_set', 'args': {'set_id': '$2.id', 'reps': 6}},
+		{'op': 'get_workout', 'args': {'workout_id': '$0.id'}}
+	]
+	res = test_client.post('/batch', json={'operations': operations}, headers=headers)
+	assert res.status_code == 200
+	results = res.get_json()
+	assert [r['status'] for r in results] == [201, 201, 201, 200, 200]
+	workout = results[4]['result']
+	assert workout['id'] == results[0]['result']['id']
+	assert [(s['exercise_id'], s['weight'], s['reps']) for s in workout['sets']] == [(1, 100, 5), (2, 62.5, 6)]
+	listed = test_client.get(f"/sets/{workout['id']}", headers=headers).get_json()
+	assert [(s['id'], s['reps']) for s in listed] == [(s['id'], s['reps']) for s in workout['sets']]
+
+	print("--- A failing operation undoes the whole batch ---")
+	before = test_client.get('/sets/1', headers=headers).get_json()
+	operations = [
+		{'op': 'add_set', 'args': {'workout_id': 1, 'exercise_id': 1, 'weight': 100, 'reps': 5}},
+		{'op': 'delete_set', 'args': {'set_id': before[0]['id']}},
+		{'op': 'add_set', 'args': {'workout_id': 1, 'exercise_id': 999, 'weight': 100, 'reps': 5}}
+	]
+	res = test_client.post('/batch', json={'operations': operations}, headers=headers)
+	assert res.status_code == 404
+	assert res.get_json()['index'] == 2
+	assert test_client.get('/sets/1', headers=headers).get_json() == before
+
+	print("--- Invalid operations are rejected ---")
+	for operations in ([{'op': 'get_workout', 'args': {'workout_id': '$0.id'}}],
+	                   [{'op': 'drop_table', 'args': {}}],
+	                   [{'op': 'add_set', 'args': {'workout_id': 1, 'exercise_id': 1, 'reps': 'five'}}]):
+		res = test_client.post('/batch', json={'operations': operations}, headers=headers)
+		assert res.status_code == 400
+		assert res.get_json()['index'] == 0
+
+	res = test_client.post('/batch', json={'operations': [{'op': 'create_workout', 'args': {'user_id': 2}}]},
+	                       headers=headers)
+	assert res.status_code == 403
+
+
+def test_exercise_catalogue(test_client, app, session):
+	"""
+	Test that exercises are served from the in-process catalogue and reloaded when the version stamp changes
+	"""
+
+	headers = {
+		'X-User-ID': 1,
+		'X-User-Role': 'admin'
+	}
+
+	print("\n--- Listing and paging exercises from the catalogue ---")
+	stored = marshal(Exercise.query.order_by(Exercise.id).all(), exercise_model)
+	res = test_client.get('/exercises/', headers=headers)
+	assert res.status_code == 200
+	assert res.get_json() == stored
+	res = test_client.get('/exercises/?limit=2&fields=name', headers=headers)
+	assert res.get_json() == [{'name': e['name']} for e in stored[:2]]
+	res = test_client.get(f"/exercises/?limit=2&after={res.headers['X-Next-Cursor']}", headers=headers)
+	assert res.get_json() == stored[2:4]
+
+	print("--- A new exercise can be used at once ---")
+	res = test_client.post('/exercises/', data={'name': 'Front squat'}, headers=headers)
+	exercise_id = res.get_json()['id']
+	res = test_client.post('/sets/1', data={'exercise_id': exercise_id, 'weight': 100, 'reps': 5}, headers=headers)
+	assert res.status_code == 201
+	res = test_client.get(f'/analytics/users/1/exercises/{exercise_id}/findpr', headers=headers)
+	assert res.status_code == 200
+
+	print("--- Another worker's catalogue follows the version stamp ---")
+	catalogue = ExerciseCatalogue(check_interval=60)
+	statements = []
+	with app.test_request_context():
+		listen = lambda *args: statements.append(args[2])
+		event.listen(session.get_bind(), 'before_cursor_execute', listen)
+		try:
+			assert catalogue.get(exercise_id).name == 'Front squat'
+			loaded = len(statements)
+			assert loaded > 0
+			# Hits within the check interval need no database round trip
+			assert catalogue.get(1) is not None
+			assert catalogue.existing([1, 2, exercise_id]) == {1, 2, exercise_id}
+			assert len(statements) == loaded
+
+			# Added by another worker: the miss reads the stamp and reloads
+			new_exercise = Exercise(name='Good morning')
+			session.add(new_exercise)
+			bump_version(EXERCISES)
+			session.flush()
+			assert catalogue.get(new_exercise.id).name == 'Good morning'
+			assert catalogue.names()['good morning'] == new_exercise.id
+
+			# Deleted by another worker: seen at the next check of the stamp
+			session.delete(new_exercise)
+			bump_version(EXERCISES)
+			session.flush()
+			catalogue.invalidate()
+			assert catalogue.get(new_exercise.id) is None
+		finally:
+			event.remove(session.get_bind(), 'before_cursor_execute', listen)
+
+	print("--- A stamp is inserted by its first bump and incremented in place after ---")
+	bump_version('new stamp')
+	bump_version('new stamp')
+	assert stored_version('new stamp') == 2
+
+	res = test_client.post('/sets/1', data={'exercise_id': 999, 'weight': 100, 'reps': 5}, headers=headers)
+	assert res.status_code == 404
+
+
+def test_admission_control(test_client, app, session, monkeypatch):
+	"""
+	Test that writes are rate limited per user, analytics concurrency is bounded and a saturated pool sheds load
+	"""
+
+	headers = {
+		'X-User-ID': 1,
+		'X-User-Role': 'user'
+	}
+
+	print("\n--- Limiting the writes of a user ---")
+	limiter = RateLimiter(rate=0.5, burst=2)
+	for name in ('sets', 'batch'):
+		monkeypatch.setattr(admission[name], 'rate_limiter', limiter)
+	for _ in range(2):
+		res = test_client.post('/sets/1', data={'exercise_id': 1, 'weight': 100, 'reps': 5}, headers=headers)
+		assert res.status_code == 201
+	res = test_client.post('/sets/1', data={'exercise_id': 1, 'weight': 100, 'reps': 5}, headers=headers)
+	assert res.status_code == 429
+	assert res.headers['Retry-After'] == '2'
+	# Reads and other users are not limited
+	assert test_client.get('/sets/1', headers=headers).status_code == 200
+	res = test_client.post('/sets/1', data={'exercise_id': 1, 'weight': 100, 'reps': 5},
+	                       headers={'X-User-ID': 2, 'X-User-Role': 'admin'})
+	assert res.status_code == 201
+
+	print("--- A batch is charged per operation, from the same bucket as the other writes ---")
+	admin_headers = {'X-User-ID': 3, 'X-User-Role': 'admin'}
+	operations = [{'op': 'add_set', 'args': {'workout_id': 1, 'exercise_id': 1, 'weight': 100, 'reps': 5}}] * 3
+	assert test_client.post('/batch', json={'operations': operations}, headers=admin_headers).status_code == 200
+	res = test_client.post('/sets/1', data={'exercise_id': 1, 'weight': 100, 'reps': 5}, headers=admin_headers)
+	assert res.status_code == 429
+	assert res.headers['Retry-After'] == '4'
+
+	print("--- Bounding the analytics requests in progress ---")
+	concurrency = admission['analytics'].concurrency
+	for _ in range(concurrency.limit):
+		assert concurrency.acquire()
+	try:
+		res = test_client.get('/analytics/users/1/exercises/1/findpr', headers=headers)
+		assert res.status_code == 503
+		assert 'Retry-After' in res.headers
+		assert test_client.get('/workouts/1/get', headers=headers).status_code == 200
+	finally:
+		for _ in range(concurrency.limit):
+			concurrency.release()
+	assert test_client.get('/analytics/users/1/exercises/1/findpr', headers=headers).status_code == 200
+
+	print("--- Shedding load while connection checkouts wait ---")
+	monkeypatch.setattr(admission['workouts'], 'pool_wait', lambda: 5.0)
+	res = test_client.get('/workouts/1/get', headers=headers)
+	assert res.status_code == 503
+	assert res.headers['Retry-After'] == '1'
+	res = test_client.get('/admin/pool', headers={'X-User-ID': 1, 'X-User-Role': 'admin'})
+	assert res.status_code == 200
+	assert res.get_json()['waiting'] == 0
+
+	res = test_client.get('/metrics', headers={'X-User-ID': 1, 'X-User-Role': 'admin'})
+	for reason in ('write_rate', 'concurrency', 'pool_wait'):
+		assert f'reason="{reason}"' in res.get_data(as_text=True)
+
+
+def test_pool_wait_decays():
+	"""
+	Test that the current pool wait covers checkouts in progress and fades once nothing waits
+	"""
+	stats = PoolStats()
+	assert stats.current_wait() == 0.0
+	ticket = stats.start_wait()
+	time.sleep(0.05)
+	assert stats.current_wait() >= 0.05
+	stats.end_wait(ticket)
+	stats.record(4.0)
+	assert 3.9 < stats.current_wait() <= 4.0
+	stats._recent_at -= RECENT_WAIT_HALF_LIFE
+	assert 1.9 < stats.current_wait() <= 2.0
+
+
+def test_migrations():
+	"""
+	Test that migrations create an empty database, upgrade a baseline one and only apply pending steps
+	"""
+
+	def quiet(message):
+		pass
+
+	print("\n--- Migrating an empty database ---")
+	engine = create_engine('sqlite://')
+	assert migrate(engine, log=quiet) == [m.version for m in MIGRATIONS]
+	with engine.connect() as connection:
+		assert pending_migrations(connection) == []
+	assert migrate(engine, log=quiet) == []
+
+	print("--- Migrating a database created before versioning ---")
+	engine = create_engine('sqlite://')
+	for name in ('user', 'exercise', 'workout', 'set'):
+		db.metadata.tables[name].create(engine)
+	with engine.begin() as connection:
+		connection.execute(insert(User.__table__).values(id=1, first_name='Baseline', enabled=1))
+		connection.execute(insert(Exercise.__table__).values(id=1, name='Squat'))
+		connection.execute(insert(Workout.__table__).values(id=1, user_id=1, workout_date=date(2024, 1, 1)))
+		connection.execute(insert(Set.__table__), [
+			{'id': 1, 'workout_id': 1, 'exercise_id': 1, 'weight': 100.0, 'reps': 5},
+			{'id': 2, 'workout_id': 1, 'exercise_id': 1, 'weight': 110.0, 'reps': 3},
+		])
+	assert migrate(engine, log=quiet) == ['1.1.0', '1.2.0', '1.3.0', '1.4.0', '1.5.0']
+	tables = inspect(engine).get_table_names()
+	assert {'schema_version', 'personal_record', 'rep_record', 'cache_version', 'volume_rollup',
+	        'workout_summary'} <= set(tables)
+	with engine.connect() as connection:
+		assert applied_versions(connection) == {m.version for m in MIGRATIONS}
+
+		print("--- The records and summaries of the existing history are stored ---")
+		record = connection.execute(text("SELECT max_weight, max_weight_set_id FROM personal_record")).one()
+		assert tuple(record) == (110.0, 2)
+		rep_records = connection.execute(text("SELECT weight, reps, set_id FROM rep_record ORDER BY weight")).all()
+		assert [tuple(row) for row in rep_records] == [(100.0, 5, 1), (110.0, 3, 2)]
+		summary = connection.execute(text("SELECT set_count, tonnage, top_set_id FROM workout_summary")).one()
+		assert tuple(summary) == (2, 830.0, 2)
+
+
+def test_read_replicas(tmp_path):
+	"""
+	Test that read-only requests read from a current replica, and writes and the reads after them from the primary
+	"""
+	print("\n--- Configuring an app with a primary and a replica SQLite file ---")
+	replica_app = Flask('replicas')
+	replica_app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'primary.db'}"
+	init_replicas(replica_app, [f"sqlite:///{tmp_path / 'replica.db'}"])
+	# An extension of its own with the same tables, the fixtures bind db.session to the main database
+	replica_db = SQLAlchemy(metadata=db.metadata, session_options={'class_': RoutingSession})
+	replica_db.init_app(replica_app)
+
+	@replica_app.route('/users/<int:user_id>')
+	@read_only
+	def get_first_name(user_id):
+		return {'first_name': replica_db.session.query(User.first_name).filter_by(id=user_id).scalar()}
+
+	@replica_app.route('/users/<int:user_id>/exercises', methods=['POST'])
+	@read_only
+	def add_exercise(user_id):
+		before = replica_db.session.query(User.first_name).filter_by(id=user_id).scalar()
+		replica_db.session.add(Exercise(name='Curl'))
+		replica_db.session.flush()
+		after = replica_db.session.query(User.first_name).filter_by(id=user_id).scalar()
+		replica_db.session.rollback()
+		return {'before': before, 'after': after}
+
+	# The same user has a different name in each database, so the answer shows where it was read
+	with replica_app.app_context():
+		for bind_key, first_name in ((None, 'Primary'), ('replica_0', 'Replica')):
+			engine = replica_db.engines[bind_key]
+			db.metadata.create_all(engine)
+			with engine.begin() as connection:
+				connection.execute(insert(User.__table__).values(id=1, first_name=first_name, enabled=1))
+	client = replica_app.test_client()
+
+	print("--- Reading from the replica ---")
+	assert client.get('/users/1').get_json()['first_name'] == 'Replica'
+
+	print("--- Reading after a write in the same request ---")
+	assert client.post('/users/1/exercises').get_json() == {'before': 'Replica', 'after': 'Primary'}
+
+	print("--- Falling back to the primary when the replica lags or is down ---")
+	replica_app.extensions['replica_router'] = ReplicaRouter(['replica_0'], max_lag=5, lag=lambda connection: 60.0)
+	assert client.get('/users/1').get_json()['first_name'] == 'Primary'
+
+	def unreachable(connection):
+		raise ConnectionError("replica is down")
+
+	replica_app.extensions['replica_router'] = ReplicaRouter(['replica_0'], lag=unreachable)
+	assert client.get('/users/1').get_json()['first_name'] == 'Primary'
+
+
+def test_cached_reads_after_a_write_use_the_primary(test_client, app, seed_database, tmp_path, monkeypatch):
+	"""
+	Test that a cached GET right after a write reads the primary, not a replica that lacks the write
+	"""
+	print("\n--- Adding a replica that never receives the writes ---")
+	replica = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+	db.metadata.create_all(replica)
+	with app.app_context():
+		users = [dict(row._mapping) for row in db.session.execute(select(User.__table__))]
+	with replica.begin() as connection:
+		connection.execute(insert(User.__table__), users)
+
+	class LaggingRouter:
+		def choose(self, engines):
+			return replica
+
+	monkeypatch.setitem(app.extensions, 'replica_router', LaggingRouter())
+	with app.test_request_context():
+		use_replica()
+		assert db.session.execute(select(Workout.id)).all() == []
+		db.session.remove()
+
+	headers = {
+		'X-User-ID': 1,
+		'X-User-Role': 'user'
+	}
+	workout_id = None
+	try:
+		print("--- Listing the workouts right after adding one ---")
+		res = test_client.post('/workouts/1/add', data={'workout_date': '2025-09-02 18:00:00'}, headers=headers)
+		assert res.status_code == 201
+		workout_id = res.get_json()['id']
+		res = test_client.get('/workouts/1/get', headers=headers)
+		assert res.status_code == 200
+		assert workout_id in [w['id'] for w in res.get_json()]
+	finally:
+		with app.app_context():
+			if workout_id is not None:
+				WorkoutSummary.query.filter_by(workout_id=workout_id).delete()
+				Workout.query.filter_by(id=workout_id).delete()
+				db.session.commit()
+		response_cache.clear()
+		user_status_cache.clear()
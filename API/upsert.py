@@ -0,0 +1,21 @@
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from models import db
+
+
+def upsert(model, values, update=None):
+	"""
+	Returns an INSERT of one row that applies update, a dict of column name -> expression, to the
+	row instead if its primary key exists. Without update an existing row is left as it is.
+	Unlike a SELECT followed by an INSERT, two requests inserting the same key do not both insert it.
+	"""
+	dialect = db.session.get_bind().dialect.name
+	keys = [column.name for column in model.__table__.primary_key]
+	if dialect == 'mysql':
+		# MySQL has no DO NOTHING, assigning a key column to itself changes nothing
+		return mysql.insert(model).values(**values).on_duplicate_key_update(update or {keys[0]: model.__table__.c[keys[0]]})
+	if dialect in ('sqlite', 'postgresql'):
+		statement = (sqlite.insert if dialect == 'sqlite' else postgresql.insert)(model).values(**values)
+		if update:
+			return statement.on_conflict_do_update(index_elements=keys, set_=update)
+		return statement.on_conflict_do_nothing(index_elements=keys)
+	raise NotImplementedError(f"Upserts are not supported on {dialect}")
@@ -0,0 +1,27 @@
+from models import db, CacheVersion
+from upsert import upsert
+
+
+def stored_version(name):
+	"""
+	Returns the version stamp of cached data, 0 if it was never bumped.
+	"""
+	return db.session.query(CacheVersion.version).filter_by(name=name).scalar() or 0
+
+
+def stored_versions(names):
+	"""
+	Returns the version stamps of several names in order, in one query. A name that was never bumped is 0.
+	"""
+	if not names:
+		return ()
+	versions = dict(db.session.query(CacheVersion.name, CacheVersion.version).filter(CacheVersion.name.in_(names)))
+	return tuple(versions.get(name, 0) for name in names)
+
+
+def bump_version(name):
+	"""
+	Increments a version stamp in the current transaction, other workers see it once it commits.
+	The first bump inserts the stamp; it is one upsert, so two first bumps do not both insert it.
+	"""
+	db.session.execute(upsert(CacheVersion, {'name': name, 'version': 1}, {'version': CacheVersion.version + 1}))
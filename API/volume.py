@@ -0,0 +1,317 @@
+from datetime import date, timedelta
+from sqlalchemy import cast, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.types import Date
+from models import db, Workout, Set, VolumeRollup
+from replica import use_primary
+from upsert import upsert
+
+
+PERIODS = ('week', 'month')
+TOTAL = 'total'
+TOTAL_START = date(1970, 1, 1)
+
+
+class week_start(FunctionElement):
+	"""
+	SQL expression for the Monday of the week of a datetime.
+	"""
+	type = Date()
+	inherit_cache = True
+	name = 'week_start'
+
+
+class month_start(FunctionElement):
+	"""
+	SQL expression for the first day of the month of a datetime.
+	"""
+	type = Date()
+	inherit_cache = True
+	name = 'month_start'
+
+
+@compiles(week_start, 'mysql')
+def _week_start_mysql(element, compiler, **kw):
+	column, = element.clauses
+	return compiler.process(func.date(func.subdate(column, func.weekday(column))), **kw)
+
+
+@compiles(month_start, 'mysql')
+def _month_start_mysql(element, compiler, **kw):
+	column, = element.clauses
+	return compiler.process(func.date(func.date_format(column, '%Y-%m-01')), **kw)
+
+
+@compiles(week_start, 'sqlite')
+def _week_start_sqlite(element, compiler, **kw):
+	column, = element.clauses
+	return compiler.process(func.date(column, 'weekday 0', '-6 days'), **kw)
+
+
+@compiles(month_start, 'sqlite')
+def _month_start_sqlite(element, compiler, **kw):
+	column, = element.clauses
+	return compiler.process(func.date(column, 'start of month'), **kw)
+
+
+@compiles(week_start)
+@compiles(month_start)
+def _period_start_default(element, compiler, **kw):
+	column, = element.clauses
+	period = 'week' if isinstance(element, week_start) else 'month'
+	return compiler.process(cast(func.date_trunc(period, column), Date()), **kw)
+
+
+PERIOD_STARTS = {'week': week_start, 'month': month_start}
+
+
+def bucket_start(period, day):
+	"""
+	Returns the period_start of the bucket a date falls into.
+	"""
+	if period == TOTAL:
+		return TOTAL_START
+	if period == 'week':
+		return day - timedelta(days=day.weekday())
+	return day.replace(day=1)
+
+
+def _bucket_end(period, start):
+	if period == 'week':
+		return start + timedelta(days=7)
+	return (start + timedelta(days=32)).replace(day=1)
+
+
+def _buckets(workout_date):
+	day = workout_date.date()
+	return [(period, bucket_start(period, day)) for period in PERIODS + (TOTAL,)]
+
+
+def _query_bucket_sets(user_id, exercise_id, period, start):
+	query = db.session.query(Set.id, Set.weight, Set.reps).join(Workout, Set.workout_id == Workout.id) \
+		.filter(Workout.user_id == user_id, Set.exercise_id == exercise_id)
+	if period != TOTAL:
+		query = query.filter(Workout.workout_date >= start, Workout.workout_date < _bucket_end(period, start))
+	return query
+
+
+def top_set_order():
+	"""
+	Returns the ORDER BY of the top set: the heaviest, then the one with the most reps, then the first logged.
+	"""
+	return Set.weight.desc(), Set.reps.desc(), Set.id
+
+
+def is_better_top_set(weight, reps, set_id, row):
+	"""
+	Returns whether a set beats the top set of a rollup or summary row, in the order of top_set_order.
+	"""
+	if weight is None:
+		return False
+	if row.top_set_id is None:
+		return True
+	return (weight, reps or 0, -set_id) > (row.top_weight, row.top_reps or 0, -row.top_set_id)
+
+
+def build_volume(user_id, exercise_id):
+	"""
+	Computes the rollups of a user's exercise from the full set history, with one GROUP BY
+	query per period for the totals and a window function for the top sets.
+	"""
+	# Stored rollups must not be computed from a lagging replica
+	use_primary()
+	VolumeRollup.query.filter_by(user_id=user_id, exercise_id=exercise_id).delete()
+
+	rows = {}
+	for period in PERIODS + (TOTAL,):
+		bucket = PERIOD_STARTS[period](Workout.workout_date) if period != TOTAL else func.date(TOTAL_START)
+		base = select(Set.id, Set.weight, Set.reps, bucket.label('bucket')) \
+			.join(Workout, Set.workout_id == Workout.id) \
+			.where(Workout.user_id == user_id, Set.exercise_id == exercise_id) \
+			.subquery()
+
+		totals = db.session.execute(
+			select(base.c.bucket, func.count(base.c.id), func.sum(base.c.reps),
+			       func.sum(base.c.weight * base.c.reps))
+			.group_by(base.c.bucket)
+		)
+		for start, set_count, rep_count, tonnage in totals:
+			start = start if period != TOTAL else TOTAL_START
+			rows[period, start] = VolumeRollup(user_id=user_id, exercise_id=exercise_id, period=period,
+			                                   period_start=start, set_count=set_count,
+			                                   rep_count=rep_count or 0, tonnage=tonnage or 0.0)
+
+		rank = func.row_number().over(
+			partition_by=base.c.bucket,
+			order_by=(base.c.weight.desc(), base.c.reps.desc(), base.c.id)
+		)
+		ranked = select(base.c.bucket, base.c.id, base.c.weight, base.c.reps, rank.label('rn')) \
+			.where(base.c.weight.isnot(None)) \
+			.subquery()
+		for start, set_id, weight, reps in db.session.execute(
+				select(ranked.c.bucket, ranked.c.id, ranked.c.weight, ranked.c.reps).where(ranked.c.rn == 1)):
+			row = rows[period, start if period != TOTAL else TOTAL_START]
+			row.top_set_id, row.top_weight, row.top_reps = set_id, weight, reps
+
+	# The total row is kept even without sets, it marks the rollups of the exercise as built
+	if (TOTAL, TOTAL_START) not in rows:
+		rows[TOTAL, TOTAL_START] = VolumeRollup(user_id=user_id, exercise_id=exercise_id, period=TOTAL,
+		                                        period_start=TOTAL_START, set_count=0, rep_count=0, tonnage=0.0)
+	db.session.add_all(rows.values())
+
+
+def _is_built(user_id, exercise_id):
+	return db.session.get(VolumeRollup, (user_id, exercise_id, TOTAL, TOTAL_START)) is not None
+
+
+def get_volume(user_id, exercise_id, period, start=None, end=None):
+	"""
+	Returns the rollups of a user's exercise for one period, oldest first, optionally limited
+	to buckets starting between start and end. The rollups are built on the first lookup.
+	"""
+	if not _is_built(user_id, exercise_id):
+		try:
+			build_volume(user_id, exercise_id)
+			db.session.commit()
+		except IntegrityError:
+			# Another request built them first
+			db.session.rollback()
+
+	query = VolumeRollup.query.filter_by(user_id=user_id, exercise_id=exercise_id, period=period)
+	if start is not None:
+		query = query.filter(VolumeRollup.period_start >= bucket_start(period, start))
+	if end is not None:
+		query = query.filter(VolumeRollup.period_start <= end)
+	return query.order_by(VolumeRollup.period_start).all()
+
+
+def _locked_rollup(user_id, exercise_id, period, start):
+	# Locked until the transaction ends, so concurrent writes to one bucket do not lose counts.
+	# Loaded again even if the session has it, the lock must come with the latest values.
+	return db.session.get(VolumeRollup, (user_id, exercise_id, period, start), with_for_update=True,
+	                      populate_existing=True)
+
+
+def _refresh_top(row):
+	# The row must be locked, see _locked_rollup
+	top = _query_bucket_sets(row.user_id, row.exercise_id, row.period, row.period_start) \
+		.filter(Set.weight.isnot(None)) \
+		.order_by(*top_set_order()) \
+		.first()
+	row.top_set_id, row.top_weight, row.top_reps = (top.id, top.weight, top.reps) if top else (None, None, None)
+
+
+def _contribution(weight, reps):
+	return (reps or 0), (weight or 0.0) * (reps or 0)
+
+
+def add_sets_to_volume(user_id, sets):
+	"""
+	Adds new sets of a user, as (workout_date, set) pairs, to the rollups of their weeks, months and totals.
+	Each rollup row is locked and written once for all the sets. The sets must be flushed so that they have IDs.
+	"""
+	built = {}
+	buckets = {}
+	for workout_date, set_record in sets:
+		exercise_id = set_record.exercise_id
+		if exercise_id not in built:
+			built[exercise_id] = _is_built(user_id, exercise_id)
+		if built[exercise_id]:
+			for period, start in _buckets(workout_date):
+				buckets.setdefault((exercise_id, period, start), []).append(set_record)
+
+	# In key order, so that concurrent requests lock the rows in the same order
+	for (exercise_id, period, start), bucket_sets in sorted(buckets.items()):
+		# A new week or month is inserted empty first, a locking read of a missing row only
+		# takes a gap lock and would let two requests insert it
+		db.session.execute(upsert(VolumeRollup, {'user_id': user_id, 'exercise_id': exercise_id, 'period': period,
+		                                         'period_start': start, 'set_count': 0, 'rep_count': 0,
+		                                         'tonnage': 0.0}))
+		row = _locked_rollup(user_id, exercise_id, period, start)
+		for set_record in bucket_sets:
+			reps, tonnage = _contribution(set_record.weight, set_record.reps)
+			row.set_count += 1
+			row.rep_count += reps
+			row.tonnage += tonnage
+			if is_better_top_set(set_record.weight, set_record.reps, set_record.id, row):
+				row.top_set_id, row.top_weight, row.top_reps = set_record.id, set_record.weight, set_record.reps
+
+
+def add_set_to_volume(user_id, workout_date, set_record):
+	"""
+	Adds a new set to the rollups of its week, month and total.
+	The set must be flushed so that it has an ID.
+	"""
+	add_sets_to_volume(user_id, [(workout_date, set_record)])
+
+
+def change_set_in_volume(user_id, workout_date, set_record, old_weight, old_reps):
+	"""
+	Updates the rollups after the weight or reps of a set changed.
+	The top set is looked up again only if the changed set was the top set and got lighter.
+	"""
+	if not _is_built(user_id, set_record.exercise_id):
+		return
+
+	old_reps_count, old_tonnage = _contribution(old_weight, old_reps)
+	reps, tonnage = _contribution(set_record.weight, set_record.reps)
+	lighter = set_record.weight is None or \
+		(set_record.weight, set_record.reps or 0) < (old_weight, old_reps or 0)
+	for period, start in _buckets(workout_date):
+		row = _locked_rollup(user_id, set_record.exercise_id, period, start)
+		if row is None:
+			continue
+		row.rep_count += reps - old_reps_count
+		row.tonnage += tonnage - old_tonnage
+		if row.top_set_id == set_record.id and lighter:
+			_refresh_top(row)
+		elif row.top_set_id == set_record.id:
+			row.top_weight, row.top_reps = set_record.weight, set_record.reps
+		elif is_better_top_set(set_record.weight, set_record.reps, set_record.id, row):
+			row.top_set_id, row.top_weight, row.top_reps = set_record.id, set_record.weight, set_record.reps
+
+
+def remove_sets_from_volume(user_id, workout_date, sets):
+	"""
+	Takes deleted sets, as (id, exercise_id, weight, reps) rows of one workout, out of the rollups.
+	Empty weeks and months are dropped; the top set is looked up again only if it was deleted.
+	"""
+	by_exercise = {}
+	for row in sets:
+		by_exercise.setdefault(row[1], []).append(row)
+
+	for exercise_id, exercise_sets in sorted(by_exercise.items()):
+		if not _is_built(user_id, exercise_id):
+			continue
+
+		for period, start in _buckets(workout_date):
+			row = _locked_rollup(user_id, exercise_id, period, start)
+			if row is None:
+				continue
+			removed_top = False
+			for set_id, _, weight, reps in exercise_sets:
+				rep_count, tonnage = _contribution(weight, reps)
+				row.set_count -= 1
+				row.rep_count -= rep_count
+				row.tonnage -= tonnage
+				removed_top = removed_top or row.top_set_id == set_id
+
+			if row.set_count <= 0 and period != TOTAL:
+				db.session.delete(row)
+				continue
+			if row.set_count <= 0:
+				row.set_count, row.rep_count, row.tonnage = 0, 0, 0.0
+			if removed_top:
+				_refresh_top(row)
+
+
+def invalidate_volume(user_id, exercise_ids):
+	"""
+	Drops the rollups of a user's exercises, get_volume rebuilds them on the next lookup.
+	"""
+	VolumeRollup.query.filter(
+		VolumeRollup.user_id == user_id,
+		VolumeRollup.exercise_id.in_(exercise_ids)
+	).delete(synchronize_session=False)
@@ -5,6 +5,11 @@ use `lifting_db`;
 -- ==========================
 START TRANSACTION;
 SET FOREIGN_KEY_CHECKS = 0;
+TRUNCATE TABLE `cache_version`;
+TRUNCATE TABLE `workout_summary`;
+TRUNCATE TABLE `volume_rollup`;
+TRUNCATE TABLE `rep_record`;
+TRUNCATE TABLE `personal_record`;
 TRUNCATE TABLE `set`;
 TRUNCATE TABLE `workout`;
 TRUNCATE TABLE `exercise`;
@@ -17,7 +22,12 @@ COMMIT;
 START TRANSACTION;
 INSERT INTO `schema_version` VALUES
 (1, '1.0.0', '2025-08-27 20:26:29', 'Initial schema creation with exercise, set, workout tables'),
-(2, '1.0.1', '2025-08-28 09:26:29', 'Added user table');
+(2, '1.0.1', '2025-08-28 09:26:29', 'Added user table'),
+(3, '1.1.0', '2025-09-15 20:00:00', 'Added personal_record and rep_record tables'),
+(4, '1.2.0', '2025-09-15 20:00:00', 'Replaced foreign key indexes with composite indexes for history queries'),
+(5, '1.3.0', '2025-09-18 20:00:00', 'Added cache_version table'),
+(6, '1.4.0', '2025-09-22 20:00:00', 'Added volume_rollup table'),
+(7, '1.5.0', '2025-09-29 20:00:00', 'Added workout_summary table');
 COMMIT;
 
 START TRANSACTION;
@@ -10,6 +10,11 @@ USE `lifting_db`;
 -- Drop existing tables safely
 -- ===========================================
 START TRANSACTION;
+DROP TABLE IF EXISTS `cache_version`;
+DROP TABLE IF EXISTS `workout_summary`;
+DROP TABLE IF EXISTS `volume_rollup`;
+DROP TABLE IF EXISTS `rep_record`;
+DROP TABLE IF EXISTS `personal_record`;
 DROP TABLE IF EXISTS `set`;
 DROP TABLE IF EXISTS `workout`;
 DROP TABLE IF EXISTS `exercise`;
@@ -73,11 +78,11 @@ CREATE TABLE IF NOT EXISTS `workout` (
   `comment` VARCHAR(245) DEFAULT NULL,
   `user_id` INT NOT NULL,
   PRIMARY KEY (`id`),
-  KEY `fk_workout_user` (`user_id`),
+  KEY `ix_workout_user_date` (`user_id`, `workout_date`),
   CONSTRAINT `fk_workout_user` FOREIGN KEY (`user_id`) REFERENCES `user` (`id`) ON DELETE CASCADE ON UPDATE CASCADE
 );
 COMMIT;
--- Commit message: Created workout table with foreign key to user
+-- Commit message: Created workout table with foreign key to user, indexed for per-user date ranges
 
 -- ===========================================
 -- Create set table
@@ -91,10 +96,98 @@ CREATE TABLE IF NOT EXISTS `set` (
   `comment` VARCHAR(245) DEFAULT NULL,
   `workout_id` INT NOT NULL,
   PRIMARY KEY (`id`),
-  KEY `fk_set_exercise` (`exercise_id`),
+  KEY `ix_set_exercise_workout_weight` (`exercise_id`, `workout_id`, `weight`, `reps`),
   KEY `fk_set_workout` (`workout_id`),
   CONSTRAINT `fk_set_exercise` FOREIGN KEY (`exercise_id`) REFERENCES `exercise` (`id`) ON DELETE CASCADE ON UPDATE CASCADE,
   CONSTRAINT `fk_set_workout` FOREIGN KEY (`workout_id`) REFERENCES `workout` (`id`) ON DELETE CASCADE ON UPDATE CASCADE
 );
 COMMIT;
--- Commit message: Created set table with foreign keys to exercise and workout
+-- Commit message: Created set table with foreign keys to exercise and workout, and a covering index for PR lookups
+
+-- ===========================================
+-- Create personal_record table
+-- ===========================================
+START TRANSACTION;
+CREATE TABLE IF NOT EXISTS `personal_record` (
+  `user_id` INT NOT NULL,
+  `exercise_id` INT NOT NULL,
+  `max_weight` FLOAT DEFAULT NULL,
+  `max_weight_set_id` INT DEFAULT NULL,
+  `best_one_rep_max` FLOAT DEFAULT NULL,
+  `best_one_rep_max_set_id` INT DEFAULT NULL,
+  PRIMARY KEY (`user_id`, `exercise_id`),
+  KEY `fk_personal_record_exercise` (`exercise_id`),
+  CONSTRAINT `fk_personal_record_user` FOREIGN KEY (`user_id`) REFERENCES `user` (`id`) ON DELETE CASCADE ON UPDATE CASCADE,
+  CONSTRAINT `fk_personal_record_exercise` FOREIGN KEY (`exercise_id`) REFERENCES `exercise` (`id`) ON DELETE CASCADE ON UPDATE CASCADE
+);
+COMMIT;
+-- Commit message: Created personal_record table, maintained by the API on every set change
+
+-- ===========================================
+-- Create rep_record table
+-- ===========================================
+START TRANSACTION;
+CREATE TABLE IF NOT EXISTS `rep_record` (
+  `user_id` INT NOT NULL,
+  `exercise_id` INT NOT NULL,
+  `weight` DOUBLE NOT NULL,
+  `reps` INT NOT NULL,
+  `set_id` INT NOT NULL,
+  PRIMARY KEY (`user_id`, `exercise_id`, `weight`),
+  KEY `fk_rep_record_exercise` (`exercise_id`),
+  CONSTRAINT `fk_rep_record_user` FOREIGN KEY (`user_id`) REFERENCES `user` (`id`) ON DELETE CASCADE ON UPDATE CASCADE,
+  CONSTRAINT `fk_rep_record_exercise` FOREIGN KEY (`exercise_id`) REFERENCES `exercise` (`id`) ON DELETE CASCADE ON UPDATE CASCADE
+);
+COMMIT;
+-- Commit message: Created rep_record table with the most reps per weight
+
+-- ===========================================
+-- Create cache_version table
+-- ====================================START TRANSACTION;
+CREATE TABLE IF NOT EXISTS `cache_version` (
+  `name` VARCHAR(45) NOT NULL,
+  `version` INT NOT NULL DEFAULT 0,
+  PRIMARY KEY (`name`)
+);
+COMMIT;
+-- Commit message: Created cache_version table with the version stamps of data the API caches per worker
+=======
+-- Create volume_rollup table
+-- ===========================================
+START TRANSACTION;
+CREATE TABLE IF NOT EXISTS `volume_rollup` (
+  `user_id` INT NOT NULL,
+  `exercise_id` INT NOT NULL,
+  `period` VARCHAR(5) NOT NULL,
+  `period_start` DATE NOT NULL,
+  `set_count` INT NOT NULL DEFAULT 0,
+  `rep_count` INT NOT NULL DEFAULT 0,
+  `tonnage` DOUBLE NOT NULL DEFAULT 0,
+  `top_set_id` INT DEFAULT NULL,
+  `top_weight` FLOAT DEFAULT NULL,
+  `top_reps` INT DEFAULT NULL,
+  PRIMARY KEY (`user_id`, `exercise_id`, `period`, `period_start`),
+  KEY `fk_volume_rollup_exercise` (`exercise_id`),
+  CONSTRAINT `fk_volume_rollup_user` FOREIGN KEY (`user_id`) REFERENCES `user` (`id`) ON DELETE CASCADE ON UPDATE CASCADE,
+  CONSTRAINT `fk_volume_rollup_exercise` FOREIGN KEY (`exercise_id`) REFERENCES `exercise` (`id`) ON DELETE CASCADE ON UPDATE CASCADE
+);
+COMMIT;
+-- Commit message: Created volume_rollup table with weekly, monthly and total volume per exercise
+
+-- ===========================================
+-- Create workout_summary table
+-- ===========================================
+START TRANSACTION;
+CREATE TABLE IF NOT EXISTS `workout_summary` (
+  `workout_id` INT NOT NULL,
+  `set_count` INT NOT NULL DEFAULT 0,
+  `tonnage` DOUBLE NOT NULL DEFAULT 0,
+  `exercise_count` INT NOT NULL DEFAULT 0,
+  `top_set_id` INT DEFAULT NULL,
+  `top_weight` FLOAT DEFAULT NULL,
+  `top_reps` INT DEFAULT NULL,
+  PRIMARY KEY (`workout_id`),
+  CONSTRAINT `fk_workout_summary_workout` FOREIGN KEY (`workout_id`) REFERENCES `workout` (`id`) ON DELETE CASCADE ON UPDATE CASCADE
+);
+COMMIT;
+-- Commit message: Created workout_summary table with the set totals of each workout
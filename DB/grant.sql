@@ -2,4 +2,6 @@ DROP USER 'lifting_app'@'localhost';
 CREATE USER 'lifting_app'@'localhost' IDENTIFIED BY 'Gr8P$ss!';
 GRANT CREATE, ALTER, DROP, REFERENCES ON `lifting-db`.* TO 'lifting_app'@'localhost';
 GRANT SELECT, INSERT, UPDATE, DELETE ON `lifting-db`.* TO 'lifting_app'@'localhost';
+-- Lets the API read the replication lag of the replicas with SHOW REPLICA STATUS
+GRANT REPLICATION CLIENT ON *.* TO 'lifting_app'@'localhost';
 FLUSH PRIVILEGES;
\ No newline at end of file